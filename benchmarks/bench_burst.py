@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+#   Burst Framing Benchmark
+#
+#   Estimates effective image throughput when sending k SSDV packets per TNC
+#   frame, for a modem with a per-frame preamble overhead and (optionally)
+#   fixed-size modem frames and a bit error rate. Longer bursts pay the
+#   preamble less often, but a lost frame takes more packets with it.
+#
+#   Also checks that an image sent in bursts is received intact by SSDVRX,
+#   and times unpacking.
+#
+#   Usage: python benchmarks/bench_burst.py [--bitrate 980] [--modem-frame 510] [--frame-overhead 0.6] [--ber 1e-5]
+#
+
+import argparse
+import logging
+import struct
+import time
+
+from hfssdv.burst import *
+from hfssdv.fec import ssdv_crc32
+from hfssdv.packets import *
+from hfssdv.pacing import frame_airtime
+from hfssdv.receive import SSDVRX, iter_responses
+
+
+def make_packets(count):
+    """ SSDV packets with valid headers, for one image """
+    _packets = []
+    for _i in range(count):
+        _packet = bytes([SSDV_HEADER, SSDV_TYPE_NOFEC]) + struct.pack('>IBHBBBBH',
+            ssdv_encode_callsign("VK5ABC"), 1, _i, 20, 15, 0, 0, 0) + bytes(SSDV_PAYLOAD_NOFEC)
+        _packets.append(_packet + struct.pack('>I', ssdv_crc32(_packet[1:])))
+    return _packets
+
+
+def throughput(packets, burst_size, bitrate, modem_frame, frame_overhead, ber):
+    """ Airtime to send the packets, and the expected image throughput (bits/s of SSDV packets delivered) """
+    _airtime = 0.0
+    _delivered = 0.0
+    for _frame, _count in burst_frames(packets, burst_size):
+        # Plus the TNC port byte.
+        _bytes = len(_frame) + 1
+        _airtime += frame_airtime(_bytes, bitrate, modem_frame, frame_overhead)
+        # The whole frame is lost if any bit in it is - padded out to whole modem frames.
+        _bits = 8 * (modem_frame * -(-_bytes // modem_frame) if modem_frame else _bytes)
+        _delivered += _count * (1.0 - ber) ** _bits
+
+    return (_airtime, _delivered * SSDV_PACKET_SIZE * 8 / _airtime)
+
+
+def check_receive(packets, burst_size):
+    """ Send the packets through SSDVRX in bursts, returning (packets received, unpack + add time) """
+    _rx = SSDVRX(max_images=None, max_bytes=None, defer_decode=True)
+    _frames = [b'\x00' + _frame for _frame, _count in burst_frames(packets, burst_size)]
+
+    _start = time.perf_counter()
+    _received = 0
+    for _frame in _frames:
+        _received += sum(1 for _resp in iter_responses(_rx.addPacket(_frame)) if _resp['type'] == 'image_update')
+    return (_received, time.perf_counter() - _start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate image throughput against the number of SSDV packets per TNC frame.")
+    parser.add_argument("--bitrate", type=float, default=980, help="Modem bitrate (bits/s). (default: 980)")
+    parser.add_argument("--modem-frame", type=int, default=510,
+        help="Modem frame payload size (bytes), 0 for none. (default: 510, FreeDV DATAC1)")
+    parser.add_argument("--frame-overhead", type=float, default=0.6, help="Preamble time per modem frame (s). (default: 0.6)")
+    parser.add_argument("--ber", type=float, default=1e-5, help="Bit error rate, after the modem's FEC. (default: 1e-5)")
+    parser.add_argument("--packets", type=int, default=300, help="Packets in the image. (default: 300)")
+    parser.add_argument("--max-k", type=int, default=8, help="Largest number of packets per frame to try. (default: 8)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    _packets = make_packets(args.packets)
+    _modem_frame = args.modem_frame or None
+
+    print(f"{'k':>3} {'Frame (B)':>10} {'Airtime (s)':>12} {'Throughput (bps)':>17} {'Received':>9} {'RX time (ms)':>13}")
+    for _k in range(1, args.max_k + 1):
+        # Room for exactly k packets.
+        _burst_size = None if _k == 1 else BURST_HEADER_SIZE + _k * (BURST_ITEM_HEADER_SIZE + SSDV_PACKET_SIZE)
+        _airtime, _throughput = throughput(_packets, _burst_size, args.bitrate, _modem_frame, args.frame_overhead, args.ber)
+        _received, _rx_time = check_receive(_packets, _burst_size)
+
+        print(f"{_k:>3} {(_burst_size or SSDV_PACKET_SIZE):>10} {_airtime:>12.1f} {_throughput:>17.1f} "
+            f"{_received:>9} {_rx_time * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
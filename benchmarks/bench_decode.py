@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+#   SSDV Decode Benchmark
+#
+#   Replays a recorded SSDV packet set (a .bin file of concatenated 256-byte
+#   packets, as produced by `ssdv -e`) one packet at a time, decoding the
+#   image after every packet - the same pattern as the receive path.
+#
+#   Compares the incremental in-process decoder, a full in-process re-decode
+#   per packet, and the `ssdv -d` subprocess path (if the ssdv binary is
+#   available). With the binary, it also checks that the in-process decoder
+#   gives the same pixels as `ssdv -d` for the whole capture.
+#
+#   Usage: python benchmarks/bench_decode.py capture.bin [--ssdv ./ssdv]
+#
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+from hfssdv.decoder import SSDVDecoder, decode_packets
+
+
+def read_packets(filename):
+    """ Read a .bin file of concatenated SSDV packets """
+    _packets = []
+    with open(filename, 'rb') as _f:
+        while True:
+            _packet = _f.read(256)
+            if len(_packet) != 256:
+                break
+            _packets.append(_packet)
+    return _packets
+
+
+def decode_native(packets, workdir):
+    return decode_packets(packets.values())
+
+
+class IncrementalDecode(object):
+    """ Feed only the newest packet to a persistent decoder, as SSDVRX does """
+
+    def __init__(self):
+        self.decoder = SSDVDecoder()
+
+    def __call__(self, packets, workdir):
+        self.decoder.add_packet(packets[len(packets) - 1])
+        return self.decoder.get_jpeg()
+
+
+def decode_subprocess(packets, workdir, ssdv_path):
+    """ The original receive path - write all packets out, and run ssdv -d """
+    _tempfile = os.path.join(workdir, 'rxtemp.bin')
+    _outfile = os.path.join(workdir, 'rxtemp.jpg')
+
+    with open(_tempfile, 'wb') as _f:
+        for _pkt in sorted(packets):
+            _f.write(packets[_pkt])
+
+    os.system(f"{ssdv_path} -d {_tempfile} {_outfile} 2>/dev/null > /dev/null")
+    return _outfile
+
+
+def check_reference(packets, ssdv_path):
+    """ Check the in-process decoder gives the same pixels as ssdv -d, for all the packets """
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as _workdir:
+        _outfile = decode_subprocess(dict(enumerate(packets)), _workdir, ssdv_path)
+        with Image.open(_outfile) as _img:
+            _reference = _img.convert('RGB')
+
+    with Image.open(io.BytesIO(decode_packets(packets))) as _img:
+        _decoded = _img.convert('RGB')
+
+    assert _decoded.size == _reference.size, f"Decoded {_decoded.size}, ssdv -d gave {_reference.size}"
+    assert _decoded.tobytes() == _reference.tobytes(), "Decoded pixels differ from ssdv -d"
+
+
+def run(packets, decode):
+    """ Feed packets in one at a time, decoding after each. Returns per-packet decode times. """
+    _received = {}
+    _times = []
+
+    with tempfile.TemporaryDirectory() as _workdir:
+        for _i, _packet in enumerate(packets):
+            _received[_i] = _packet
+            _start = time.perf_counter()
+            decode(_received, _workdir)
+            _times.append(time.perf_counter() - _start)
+
+    return _times
+
+
+def report(name, times):
+    _times = sorted(times)
+    print(f"{name:>12}: total {sum(_times):8.3f} s, "
+        f"mean {1000*sum(_times)/len(_times):8.2f} ms, "
+        f"median {1000*_times[len(_times)//2]:8.2f} ms, "
+        f"last {1000*times[-1]:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare in-process and subprocess SSDV decoding.")
+    parser.add_argument("capture", help="SSDV .bin file (concatenated 256-byte packets)")
+    parser.add_argument("--ssdv", default="./ssdv", help="Path to the ssdv binary (default: ./ssdv)")
+    args = parser.parse_args()
+
+    _packets = read_packets(args.capture)
+    if not _packets:
+        print("No packets found.")
+        sys.exit(1)
+
+    print(f"{len(_packets)} packets, decoding after each packet.")
+
+    report("incremental", run(_packets, IncrementalDecode()))
+    report("full", run(_packets, decode_native))
+
+    if os.path.isfile(args.ssdv):
+        report("subprocess", run(_packets, lambda p, w: decode_subprocess(p, w, args.ssdv)))
+        check_reference(_packets, args.ssdv)
+        print("Decoded image matches ssdv -d.")
+    else:
+        print(f"{args.ssdv} not found, skipping subprocess comparison.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+#   Fountain Code Benchmark
+#
+#   Times encoding repair packets for, and rebuilding, a large image, then
+#   estimates how often an image arrives complete - with no resend request
+#   round trip - against the fraction of repair packets sent after it, over
+#   channels with random and burst (fading) packet loss.
+#
+#   Usage: python benchmarks/bench_fountain.py [--packets 2000] [--loss 0.05] [--trials 20]
+#
+
+import argparse
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from hfssdv.fountain import *
+
+
+def random_loss(count, loss, rng):
+    """ Which of count packets arrive, each lost independently """
+    return rng.random(count) >= loss
+
+
+def burst_loss(count, loss, rng, fade_length=20):
+    """ Which of count packets arrive, over a two-state (Gilbert-Elliott) channel which loses every packet
+        during fades averaging fade_length packets, with the same average loss rate
+    """
+    _p_end = 1.0 / fade_length
+    _p_start = _p_end * loss / (1.0 - loss)
+
+    _arrived = np.ones(count, dtype=bool)
+    _fading = rng.random() < loss
+    _draws = rng.random(count)
+    for _i in range(count):
+        _fading = (_draws[_i] >= _p_end) if _fading else (_draws[_i] < _p_start)
+        _arrived[_i] = not _fading
+    return _arrived
+
+
+def send(packets, source, overhead, channel, loss, rng):
+    """ Send an image and ceil(K * overhead) repair packets over a channel. Returns True if it could be rebuilt. """
+    _count = len(packets)
+    _repair_count = math.ceil(_count * overhead)
+    _arrived = channel(_count + _repair_count, loss, rng)
+
+    _known = _arrived[:_count]
+    if _known.all():
+        return True
+
+    _seed = int(rng.integers(2**32))
+    _seeds = [(_seed + _i) % 2**32 for _i in np.flatnonzero(_arrived[_count:])]
+    _decoder = FountainDecoder(_count)
+    for _seed, _payload in zip(_seeds, xor_combine(repair_matrix(_seeds, _count), source)):
+        _decoder.add(_seed, _payload.tobytes())
+
+    _rebuilt = np.zeros_like(source)
+    _rebuilt[_known] = source[_known]
+    if not _decoder.decode(_known, _rebuilt):
+        return False
+    return bool((_rebuilt == source).all())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fountain-coded repair packets.")
+    parser.add_argument("--packets", type=int, default=2000, help="Packets in the image, K. (default: 2000)")
+    parser.add_argument("--loss", type=float, default=0.05, help="Average packet loss rate. (default: 0.05)")
+    parser.add_argument("--fade-length", type=float, default=20, help="Mean fade length, in packets, for burst loss. (default: 20)")
+    parser.add_argument("--overheads", default="0,0.05,0.1,0.15,0.2",
+        help="Repair packets to send, as fractions of K. (default: 0,0.05,0.1,0.15,0.2)")
+    parser.add_argument("--trials", type=int, default=20, help="Images to send per overhead and channel. (default: 20)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    _rng = np.random.default_rng(1)
+    _packets = [os.urandom(SSDV_PACKET_SIZE) for _i in range(args.packets)]
+    _source = packet_array(_packets)
+
+    # Speed, losing a range of fractions of the image.
+    print(f"{'Lost':>6} {'Repair packets':>15} {'Encode (s)':>11} {'Decode (s)':>11} {'Rebuilt':>8}")
+    for _lost in (0.01, 0.05, 0.2, 0.5, 1.0):
+        _known = _rng.random(args.packets) >= _lost
+        _missing = args.packets - np.count_nonzero(_known)
+        _seeds = list(range(_missing + 8))
+
+        _start = time.perf_counter()
+        _repair = encode_repair_packets(_packets, "VK5ABC", 0, _seeds)
+        _encode_time = time.perf_counter() - _start
+
+        _decoder = FountainDecoder(args.packets)
+        for _packet in _repair:
+            _info = fountain_packet_info(_packet)
+            _decoder.add(_info['seed'], _info['payload'])
+
+        _rebuilt = np.zeros_like(_source)
+        _rebuilt[_known] = _source[_known]
+        _start = time.perf_counter()
+        _ids = _decoder.decode(_known, _rebuilt)
+        _decode_time = time.perf_counter() - _start
+
+        _ok = len(_ids) == _missing and (_rebuilt == _source).all()
+        print(f"{_lost:>6.0%} {len(_repair):>15} {_encode_time:>11.3f} {_decode_time:>11.3f} {'yes' if _ok else 'NO':>8}")
+
+    # Chance of a complete image without a resend request.
+    print()
+    print(f"{'Overhead':>9} {'Random loss':>12} {'Burst loss':>11}")
+    _burst = lambda _count, _loss, _rng: burst_loss(_count, _loss, _rng, args.fade_length)
+    for _overhead in map(float, args.overheads.split(",")):
+        _random_ok = sum(send(_packets, _source, _overhead, random_loss, args.loss, _rng) for _i in range(args.trials))
+        _burst_ok = sum(send(_packets, _source, _overhead, _burst, args.loss, _rng) for _i in range(args.trials))
+        print(f"{_overhead:>9.0%} {_random_ok / args.trials:>12.0%} {_burst_ok / args.trials:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+#   SSDV Header Parsing Benchmark
+#
+#   Compares per-packet ssdv_packet_info against batch parsing with
+#   ssdv_packet_headers, and times SSDVRX.importPackets, on a synthetic
+#   capture of many images.
+#
+#   Usage: python benchmarks/bench_headers.py [--packets 100000]
+#
+
+import argparse
+import logging
+import struct
+import time
+
+from hfssdv.fec import ssdv_crc32
+from hfssdv.packets import *
+from hfssdv.receive import SSDVRX
+
+
+def make_capture(packets, image_packets=300):
+    """ Concatenated SSDV packets with valid headers, from a few callsigns """
+    _packets = []
+    for _i in range(packets):
+        _image = _i // image_packets
+        _packet = bytes([SSDV_HEADER, SSDV_TYPE_NOFEC]) + struct.pack('>IBHBBBBH',
+            ssdv_encode_callsign(f"VK{_image % 4}ABC"), _image % 256, _i % image_packets, 20, 15, 0, 0, 0) \
+            + bytes(SSDV_PAYLOAD_NOFEC)
+        _packets.append(_packet + struct.pack('>I', ssdv_crc32(_packet[1:])))
+    return b''.join(_packets)
+
+
+def timed(func, *args):
+    _start = time.perf_counter()
+    _result = func(*args)
+    return _result, time.perf_counter() - _start
+
+
+def per_packet(data):
+    return [ssdv_packet_info(data[_i:_i + SSDV_PACKET_SIZE]) for _i in range(0, len(data), SSDV_PACKET_SIZE)]
+
+
+def batch(data):
+    _headers = ssdv_packet_headers(data)
+    return (_headers, ssdv_decode_callsigns(_headers['callsign']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-packet and batch SSDV header parsing.")
+    parser.add_argument("--packets", type=int, default=100000, help="Packets in the capture. (default: 100000)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    _data = make_capture(args.packets)
+    print(f"{args.packets} packets ({len(_data)/1e6:.1f} MB)")
+
+    # Import numpy before timing anything.
+    batch(_data[:SSDV_PACKET_SIZE])
+
+    _, _time = timed(per_packet, _data)
+    print(f"{'ssdv_packet_info':>24}: {_time:.3f} s ({1e6*_time/args.packets:.2f} us/packet)")
+
+    _, _time = timed(batch, _data)
+    print(f"{'ssdv_packet_headers':>24}: {_time:.3f} s ({1e6*_time/args.packets:.2f} us/packet)")
+
+    _rx = SSDVRX(max_images=None, max_bytes=None, epoch_timeout=None)
+    _count, _time = timed(_rx.importPackets, _data)
+    print(f"{'importPackets':>24}: {_time:.3f} s ({1e6*_time/args.packets:.2f} us/packet, {len(_rx.image_store)} images)")
+
+
+if __name__ == "__main__":
+    main()
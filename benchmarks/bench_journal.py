@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+#   Packet Journal Benchmark
+#
+#   Writes a journal of a day's worth of synthetic SSDV traffic, then times
+#   rebuilding a SSDVRX image store from it, as happens on startup.
+#
+#   Usage: python benchmarks/bench_journal.py [--hours 24] [--delay 7] [--image-packets 300]
+#
+
+import argparse
+import logging
+import os
+import struct
+import tempfile
+import time
+
+from hfssdv.fec import ssdv_crc32
+from hfssdv.journal import PacketJournal
+from hfssdv.packets import *
+from hfssdv.receive import SSDVRX
+
+
+def make_frame(callsign, image_id, packet_id):
+    """ A KISS frame holding a SSDV packet with a valid header. The payload is not decoded during replay. """
+    _packet = bytes([SSDV_HEADER, SSDV_TYPE_NOFEC]) + struct.pack('>IBHBBBBH',
+        ssdv_encode_callsign(callsign), image_id, packet_id, 20, 15, 0, 0, 0) + bytes(SSDV_PAYLOAD_NOFEC)
+    return b'\x00' + _packet + struct.pack('>I', ssdv_crc32(_packet[1:]))
+
+
+def write_journal(filename, frames, image_packets, delay, links):
+    """ Journal 'frames' packets, from images of image_packets packets, one every 'delay' seconds """
+    _journal = PacketJournal(filename, compact_interval=None)
+    _start = time.time() - frames * delay
+
+    for _i in range(frames):
+        _image = _i // image_packets
+        _journal.append(
+            make_frame(f"VK{_image % 4}ABC", _image % 256, _i % image_packets),
+            link=_i % links,
+            timestamp=_start + _i * delay
+        )
+
+    _journal.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time rebuilding the image store from a packet journal.")
+    parser.add_argument("--hours", type=float, default=24, help="Hours of traffic to journal. (default: 24)")
+    parser.add_argument("--delay", type=float, default=7, help="Seconds between packets. (default: 7)")
+    parser.add_argument("--image-packets", type=int, default=300, help="Packets per image. (default: 300)")
+    parser.add_argument("--links", type=int, default=2, help="Number of TNC links. (default: 2)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    _frames = int(args.hours * 3600 / args.delay)
+
+    with tempfile.TemporaryDirectory() as _workdir:
+        _filename = os.path.join(_workdir, 'journal.bin')
+
+        _start = time.perf_counter()
+        write_journal(_filename, _frames, args.image_packets, args.delay, args.links)
+        _write_time = time.perf_counter() - _start
+        print(f"Journalled {_frames} frames ({os.path.getsize(_filename)/1e6:.1f} MB) in {_write_time:.3f} s.")
+
+        _start = time.perf_counter()
+        _journal = PacketJournal(_filename, compact_interval=None)
+        _ssdv_rx = SSDVRX(max_images=None, max_bytes=None, epoch_timeout=None)
+        _journal.replay(_ssdv_rx)
+        _replay_time = time.perf_counter() - _start
+        print(f"Rebuilt {len(_ssdv_rx.image_store)} images from the journal in {_replay_time:.3f} s.")
+
+        _start = time.perf_counter()
+        _dropped = _journal.compact()
+        print(f"Compacted the journal in {time.perf_counter() - _start:.3f} s ({_dropped} frames dropped).")
+        _journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+#   Missing Packet Tracking Benchmark
+#
+#   Compares the per-packet cost of the original list-based missing packet
+#   calculation against the MissingPackets bitmap, for large images received
+#   with random loss and in random order, and measures SSDVRX.addPacket
+#   bookkeeping with a large backlog of images already in the image store.
+#
+#   Usage: python benchmarks/bench_missing.py [--packets 2000] [--backlog 500]
+#
+
+import argparse
+import logging
+import random
+import struct
+import time
+
+from hfssdv.fec import ssdv_crc32
+from hfssdv.packets import *
+from hfssdv.receive import MissingPackets, SSDVRX
+
+
+def calculate_missing_list(received):
+    """ The original calculation - a scan of a list, run on every packet """
+    _missing = []
+    for i in range(max(received)):
+        if i not in received:
+            _missing.append(i)
+    return _missing
+
+
+def arrival_order(packets, loss, seed=1):
+    """ Packet IDs in a shuffled arrival order, with a fraction of them lost """
+    _random = random.Random(seed)
+    _order = [_i for _i in range(packets) if _random.random() >= loss]
+    _random.shuffle(_order)
+    return _order
+
+
+def bench_list(order, sample):
+    """ Time the list-based calculation on a sample of packets (it is far too slow to run on all of them) """
+    _received = {}
+    _times = []
+    for _i, _pkt in enumerate(order):
+        _received[_pkt] = True
+        if _i % sample == 0:
+            _start = time.perf_counter()
+            calculate_missing_list(list(_received.keys()))
+            _times.append(time.perf_counter() - _start)
+    return _times
+
+
+def bench_bitmap(order):
+    _missing = MissingPackets()
+    _times = []
+    for _pkt in order:
+        _start = time.perf_counter()
+        _missing.add(_pkt)
+        len(_missing)
+        _times.append(time.perf_counter() - _start)
+
+    _start = time.perf_counter()
+    _ranges = list(_missing.ranges())
+    _ranges_time = time.perf_counter() - _start
+
+    return _times, _ranges_time, len(_ranges)
+
+
+class NoDecode(object):
+    """ Stand-in for SSDVDecoder, so only the image store bookkeeping is timed """
+    def add_packet(self, packet):
+        return None
+
+
+def make_packet(callsign, image_id, packet_id):
+    """ A SSDV packet with a valid header. The payload is not decoded in this benchmark. """
+    _packet = bytes([SSDV_HEADER, SSDV_TYPE_NOFEC]) + struct.pack('>IBHBBBBH',
+        ssdv_encode_callsign(callsign), image_id, packet_id, 20, 15, 0, 0, 0) + bytes(SSDV_PAYLOAD_NOFEC)
+    return b'\x00' + _packet + struct.pack('>I', ssdv_crc32(_packet[1:]))
+
+
+def bench_receive(order, backlog, packets):
+    """ Time SSDVRX.addPacket, with a backlog of complete images already in the store """
+    _rx = SSDVRX(max_images=None, max_bytes=None)
+
+    for _img in range(backlog):
+        _call = f"BK{_img // 256}"
+        for _pkt in range(0, packets, max(1, packets // 50)):
+            _rx.addPacket(make_packet(_call, _img % 256, _pkt))
+
+    # Skip the decode, to time only the missing packet bookkeeping.
+    for _image in _rx.image_store:
+        _image.decoder = NoDecode()
+
+    _frames = [make_packet("N0CALL", 0, _pkt) for _pkt in order]
+    _rx.addPacket(_frames[0])
+    _rx.image_store.get('N0CALL', 0).decoder = NoDecode()
+
+    _times = []
+    for _frame in _frames[1:]:
+        _start = time.perf_counter()
+        _rx.addPacket(_frame)
+        _times.append(time.perf_counter() - _start)
+    return _times
+
+
+def report(name, times):
+    _times = sorted(times)
+    print(f"{name:>24}: mean {1e6*sum(_times)/len(_times):10.2f} us, "
+        f"median {1e6*_times[len(_times)//2]:10.2f} us, "
+        f"max {1e6*_times[-1]:10.2f} us  ({len(_times)} samples)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare list and bitmap missing packet tracking.")
+    parser.add_argument("--packets", type=int, default=2000, help="Packets per image. (default: 2000)")
+    parser.add_argument("--loss", type=float, default=0.1, help="Fraction of packets lost. (default: 0.1)")
+    parser.add_argument("--backlog", type=int, default=500, help="Images already in the image store. (default: 500)")
+    parser.add_argument("--sample", type=int, default=50, help="Time the list method on every Nth packet. (default: 50)")
+    args = parser.parse_args()
+
+    _order = arrival_order(args.packets, args.loss)
+    print(f"{args.packets} packet image, {len(_order)} packets received in random order.")
+
+    report("list (sampled)", bench_list(_order, args.sample))
+
+    _times, _ranges_time, _num_ranges = bench_bitmap(_order)
+    report("bitmap", _times)
+    print(f"{'bitmap ranges()':>24}: {1e6*_ranges_time:10.2f} us for {_num_ranges} missing ranges")
+
+    logging.disable(logging.INFO)
+    report(f"addPacket, {args.backlog} backlog", bench_receive(_order, args.backlog, args.packets))
+
+
+if __name__ == "__main__":
+    main()
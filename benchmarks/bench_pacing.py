@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+#   Transmit Pacing Benchmark
+#
+#   Sends an image's worth of packets to a simulated TNC, on a simulated
+#   clock, with fixed delays and with the pacer, and reports how long each
+#   took, how much air time was left idle, and how many frames overflowed
+#   the TNC's buffer.
+#
+#   The pacer is also run with a mis-configured bitrate, with and without
+#   buffer occupancy feedback from the TNC.
+#
+#   Usage: python benchmarks/bench_pacing.py [--bitrate 1000] [--packets 300] [--delays 2,4,8]
+#
+
+import argparse
+import logging
+
+from hfssdv.packets import *
+from hfssdv.pacing import SimulatedTNC, TransmitPacer
+
+
+class SimulatedClock(object):
+    """ A clock which only moves when slept on """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+
+def run(packets, tnc, clock, delay=None, pacer=None):
+    """ Send 'packets' packets through the TNC, as SSDVTX does, then let the TNC finish """
+    _packet = bytes(SSDV_PACKET_SIZE)
+    for _i in range(packets):
+        tnc.write(_packet)
+        clock.sleep(pacer.sent(len(_packet)) if pacer else delay)
+    return tnc.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fixed TX delays against the transmit pacer, on a simulated TNC.")
+    parser.add_argument("--bitrate", type=float, default=1000, help="Simulated modem bitrate (bits/s). (default: 1000)")
+    parser.add_argument("--modem-frame", type=int, default=None, help="Modem frame payload size (bytes). (default: none)")
+    parser.add_argument("--frame-overhead", type=float, default=0.5, help="Preamble time per modem frame (s). (default: 0.5)")
+    parser.add_argument("--buffer", type=int, default=8, help="TNC buffer size (frames). (default: 8)")
+    parser.add_argument("--packets", type=int, default=300, help="Packets to send. (default: 300)")
+    parser.add_argument("--delays", default="2,4,8", help="Fixed delays to compare (s). (default: 2,4,8)")
+    parser.add_argument("--misconfigure", type=float, default=1.5,
+        help="Factor the pacer's bitrate is wrong by, for the mis-configured runs. (default: 1.5)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    _modem = {'modem_frame': args.modem_frame, 'frame_overhead': args.frame_overhead}
+
+    _runs = [(f"fixed {_delay:g} s", _delay, None, False) for _delay in map(float, args.delays.split(","))]
+    _runs += [
+        ("pacer", None, args.bitrate, False),
+        (f"pacer, bitrate x{args.misconfigure:g}", None, args.bitrate * args.misconfigure, False),
+        (f"pacer, bitrate x{args.misconfigure:g}, feedback", None, args.bitrate * args.misconfigure, True),
+        (f"pacer, bitrate /{args.misconfigure:g}, feedback", None, args.bitrate / args.misconfigure, True),
+    ]
+
+    print(f"{'Strategy':<36} {'Duration (s)':>12} {'Idle (s)':>10} {'Overflows':>10}")
+    for _name, _delay, _bitrate, _feedback in _runs:
+        _clock = SimulatedClock()
+        _tnc = SimulatedTNC(args.bitrate, buffer_frames=args.buffer, clock=_clock.time, **_modem)
+        _pacer = None
+        if _bitrate:
+            _pacer = TransmitPacer(_bitrate, clock=_clock.time, queue_depth=_tnc.depth if _feedback else None, **_modem)
+
+        _stats = run(args.packets, _tnc, _clock, delay=_delay, pacer=_pacer)
+        print(f"{_name:<36} {_stats['duration']:>12.1f} {_stats['idle_time']:>10.1f} {_stats['overflows']:>10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+#   Receive Path Benchmark
+#
+#   Encodes synthetic images of several sizes, and replays them through the
+#   receive path (SSDVRX.addPacket + decode) with hfssdv.replay - in order,
+#   and shuffled with packet loss. Fails if throughput falls below a floor, so
+#   regressions in receive.py / packets.py / decoder.py get noticed.
+#
+#   Usage: python benchmarks/bench_replay.py [--min-rate 20] [--sizes 320x240,640x480]
+#
+
+import argparse
+import logging
+import random
+import sys
+
+from PIL import Image, ImageDraw
+
+from hfssdv.encoder import encode_image
+from hfssdv.replay import replay
+
+DEFAULT_SIZES = "320x240,640x480,1024x768"
+
+
+def synthetic_image(width, height, seed=1):
+    """ A test image with gradients, shapes and some noise - roughly as compressible as a photo """
+    _random = random.Random(seed)
+    _img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    _draw = ImageDraw.Draw(_img)
+    for _i in range(40):
+        _x, _y = _random.randrange(width), _random.randrange(height)
+        _r = _random.randrange(4, max(5, width // 6))
+        _colour = tuple(_random.randrange(256) for _c in range(3))
+        _draw.ellipse([_x - _r, _y - _r, _x + _r, _y + _r], fill=_colour)
+    _noise = Image.effect_noise((width, height), 24).convert('RGB')
+    return Image.blend(_img, _noise, 0.15)
+
+
+def frames_for(packets, loss=0.0, shuffle=False, seed=1):
+    _random = random.Random(seed)
+    _frames = [b'\x00' + _p for _p in packets if _random.random() >= loss]
+    if shuffle:
+        _random.shuffle(_frames)
+    return _frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the receive path against synthetic images.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Image sizes to test. (default: {DEFAULT_SIZES})")
+    parser.add_argument("--quality", type=int, default=4, help="SSDV quality level. (default: 4)")
+    parser.add_argument("--loss", type=float, default=0.1, help="Packet loss for the shuffled runs. (default: 0.1)")
+    parser.add_argument("--min-rate", type=float, default=20.0,
+        help="Fail if any run decodes fewer packets/s than this. (default: 20)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    _failures = []
+    for _size in args.sizes.split(','):
+        _width, _height = [int(_v) for _v in _size.split('x')]
+        _packets = encode_image(synthetic_image(_width, _height), quality=args.quality)
+
+        for _name, _frames in [
+            ('in order', frames_for(_packets)),
+            (f"shuffled, {100*args.loss:.0f}% loss", frames_for(_packets, args.loss, shuffle=True))
+        ]:
+            _result = replay(_frames)
+            print(f"--- {_size}, {len(_packets)} packets, {_name}")
+            print(_result.report())
+
+            if _result.rate() < args.min_rate:
+                _failures.append(f"{_size} {_name}: {_result.rate():.1f} packets/s")
+
+    for _failure in _failures:
+        print(f"FAIL: {_failure} is below {args.min_rate} packets/s")
+
+    sys.exit(1 if _failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+#   Resend Request Size Benchmark
+#
+#   Compares the original resend request format (a fixed 256-byte packet,
+#   listing at most 120 missing packets) against the compact v2 format, for
+#   images losing packets at random, and in fades, as on a fading HF path.
+#   Requests in either format are at most 256 bytes, so heavy losses take
+#   several requests to list.
+#
+#   Usage: python benchmarks/bench_resend.py [--packets 300,2000] [--trials 20]
+#
+
+import argparse
+import math
+import random
+import time
+
+from hfssdv.packets import *
+
+# Offset of the encoding byte in a v2 resend request.
+RESEND_V2_ENCODING_OFFSET = 16
+
+
+def random_loss(count, loss, rng):
+    """ IDs of the packets lost, each independently """
+    return [_i for _i in range(count) if rng.random() < loss]
+
+
+def fade_loss(count, loss, rng, fade_length):
+    """ IDs of the packets lost over a two-state (Gilbert-Elliott) channel, which loses every packet
+        during fades averaging fade_length packets, with the same average loss rate
+    """
+    _p_end = 1.0 / fade_length
+    _p_start = _p_end * loss / (1.0 - loss)
+
+    _lost = []
+    _fading = rng.random() < loss
+    for _i in range(count):
+        _fading = (rng.random() >= _p_end) if _fading else (rng.random() < _p_start)
+        if _fading:
+            _lost.append(_i)
+    return _lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the size of resend requests in the original and compact formats.")
+    parser.add_argument("--packets", default="300,2000", help="Image sizes to try (packets). (default: 300,2000)")
+    parser.add_argument("--trials", type=int, default=20, help="Images per size and loss pattern. (default: 20)")
+    args = parser.parse_args()
+
+    _rng = random.Random(1)
+    _patterns = [
+        ("random 1%", lambda _count: random_loss(_count, 0.01, _rng)),
+        ("random 5%", lambda _count: random_loss(_count, 0.05, _rng)),
+        ("random 20%", lambda _count: random_loss(_count, 0.2, _rng)),
+        ("fades 5%, 10 pkts", lambda _count: fade_loss(_count, 0.05, _rng, 10)),
+        ("fades 20%, 40 pkts", lambda _count: fade_loss(_count, 0.2, _rng, 40)),
+    ]
+
+    print(f"{'Packets':>8} {'Loss':<20} {'Missing':>8} {'v1 frames':>10} {'v1 bytes':>9} {'v2 frames':>10} "
+        f"{'v2 bytes':>9} {'Bitmap':>7} {'v2 time (us)':>13}")
+    for _count in map(int, args.packets.split(",")):
+        for _name, _loss in _patterns:
+            _missing = _v1_frames = _v2_frames = _v2_bytes = _bitmaps = 0
+            _time = 0.0
+            for _trial in range(args.trials):
+                _lost = _loss(_count)
+                _missing += len(_lost)
+                # The original format needs a request per 120 missing packets.
+                _v1_frames += math.ceil(len(_lost) / MAX_PACKET_LIST)
+
+                # Requests list the lowest missing packets that fit, so repeat until all are listed.
+                _remaining = _lost
+                while True:
+                    _start = time.perf_counter()
+                    _packet = encode_resend_packet_v2("VK5ABC", "N0CALL", 1, _count - 1, _remaining)
+                    _decoded = decode_resend_packet(_packet)
+                    _time += time.perf_counter() - _start
+
+                    assert _decoded['missing'] == _remaining[:len(_decoded['missing'])]
+                    _v2_frames += 1
+                    _v2_bytes += len(_packet)
+                    _bitmaps += _packet[RESEND_V2_ENCODING_OFFSET] == RESEND_BITMAP
+                    _remaining = _remaining[len(_decoded['missing']):]
+                    if not _remaining:
+                        break
+
+            print(f"{_count:>8} {_name:<20} {_missing / args.trials:>8.1f} {_v1_frames / args.trials:>10.1f} "
+                f"{_v1_frames * SSDV_PACKET_SIZE / args.trials:>9.0f} {_v2_frames / args.trials:>10.1f} "
+                f"{_v2_bytes / args.trials:>9.1f} {_bitmaps / _v2_frames:>7.0%} {_time * 1e6 / args.trials:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+#   ARQ Simulation
+#
+#   Runs a sending station (SSDVTX + ARQResponder) and a receiving station
+#   (SSDVRX + ARQRequester) in one process, linked by a simulated half-duplex
+#   channel with fading packet loss in both directions, on a simulated clock.
+#   The sender transmits a series of images; the receiver requests resends
+#   on its own, and the sender answers them under its policy. Reports each
+#   image's time to complete and resend rounds.
+#
+#   Exits non-zero if any image is not completed, so it works as an
+#   end-to-end test of the ARQ engine.
+#
+#   Usage: python benchmarks/sim_arq.py [--images 3] [--loss 0.1] [--bitrate 980]
+#
+
+import argparse
+import logging
+import math
+import random
+import sys
+from collections import deque
+
+from bench_replay import synthetic_image
+
+from hfssdv.arq import ARQRequester, ARQResponder
+from hfssdv.burst import *
+from hfssdv.packets import *
+from hfssdv.pacing import frame_airtime
+from hfssdv.receive import SSDVRX
+from hfssdv.transmit import SSDVTX
+
+TX_CALLSIGN = "VK5TX"
+RX_CALLSIGN = "VK5RX"
+
+
+class FadingLink(object):
+    """ One direction of a channel, losing every frame sent during a fade (a two-state Gilbert-Elliott model).
+
+        Fades come and go in time rather than per frame, so the channel recovers while the stations are
+        quiet, waiting on their timers.
+    """
+
+    def __init__(self, loss, fade_length, rng):
+        self.loss = loss
+        # Rates of leaving and entering a fade (per second).
+        self.end_rate = 1.0 / fade_length
+        self.start_rate = self.end_rate * loss / (1.0 - loss) if loss < 1.0 else 0.0
+        self.rng = rng
+        self.fading = False
+        self.last_time = 0.0
+        self.sent = 0
+        self.lost = 0
+
+
+    def deliver(self, now):
+        """ Whether a frame sent at 'now' gets through """
+        # The chance of a fade relaxes from the state at the last frame towards the average loss.
+        _decay = math.exp(-(self.end_rate + self.start_rate) * (now - self.last_time))
+        self.fading = self.rng.random() < self.loss + (self.fading - self.loss) * _decay
+        self.last_time = now
+        self.sent += 1
+        self.lost += self.fading
+        return not self.fading
+
+
+class Simulation(object):
+    """ Two stations sharing a half-duplex channel. Frames go out one at a time - the receiving station's
+        resend requests in the next gap between the sender's frames.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.now = 0.0
+        _rng = random.Random(args.seed)
+
+        self.ssdv_tx = SSDVTX(burst_size=args.burst_size, fountain_overhead=args.fountain)
+        self.responder = ARQResponder(self.ssdv_tx, TX_CALLSIGN, allowlist=[RX_CALLSIGN], max_rounds=args.max_rounds,
+            max_packets=args.resend_limit, clock=self.clock)
+
+        self.ssdv_rx = SSDVRX(max_images=None, max_bytes=None, defer_decode=True)
+        self.requester = ARQRequester(self.ssdv_rx, RX_CALLSIGN, end_delay=args.end_delay, idle_timeout=args.idle_timeout,
+            retry_timeout=args.retry_timeout, max_rounds=args.max_rounds, clock=self.clock)
+
+        self.downlink = FadingLink(args.loss, args.fade_length, _rng)
+        self.uplink = FadingLink(args.loss, args.fade_length, _rng)
+
+        # Frames waiting to be sent - resends are sent ahead of new images.
+        self.tx_images = deque()
+        self.tx_resends = deque()
+        self.rx_requests = deque()
+
+        self.tx_airtime = 0.0
+        self.rx_airtime = 0.0
+
+
+    def clock(self):
+        return self.now
+
+
+    def airtime(self, frame):
+        # Plus the TNC port byte.
+        return frame_airtime(len(frame) + 1, self.args.bitrate, self.args.modem_frame, self.args.frame_overhead)
+
+
+    def load_images(self):
+        _width, _height = [int(_v) for _v in self.args.size.split('x')]
+        for _i in range(self.args.images):
+            self.ssdv_tx.add_image(synthetic_image(_width, _height, seed=_i), callsign=TX_CALLSIGN, quality=self.args.quality)
+            _image_id = self.ssdv_tx.current_image
+            _count = len(self.ssdv_tx.image_store[_image_id]['packets'])
+            _frames = self.ssdv_tx.tx_frames(_image_id, range(_count), self.ssdv_tx.repair_count(_image_id))
+            self.tx_images.extend(_frame for _frame, _sent in _frames)
+
+
+    def tx_heard(self, frame):
+        """ The sending station hears a frame - answer any resend requests in it """
+        for _item in iter_frames(b'\x00' + frame):
+            if not is_resend_packet(_item[1:]):
+                continue
+            _request = decode_resend_packet(_item[1:])
+            _packets = self.responder.handle(_request)
+            if _packets:
+                self.tx_resends.extend(_frame for _frame, _sent in self.ssdv_tx.tx_frames(_request['img_id'], _packets))
+
+
+    def rx_heard(self, frame):
+        """ The receiving station hears a frame """
+        self.requester.heard(self.ssdv_rx.addPacket(b'\x00' + frame, timestamp=self.now))
+
+
+    def step(self):
+        """ Send the next frame, or wait a second if there is nothing to send. Returns False once everything is done. """
+        for _frame, _count in burst_frames(self.requester.due(), self.args.burst_size):
+            self.rx_requests.append(_frame)
+
+        if self.rx_requests:
+            _frame = self.rx_requests.popleft()
+            _delivered = self.uplink.deliver(self.now)
+            self.now += self.airtime(_frame)
+            self.rx_airtime += self.airtime(_frame)
+            if _delivered:
+                self.tx_heard(_frame)
+            return True
+
+        if self.tx_resends or self.tx_images:
+            _frame = (self.tx_resends or self.tx_images).popleft()
+            _delivered = self.downlink.deliver(self.now)
+            self.now += self.airtime(_frame)
+            self.tx_airtime += self.airtime(_frame)
+            if _delivered:
+                self.rx_heard(_frame)
+            return True
+
+        if not self.requester.images:
+            return False
+
+        # Channel idle, waiting on the receiver's timers.
+        self.now += 1.0
+        return True
+
+
+    def run(self):
+        self.load_images()
+        while self.now < self.args.max_time and self.step():
+            pass
+
+
+def parse_args(argv=None):
+    """ Parse the simulation's options, from the command line or from argv """
+    parser = argparse.ArgumentParser(description="Simulate automatic resends between two stations over a lossy channel.")
+    parser.add_argument("--images", type=int, default=3, help="Images to send. (default: 3)")
+    parser.add_argument("--size", default="320x240", help="Image size (pixels). (default: 320x240)")
+    parser.add_argument("--quality", type=int, default=4, help="SSDV quality level. (default: 4)")
+    parser.add_argument("--loss", type=float, default=0.1, help="Average frame loss, in each direction. (default: 0.1)")
+    parser.add_argument("--fade-length", type=float, default=15, help="Mean fade length (s). (default: 15)")
+    parser.add_argument("--bitrate", type=float, default=980, help="Modem bitrate (bits/s). (default: 980)")
+    parser.add_argument("--modem-frame", type=int, default=None, help="Modem frame payload size (bytes). (default: none)")
+    parser.add_argument("--frame-overhead", type=float, default=0.6, help="Preamble time per frame (s). (default: 0.6)")
+    parser.add_argument("--burst-size", type=int, default=None, help="Burst size (bytes). (default: one packet per frame)")
+    parser.add_argument("--fountain", type=float, default=None, help="Repair packet overhead. (default: none)")
+    parser.add_argument("--end-delay", type=float, default=15, help="Receiver's end-of-image delay (s). (default: 15)")
+    parser.add_argument("--idle-timeout", type=float, default=60, help="Receiver's idle timeout (s). (default: 60)")
+    parser.add_argument("--retry-timeout", type=float, default=120, help="Receiver's retry timeout (s). (default: 120)")
+    parser.add_argument("--max-rounds", type=int, default=8, help="Most resend rounds per image. (default: 8)")
+    parser.add_argument("--resend-limit", type=int, default=None, help="Sender's resent packets per hour. (default: no limit)")
+    parser.add_argument("--max-time", type=float, default=24 * 3600, help="Simulated time limit (s). (default: 1 day)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed. (default: 1)")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Log the stations' ARQ decisions.")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO if args.verbose else logging.WARNING)
+
+    _sim = Simulation(args)
+    _sim.run()
+
+    print(f"{'Image':>6} {'Packets':>8} {'Complete':>9} {'Time (s)':>9} {'Rounds':>7} {'Requested':>10}")
+    _incomplete = 0
+    for _metrics in _sim.requester.metrics():
+        _done = _metrics['completed'] is not None
+        _incomplete += not _done
+        _time = f"{_metrics['time_to_complete']:.0f}" if _done else "-"
+        print(f"{_metrics['image_id']:>6} {_metrics['packets']:>8} {'yes' if _done else 'NO':>9} {_time:>9} "
+            f"{_metrics['rounds']:>7} {_metrics['requested']:>10}")
+    # Images lost entirely can't be requested - the receiver never knew they were sent.
+    _unheard = args.images - len(_sim.requester.metrics())
+    _incomplete += _unheard
+
+    print()
+    if _unheard:
+        print(f"{_unheard} images were never heard.")
+    print(f"Simulated time: {_sim.now:.0f} s, sender airtime {_sim.tx_airtime:.0f} s, receiver airtime {_sim.rx_airtime:.0f} s.")
+    print(f"Frames lost: {_sim.downlink.lost}/{_sim.downlink.sent} to the receiver, {_sim.uplink.lost}/{_sim.uplink.sent} to the sender.")
+    print(f"Sender: {_sim.responder.stats}")
+    print(f"Receiver: {_sim.requester.summary()}")
+
+    if _incomplete:
+        print(f"FAIL: {_incomplete} images not completed.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -40,11 +40,12 @@ if __name__ == "__main__":
             "Intended Audience :: Developers",
             "Programming Language :: Python :: 3.6",
             "Programming Language :: Python :: 3.7",
-        ]
-        # TODO: Deal with entry points.
-        # entry_points={
-        #     "console_scripts": [
-        #         "hfssdv=hfssdv.gui.main",
-        #     ]
-        # },
+        ],
+        entry_points={
+            "console_scripts": [
+                "hfssdv=hfssdv.gui:main",
+                "hfssdv-rx=hfssdv.cli:rx_main",
+                "hfssdv-tx=hfssdv.cli:tx_main",
+            ]
+        },
     )
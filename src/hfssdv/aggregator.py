@@ -0,0 +1,240 @@
+#
+#   Multi-TNC Receive Aggregator
+#
+#   Listens on several KISS TNCs at once (e.g. freedv-tnc instances on
+#   different bands/modes), and merges everything into a single SSDVRX image
+#   store. Packets heard on more than one link are only processed once.
+#
+
+import asyncio
+import logging
+import time
+from .burst import *
+from .fec import *
+from .kiss import *
+from .packets import *
+from .receive import *
+
+
+class LinkStats(object):
+    """ Per-link packet counters """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        # Frames holding several packets (see burst.py).
+        self.bursts = 0
+        self.ssdv_packets = 0
+        # Packets this link delivered first.
+        self.unique = 0
+        self.duplicates = 0
+        self.other = 0
+        # Packets which failed their CRC check, and symbols corrected by FEC.
+        self.crc_errors = 0
+        self.fec_corrected = 0
+        self.last_rx = None
+
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'frames': self.frames,
+            'bursts': self.bursts,
+            'ssdv_packets': self.ssdv_packets,
+            'unique': self.unique,
+            'duplicates': self.duplicates,
+            'other': self.other,
+            'crc_errors': self.crc_errors,
+            'fec_corrected': self.fec_corrected,
+            'last_rx': self.last_rx
+        }
+
+
+class RXAggregator(object):
+    """ Receive SSDV packets from several KISS TNC links into one SSDVRX. """
+
+    def __init__(self, links, ssdv_rx=None, callback=None, max_index=100000, stats_interval=None, dedup_window=600,
+        frame_dedup_window=5):
+        """
+            Args:
+                links (list): KISSClient objects, or (host, port) tuples.
+                ssdv_rx (SSDVRX): Receiver to add packets to. A new one is created if not supplied.
+                callback (function): Called with the result of SSDVRX.addPacket, for each new packet.
+                max_index (int): Maximum number of packets to remember for de-duplication.
+                dedup_window (float): Only treat a packet as a duplicate if it was first heard within this
+                    many seconds, so packets from a later image with a re-used image ID are not discarded.
+                frame_dedup_window (float): Only treat a non-SSDV frame (e.g. a resend request) as a duplicate if
+                    it was heard on another link within this many seconds. Repeats on the same link, or
+                    heard later, are passed on, as they are retries.
+                stats_interval (float): If set, log per-link statistics at this interval (seconds).
+        """
+        self.links = []
+        for _link in links:
+            if isinstance(_link, KISSClient):
+                self.links.append(_link)
+            else:
+                self.links.append(KISSClient(host=_link[0], port=_link[1]))
+
+        self.ssdv_rx = ssdv_rx if ssdv_rx else SSDVRX()
+        self.callback = callback
+        self.max_index = max_index
+        self.stats_interval = stats_interval
+        self.dedup_window = dedup_window
+        self.frame_dedup_window = frame_dedup_window
+
+        self.stats = [LinkStats(_link.name) for _link in self.links]
+
+        # (callsign, image ID, packet ID) header bytes -> bitmask of links which heard the packet.
+        self.index = {}
+        # Header bytes -> time the packet was first heard.
+        self._first_heard = {}
+
+        # Recently seen non-SSDV frames (e.g. resend requests), which may also arrive on several links.
+        # Frame -> (time first heard, bitmask of links which heard it).
+        self._recent_frames = {}
+
+
+    def handle_frame(self, link, frame):
+        """ Handle a frame received on a link (an index into self.links).
+
+            Returns the result of SSDVRX.addPacket, or None if the frame was a duplicate.
+            Bursts are unpacked, and each packet in them handled (and de-duplicated) separately.
+        """
+        _stats = self.stats[link]
+        _stats.frames += 1
+        _stats.last_rx = time.time()
+
+        if not is_burst(frame):
+            return self._handle_packet(link, frame)
+
+        _stats.bursts += 1
+        try:
+            _frames = list(iter_frames(frame))
+        except ValueError as e:
+            logging.error(f"Link {_stats.name} - Discarding malformed burst: {str(e)}")
+            _stats.other += 1
+            return None
+
+        _responses = [_resp for _resp in (self._handle_packet(link, _frame) for _frame in _frames) if _resp]
+        return {'type': 'burst', 'responses': _responses} if _responses else None
+
+
+    def _handle_packet(self, link, frame):
+        """ Handle a single packet, in a frame of its own or from a burst """
+        _stats = self.stats[link]
+
+        if len(frame) == 257 and frame[1] == SSDV_HEADER:
+            _stats.ssdv_packets += 1
+
+            # Check (and correct) the packet before indexing it, so a corrupted copy heard on one
+            # link does not cause a good copy from another link to be discarded as a duplicate.
+            _packet, _corrected = ssdv_verify_packet(frame[1:])
+            if _packet is None:
+                _stats.crc_errors += 1
+                return None
+            _stats.fec_corrected += _corrected
+            # Passed on corrected, so the receiver doesn't check it again.
+            frame = bytes(frame[:1]) + _packet
+
+            # Callsign, image ID and packet ID, straight from the (corrected) header.
+            _key = _packet[2:9]
+            _seen = self.index.get(_key)
+
+            if _seen is not None and (_stats.last_rx - self._first_heard[_key]) <= self.dedup_window:
+                self.index[_key] = _seen | (1 << link)
+                _stats.duplicates += 1
+                return None
+
+            if _seen is not None:
+                # Heard long ago - the image ID has wrapped around. Move the entry to the end of the index.
+                del self.index[_key]
+
+            self.index[_key] = 1 << link
+            self._first_heard[_key] = _stats.last_rx
+            _stats.unique += 1
+            if len(self.index) > self.max_index:
+                # Forget the oldest packet.
+                _oldest = next(iter(self.index))
+                del self.index[_oldest]
+                del self._first_heard[_oldest]
+
+        else:
+            _stats.other += 1
+            _corrected = None
+
+            _key = bytes(frame)
+            _recent = self._recent_frames.pop(_key, None)
+            if _recent is not None:
+                _heard, _links = _recent
+                if not _links & (1 << link) and (_stats.last_rx - _heard) <= self.frame_dedup_window:
+                    # The same transmission, heard on another link.
+                    self._recent_frames[_key] = (_heard, _links | (1 << link))
+                    _stats.duplicates += 1
+                    return None
+
+            self._recent_frames[_key] = (_stats.last_rx, 1 << link)
+            if len(self._recent_frames) > 64:
+                del self._recent_frames[next(iter(self._recent_frames))]
+
+        _resp = self.ssdv_rx.addPacket(frame, link=link, corrected=_corrected)
+        if _resp and self.callback:
+            self.callback(_resp)
+        return _resp
+
+
+    def exclusive(self):
+        """ Count the packets heard only on each link (in the de-duplication index) """
+        _counts = [0] * len(self.links)
+        for _mask in self.index.values():
+            if _mask & (_mask - 1) == 0:
+                _counts[_mask.bit_length() - 1] += 1
+        return _counts
+
+
+    def report(self):
+        """ Produce a list of per-link statistics dicts """
+        _report = []
+        for _stats, _exclusive in zip(self.stats, self.exclusive()):
+            _entry = _stats.to_dict()
+            _entry['exclusive'] = _exclusive
+            _report.append(_entry)
+        return _report
+
+
+    def log_stats(self):
+        for _entry in self.report():
+            logging.info(
+                f"Link {_entry['name']}: {_entry['ssdv_packets']} SSDV packets, {_entry['unique']} first, "
+                f"{_entry['exclusive']} exclusive, {_entry['duplicates']} duplicates, "
+                f"{_entry['crc_errors']} CRC errors, {_entry['fec_corrected']} bytes corrected by FEC."
+            )
+
+
+    async def _read_link(self, link):
+        _tnc = self.links[link]
+        while True:
+            self.handle_frame(link, await _tnc.read())
+
+
+    async def _log_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.log_stats()
+
+
+    async def run(self):
+        """ Connect to all links, and process received frames until cancelled """
+        for _tnc in self.links:
+            _tnc.start()
+
+        _tasks = [asyncio.ensure_future(self._read_link(_i)) for _i in range(len(self.links))]
+        if self.stats_interval:
+            _tasks.append(asyncio.ensure_future(self._log_stats()))
+
+        try:
+            await asyncio.gather(*_tasks)
+        finally:
+            for _task in _tasks:
+                _task.cancel()
+            for _tnc in self.links:
+                await _tnc.stop()
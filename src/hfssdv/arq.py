@@ -0,0 +1,338 @@
+#
+#   Automatic Resend Negotiation (ARQ)
+#
+#   Lets unattended stations complete images without anyone pressing
+#   "Request Resend", or approving resends at the sending end.
+#
+#   ARQRequester (receiving station) follows the images in a SSDVRX image
+#   store, and works out when to request their missing packets:
+#     - Shortly after the end of an image is heard, once packets for it have
+#       stopped arriving (so any repair packets or bursts can finish first).
+#     - If an image stalls before its end is heard, after idle_timeout.
+#     - Again, once the resent packets have stopped arriving, or after
+#       retry_timeout if the request went unanswered - up to max_rounds.
+#   It also keeps time-to-complete metrics for each image.
+#
+#   ARQResponder (sending station) decides which resend requests to answer,
+#   using SSDVTX.check_resend_ability (via resend_request_packets), subject
+#   to an allowlist of requesting callsigns, a limit on rounds per image,
+#   a minimum interval between answers to one station, and a rate limit on
+#   resent packets.
+#
+#   Neither reads the clock itself unless asked to, so both can be driven on
+#   a simulated clock - see benchmarks/sim_arq.py.
+#
+
+import logging
+import time
+from collections import OrderedDict, deque
+from .receive import iter_responses
+
+# Image metrics to keep, after their images are complete or given up on.
+ARQ_HISTORY = 256
+
+
+def image_incomplete(image):
+    """ Check if an image has missing packets, or we have not yet heard its last packet """
+    if image.missing:
+        return True
+
+    _last = image[image.missing.highest]
+    return (_last[11] & 0x04) == 0
+
+
+class ImageProgress(object):
+    """ Resend state and time-to-complete metrics for one received image """
+
+    def __init__(self, key, now):
+        self.callsign, self.image_id, self.epoch = key
+        self.first_heard = now
+        self.last_heard = now
+        # When the image's last packet was first heard.
+        self.end_heard = None
+        self.completed = None
+        self.gave_up = None
+        self.rounds = 0
+        self.last_request = None
+        # Packets requested, over all rounds.
+        self.requested = 0
+        self.packets = 0
+
+
+    @property
+    def time_to_complete(self):
+        """ Seconds from the first packet heard to the image being complete, or None """
+        if self.completed is None:
+            return None
+        return self.completed - self.first_heard
+
+
+    def to_dict(self):
+        return {
+            'callsign': self.callsign,
+            'image_id': self.image_id,
+            'epoch': self.epoch,
+            'packets': self.packets,
+            'first_heard': self.first_heard,
+            'completed': self.completed,
+            'gave_up': self.gave_up,
+            'time_to_complete': self.time_to_complete,
+            'rounds': self.rounds,
+            'requested': self.requested
+        }
+
+
+class ARQRequester(object):
+    """ Requests resends of incomplete images in a SSDVRX, automatically """
+
+    def __init__(self, ssdv_rx, callsign, end_delay=15.0, idle_timeout=60.0, retry_timeout=120.0, max_rounds=5,
+        clock=time.monotonic):
+        """
+            Args:
+                ssdv_rx (SSDVRX): Receiver whose images to complete.
+                callsign (str): Our callsign, used as the source of resend requests.
+                end_delay (float): Once an image's end has been heard (or resent packets have arrived),
+                    request a resend after no packets have been heard for it for this long (seconds).
+                    Should be longer than the time between packets.
+                idle_timeout (float): Request a resend of an image whose end has not been heard, after
+                    no packets have been heard for it for this long (seconds).
+                retry_timeout (float): Repeat a request which got no answer after this long (seconds).
+                max_rounds (int): Most resend requests to make per image.
+                clock (function): Time source, in seconds. Replaceable for simulation.
+        """
+        self.ssdv_rx = ssdv_rx
+        self.callsign = callsign
+        self.end_delay = end_delay
+        self.idle_timeout = idle_timeout
+        self.retry_timeout = retry_timeout
+        self.max_rounds = max_rounds
+        self.clock = clock
+
+        # Image store key -> ImageProgress, for images still being received.
+        self.images = OrderedDict()
+        # Image store key -> ImageProgress, for the most recently completed or given up images.
+        self.history = OrderedDict()
+
+
+    def heard(self, resp, now=None):
+        """ Update image progress from a result of SSDVRX.addPacket (bursts and repair results included) """
+        if resp is None:
+            return
+        _now = self.clock() if now is None else now
+
+        if resp['type'] == 'repair':
+            # Repair packets are still coming in, so hold off on requesting a resend.
+            _image = self.ssdv_rx.image_store.get(resp['callsign'], resp['image_id'])
+            _progress = self.images.get((_image.callsign, _image.id, _image.epoch)) if _image else None
+            if _progress is not None:
+                _progress.last_heard = _now
+
+        for _resp in iter_responses(resp):
+            if _resp['type'] == 'image_update':
+                self._image_heard(_resp['latest'], _now)
+
+
+    def _image_heard(self, image, now):
+        _key = (image.callsign, image.id, image.epoch)
+        _progress = self.images.get(_key)
+        if _progress is None:
+            if _key in self.history:
+                # A late packet of a finished image.
+                return
+            _progress = ImageProgress(_key, now)
+            self.images[_key] = _progress
+
+        _progress.last_heard = now
+        _progress.packets = len(image)
+
+        if _progress.end_heard is None and (image[image.missing.highest][11] & 0x04):
+            _progress.end_heard = now
+
+        if not image_incomplete(image):
+            _progress.completed = now
+            self._finish(_key)
+            logging.info(f"ARQ - {image.callsign} image {image.id} complete in {_progress.time_to_complete:.1f} s, "
+                f"after {_progress.rounds} resend requests.")
+
+
+    def _finish(self, key):
+        self.history[key] = self.images.pop(key)
+        while len(self.history) > ARQ_HISTORY:
+            self.history.popitem(last=False)
+
+
+    def due(self, now=None):
+        """ Work out which images need a resend request now.
+
+            Returns:
+                list: Resend request packets to send.
+        """
+        _now = self.clock() if now is None else now
+        _requests = []
+
+        for _key, _progress in list(self.images.items()):
+            _image = self.ssdv_rx.image_store.images.get(_key)
+            if _image is None:
+                # Dropped from the image store.
+                del self.images[_key]
+                continue
+
+            if _now - max(_progress.last_heard, _progress.last_request or _progress.last_heard) < self._wait(_progress):
+                continue
+
+            if _progress.rounds >= self.max_rounds:
+                _progress.gave_up = _now
+                self._finish(_key)
+                logging.warning(f"ARQ - Giving up on {_image.callsign} image {_image.id} after {_progress.rounds} "
+                    f"resend requests, {len(_image.missing)} packets missing.")
+                continue
+
+            _progress.rounds += 1
+            _progress.last_request = _now
+            _progress.requested += len(_image.missing)
+            logging.info(f"ARQ - Requesting resend of {_image.callsign} image {_image.id} (round {_progress.rounds}), "
+                f"{len(_image.missing)} packets missing.")
+            _requests.append(self.ssdv_rx.resendRequest(_image, self.callsign))
+
+        return _requests
+
+
+    def _wait(self, progress):
+        """ How long an image must have been quiet before requesting a resend """
+        if progress.last_request is not None and progress.last_heard <= progress.last_request:
+            # Nothing heard since our last request.
+            return self.retry_timeout
+        if progress.end_heard is not None:
+            return self.end_delay
+        return self.idle_timeout
+
+
+    def metrics(self):
+        """ Metrics of the completed, given up, and in progress images, as a list of dicts """
+        return [_progress.to_dict() for _progress in list(self.history.values()) + list(self.images.values())]
+
+
+    def summary(self):
+        """ Overall time-to-complete statistics """
+        _finished = list(self.history.values())
+        _times = sorted(_progress.time_to_complete for _progress in _finished if _progress.completed is not None)
+        return {
+            'complete': len(_times),
+            'gave_up': sum(1 for _progress in _finished if _progress.gave_up is not None),
+            'in_progress': len(self.images),
+            'mean_time_to_complete': sum(_times) / len(_times) if _times else None,
+            'median_time_to_complete': _times[len(_times) // 2] if _times else None,
+            'max_time_to_complete': _times[-1] if _times else None,
+            'mean_rounds': sum(_progress.rounds for _progress in _finished) / len(_finished) if _finished else None
+        }
+
+
+class ARQResponder(object):
+    """ Answers resend requests for the images in a SSDVTX automatically, subject to policy """
+
+    def __init__(self, ssdv_tx, callsign, allowlist=None, max_rounds=None, min_interval=None, max_packets=None,
+        rate_window=3600.0, clock=time.monotonic):
+        """
+            Args:
+                ssdv_tx (SSDVTX): Transmitter whose images to resend.
+                callsign (str): Our callsign - requests for other callsigns are ignored.
+                allowlist (list): If set, only answer requests from these callsigns.
+                max_rounds (int): If set, answer at most this many requests per station per image.
+                min_interval (float): If set, ignore requests from a station for the same image within
+                    this many seconds of the last one answered, e.g. the same request heard twice.
+                max_packets (int): If set, resend at most this many packets per rate_window. Requests
+                    are cut short to fit, or refused once it is used up.
+                rate_window (float): Period for max_packets (seconds).
+                clock (function): Time source, in seconds. Replaceable for simulation.
+        """
+        self.ssdv_tx = ssdv_tx
+        self.callsign = callsign
+        self.allowlist = set(_call.upper() for _call in allowlist) if allowlist else None
+        self.max_rounds = max_rounds
+        self.min_interval = min_interval
+        self.max_packets = max_packets
+        self.rate_window = rate_window
+        self.clock = clock
+
+        # (station, image ID) -> [image packet list, requests answered, time of last answer]
+        self._rounds = {}
+        # (time, packets) of each answer within the rate window.
+        self._sent = deque()
+
+        self.stats = {
+            'requests': 0,
+            'answered': 0,
+            'packets': 0,
+            'not_allowed': 0,
+            'max_rounds': 0,
+            'too_soon': 0,
+            'rate_limited': 0,
+            'unavailable': 0
+        }
+
+
+    def handle(self, request, now=None):
+        """ Decide whether to answer a decoded resend request.
+
+            Returns:
+                list: Packet IDs to resend, or None if the request is not answered.
+        """
+        _now = self.clock() if now is None else now
+
+        if request['dst_call'] != self.callsign:
+            logging.debug(f"ARQ - Resend request for {request['dst_call']}, ignoring.")
+            return None
+
+        self.stats['requests'] += 1
+        _station = request['src_call'].upper()
+        _image_id = request['img_id']
+
+        if self.allowlist is not None and _station not in self.allowlist:
+            return self._refuse('not_allowed', request)
+
+        # Packet lists are replaced when an image ID is re-used, which starts the count again.
+        _entry = self.ssdv_tx.image_store.get(_image_id)
+        _packets = _entry['packets'] if _entry else None
+        _rounds = self._rounds.get((_station, _image_id))
+        if _rounds is not None and _rounds[0] is not _packets:
+            _rounds = None
+
+        if _rounds is not None:
+            if self.max_rounds is not None and _rounds[1] >= self.max_rounds:
+                return self._refuse('max_rounds', request)
+            if self.min_interval is not None and _now - _rounds[2] < self.min_interval:
+                return self._refuse('too_soon', request)
+
+        _resend = self.ssdv_tx.resend_request_packets(request, self.callsign)
+        if not _resend:
+            return self._refuse('unavailable', request)
+
+        if self.max_packets is not None:
+            while self._sent and _now - self._sent[0][0] >= self.rate_window:
+                self._sent.popleft()
+            _allowed = self.max_packets - sum(_count for _time, _count in self._sent)
+            if _allowed <= 0:
+                return self._refuse('rate_limited', request)
+            if len(_resend) > _allowed:
+                logging.info(f"ARQ - Rate limit, resending {_allowed} of {len(_resend)} packets.")
+                _resend = _resend[:_allowed]
+            self._sent.append((_now, len(_resend)))
+
+        # The image may have just been restored from the packet cache.
+        _packets = self.ssdv_tx.image_store[_image_id]['packets']
+        if _rounds is None:
+            _rounds = [_packets, 0, _now]
+            self._rounds[(_station, _image_id)] = _rounds
+        _rounds[1] += 1
+        _rounds[2] = _now
+
+        self.stats['answered'] += 1
+        self.stats['packets'] += len(_resend)
+        logging.info(f"ARQ - Resending {len(_resend)} packets of image {_image_id} to {_station} (round {_rounds[1]}).")
+        return _resend
+
+
+    def _refuse(self, reason, request):
+        self.stats[reason] += 1
+        logging.info(f"ARQ - Not answering resend request from {request['src_call']} for image {request['img_id']}: {reason}.")
+        return None
@@ -0,0 +1,225 @@
+#
+#   Batch TX Image Loader
+#
+#   Resizes and encodes a folder (or glob) of images in parallel on a process
+#   pool, so unattended stations can pre-stage many images, and the GUI is not
+#   blocked while they are encoded.
+#
+#   Image IDs are assigned in file order when the batch is submitted. As each
+#   image is encoded its packets are added to SSDVTX.image_store, and its image
+#   ID is put on SSDVTX.ready_queue - in file order, whichever order the
+#   workers finish in.
+#
+#   If the SSDVTX has a packet cache, images found in it are not re-encoded,
+#   and newly encoded images are added to it.
+#
+
+import glob
+import logging
+import os
+import threading
+from collections import deque
+from .txcache import *
+
+# File extensions picked up when loading a directory.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def find_images(path):
+    """ Expand a directory, glob pattern or filename into a sorted list of image files """
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, _name) for _name in os.listdir(path)
+            if _name.lower().endswith(IMAGE_EXTENSIONS))
+
+    _files = sorted(glob.glob(path))
+    return _files if _files else [path]
+
+
+def encode_file(filename, callsign="N0CALL", image_id=0, quality=4, fec=False, max_size=None, max_packets=None):
+    """ Load, resize and encode an image file into SSDV packets. Runs in a worker process.
+
+        Args:
+            max_size (tuple): If set, shrink the image to fit within (width, height) pixels.
+            max_packets (int): If set, choose the image size and quality to fit this many packets.
+
+        Returns:
+            tuple: (list of 256-byte SSDV packets, settings chosen by encode_image_budget or None)
+    """
+    from PIL import Image
+    from .encoder import encode_image, encode_image_budget
+
+    with Image.open(filename) as _img:
+        _img.load()
+        _scale = 1.0
+        if max_size:
+            _scale = min(1.0, max_size[0] / _img.size[0], max_size[1] / _img.size[1])
+
+        if max_packets:
+            return encode_image_budget(_img, max_packets, callsign=callsign, image_id=image_id, fec=fec, max_scale=_scale)
+
+        return (encode_image(_img, callsign=callsign, image_id=image_id, quality=quality, fec=fec, scale=_scale), None)
+
+
+class BatchLoader(object):
+    """ Encode batches of image files in parallel into a SSDVTX image store """
+
+    def __init__(self, ssdv_tx, callsign="N0CALL", quality=4, fec=False, max_size=None, max_packets=None, processes=None,
+        status_callback=None):
+        """
+            Args:
+                ssdv_tx (SSDVTX): Transmitter to add the encoded images to.
+                callsign (str): Callsign to encode images with.
+                quality (int): SSDV quality level, 0-7.
+                fec (bool): Produce FEC (Reed-Solomon) packets.
+                max_size (tuple): If set, shrink images to fit within (width, height) pixels.
+                max_packets (int): If set, choose each image's size and quality to fit this many packets.
+                processes (int): Number of encoder processes. Defaults to the number of CPUs.
+                status_callback (function): Called with a status message as each image finishes. Called
+                    from a background thread, which it should not block for long.
+        """
+        self.ssdv_tx = ssdv_tx
+        self.callsign = callsign
+        self.quality = quality
+        self.fec = fec
+        self.max_size = max_size
+        self.max_packets = max_packets
+        self.status_callback = status_callback
+
+        # Imported here, as the process pool machinery is slow to import and the headless commands need to start quickly.
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Workers are spawned rather than forked, as the GUI is multi-threaded.
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+        # Submitted images, in order, as [image ID, filename, future, cache key or None],
+        # for delivery to the ready queue in order.
+        self._order = deque()
+        self._lock = threading.Lock()
+
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+
+
+    @property
+    def pending(self):
+        """ Number of images submitted which have not been delivered to the ready queue yet """
+        with self._lock:
+            return len(self._order)
+
+
+    def load(self, paths):
+        """ Start encoding images, from a list of directories, glob patterns or filenames. Does not block.
+
+            Returns:
+                list: The image IDs assigned, in order.
+        """
+        from concurrent.futures import Future
+
+        _filenames = [_filename for _path in paths for _filename in find_images(_path)]
+
+        # Each image gets a future up front, which is completed from the cache or by an encoder process.
+        _submitted = []
+        with self._lock:
+            self.total += len(_filenames)
+            for _filename in _filenames:
+                _entry = [self.ssdv_tx.reserve_image_id(), _filename, Future(), None]
+                self._order.append(_entry)
+                _submitted.append(_entry)
+
+        for _entry in _submitted:
+            _entry[2].add_done_callback(self._finished)
+
+        # Files are hashed and looked up in the cache on a separate thread, as hashing a folder of
+        # large images would otherwise hold up the caller (the GUI thread, when loading a folder).
+        threading.Thread(target=self._submit, args=(_submitted,), daemon=True).start()
+
+        logging.info(f"Encoding {len(_submitted)} images.")
+        return [_entry[0] for _entry in _submitted]
+
+
+    def _submit(self, entries):
+        """ Complete images found in the cache, and pass the rest to the encoder processes """
+        _cache = self.ssdv_tx.cache
+        for _entry in entries:
+            _image_id, _filename, _future, _key = _entry
+
+            _cached = None
+            if _cache is not None:
+                try:
+                    _key = cache_key(file_digest(_filename), self.callsign, self.quality, self.fec, self.max_size,
+                        self.max_packets)
+                    _cached = _cache.get(_key, _image_id)
+                except OSError as e:
+                    # Left for the encoder to report.
+                    logging.debug(f"Could not hash {_filename}: {str(e)}")
+
+            if _cached is not None:
+                _future.set_result((_cached['packets'], _cached['settings']))
+                continue
+
+            # Only set when the image is encoded, so it is added to the cache once done.
+            _entry[3] = _key
+            try:
+                _encoding = self._executor.submit(encode_file, _filename, self.callsign, _image_id,
+                    self.quality, self.fec, self.max_size, self.max_packets)
+            except RuntimeError as e:
+                # The loader has been stopped.
+                _future.set_exception(e)
+                continue
+
+            _encoding.add_done_callback(lambda _done, _future=_future: self._copy_result(_done, _future))
+
+
+    @staticmethod
+    def _copy_result(source, target):
+        """ Complete an image's future with the result of its encoder process """
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+
+    def _finished(self, future):
+        """ Deliver finished images to the ready queue, in the order they were submitted """
+        _delivered = []
+        _cached = []
+        _statuses = []
+        with self._lock:
+            while self._order and self._order[0][2].done():
+                _delivered.append(self._order.popleft())
+
+            # Delivered under the lock, so two callbacks can't interleave their images.
+            for _image_id, _filename, _future, _key in _delivered:
+                _name = os.path.basename(_filename)
+                try:
+                    _packets, _settings = _future.result()
+                    _status = self.ssdv_tx.store_image(_image_id, _packets, name=_name,
+                        callsign=self.callsign, quality=self.quality, settings=_settings)
+                    self.ssdv_tx.ready_queue.put(_image_id)
+                    if _key:
+                        _cached.append((_key, _packets, _image_id, self.ssdv_tx.image_store[_image_id]['quality'],
+                            _name, _settings))
+                except Exception as e:
+                    _status = f"Could not encode {_name}: {str(e)}"
+                    logging.error(_status)
+                    self.failed += 1
+
+                self.done += 1
+                _statuses.append(f"{_status} ({self.done}/{self.total})")
+
+        # Writing to the cache and the status callback may be slow, so are left until the lock is released.
+        for _key, _packets, _image_id, _quality, _name, _settings in _cached:
+            self.ssdv_tx.cache.put(_key, _packets, self.callsign, _image_id, _quality, name=_name, settings=_settings)
+
+        if self.status_callback:
+            for _status in _statuses:
+                self.status_callback(_status)
+
+
+    def stop(self, wait=True):
+        """ Shut down the encoder processes. Images not yet started are dropped. """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
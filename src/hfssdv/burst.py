@@ -0,0 +1,132 @@
+#
+#   Burst Framing
+#
+#   Packs several SSDV packets (and/or resend requests) into one TNC frame,
+#   so the modem's per-frame preamble and sync overhead is paid once per
+#   burst rather than once per packet.
+#
+#   Burst format (following the TNC port byte, in a KISS frame):
+#       1 byte      - BURST_HEADER (0x5A)
+#       1 byte      - Number of items
+#       Items, each:
+#           2 bytes - Item length (big-endian)
+#           N bytes - Item - a SSDV packet or resend request, as it would be sent on its own
+#
+#   Receivers unpack bursts with iter_frames(), which yields each item as if
+#   it had arrived in its own KISS frame, so the rest of the receive path is
+#   unchanged.
+#
+
+import struct
+
+BURST_HEADER = 0x5A
+
+# Bytes added by the container - the burst header, and each item's length.
+BURST_HEADER_SIZE = 2
+BURST_ITEM_HEADER_SIZE = 2
+
+# At most 255 items, so the item count fits in a byte.
+BURST_MAX_ITEMS = 255
+
+_ITEM_LENGTH = struct.Struct('>H')
+
+
+def is_burst(frame):
+    """ Check if a KISS frame (including the TNC port byte) holds a burst """
+    return len(frame) > BURST_HEADER_SIZE and frame[1] == BURST_HEADER
+
+
+def pack_burst(items):
+    """ Pack a list of packets into a burst (without the TNC port byte) """
+    if len(items) > BURST_MAX_ITEMS:
+        raise ValueError(f"Too many items for a burst: {len(items)}")
+
+    _parts = [bytes([BURST_HEADER, len(items)])]
+    for _item in items:
+        _parts.append(_ITEM_LENGTH.pack(len(_item)))
+        _parts.append(bytes(_item))
+    return b''.join(_parts)
+
+
+def unpack_burst(burst):
+    """ Unpack a burst (without the TNC port byte) into a list of packets.
+
+        Raises ValueError if the burst is malformed.
+    """
+    if len(burst) < BURST_HEADER_SIZE or burst[0] != BURST_HEADER:
+        raise ValueError("Not a burst")
+
+    _items = []
+    _offset = BURST_HEADER_SIZE
+    for _i in range(burst[1]):
+        if _offset + BURST_ITEM_HEADER_SIZE > len(burst):
+            raise ValueError("Truncated burst")
+        _length, = _ITEM_LENGTH.unpack_from(burst, _offset)
+        _offset += BURST_ITEM_HEADER_SIZE
+        if _offset + _length > len(burst):
+            raise ValueError("Truncated burst")
+        _items.append(bytes(burst[_offset:_offset + _length]))
+        _offset += _length
+
+    return _items
+
+
+def iter_frames(frame):
+    """ Yield the frames within a KISS frame - each item of a burst, with the burst's TNC port byte, or the frame itself """
+    if not is_burst(frame):
+        yield frame
+        return
+
+    _port = bytes(frame[:1])
+    for _item in unpack_burst(frame[1:]):
+        yield _port + _item
+
+
+def burst_items(sizes, burst_size):
+    """ Split items into bursts of at most burst_size bytes, in order.
+
+        Args:
+            sizes (list): Length of each item (bytes).
+            burst_size (int): Maximum burst length (bytes), including the container overhead.
+                An item too big for a burst on its own gets a burst to itself.
+
+        Returns:
+            list: (start, end) index ranges of the items in each burst.
+    """
+    _bursts = []
+    _start = 0
+    _length = BURST_HEADER_SIZE
+    for _i, _size in enumerate(sizes):
+        _item = BURST_ITEM_HEADER_SIZE + _size
+        if _i > _start and (_length + _item > burst_size or _i - _start >= BURST_MAX_ITEMS):
+            _bursts.append((_start, _i))
+            _start = _i
+            _length = BURST_HEADER_SIZE
+        _length += _item
+
+    if _start < len(sizes):
+        _bursts.append((_start, len(sizes)))
+    return _bursts
+
+
+def burst_frames(items, burst_size=None):
+    """ Group packets into the frames to send to the TNC.
+
+        Args:
+            items (list): Packets to send, in order.
+            burst_size (int): Maximum burst length (bytes). If None, each packet is sent on its own.
+
+        Returns:
+            list: (frame, number of items in the frame) tuples. Bursts of one item are sent as the bare
+                item, so they can still be received by stations without burst support.
+    """
+    if not burst_size:
+        return [(_item, 1) for _item in items]
+
+    _frames = []
+    for _start, _end in burst_items([len(_item) for _item in items], burst_size):
+        if _end - _start == 1:
+            _frames.append((items[_start], 1))
+        else:
+            _frames.append((pack_burst(items[_start:_end]), _end - _start))
+    return _frames
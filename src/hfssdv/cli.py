@@ -0,0 +1,415 @@
+#
+#   HF SSDV Headless Commands
+#
+#   hfssdv-rx - Receive images from one or more KISS TNCs, writing them to a directory.
+#   hfssdv-tx - Transmit images (or folders of images) through a KISS TNC, and answer resend requests.
+#
+#   Nothing here imports PyQt5 or pyqtgraph, so these start quickly on headless nodes.
+#   asyncio, argparse and the KISS client are only imported once a command runs, as
+#   they take most of the time to import.
+#
+
+import logging
+import os
+import queue
+from .arq import *
+from .batch import *
+from .burst import *
+from .journal import *
+from .packets import *
+from .pacing import *
+from .receive import *
+from .transmit import *
+
+
+def parse_tnc(text):
+    """ Parse a HOST:PORT TNC address into a (host, port) tuple """
+    import argparse
+
+    _host, _sep, _port = text.rpartition(':')
+    try:
+        return (_host if _sep else 'localhost', int(_port))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid TNC address: {text}")
+
+
+def parse_size(text):
+    """ Parse a WIDTHxHEIGHT image size into a (width, height) tuple """
+    import argparse
+
+    try:
+        _width, _height = [int(_v) for _v in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid image size: {text}")
+    return (_width, _height)
+
+
+def setup_logging(verbose=False):
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s',
+        level=logging.DEBUG if verbose else logging.INFO
+    )
+
+
+class RXDaemon(object):
+    """ Headless receiver - writes decoded images to a directory, and optionally requests resends. """
+
+    def __init__(self, links, output_dir=".", callsign=None, resend_timeout=None, stats_interval=None, ssdv_rx=None,
+        burst_size=None, max_rounds=5, end_delay=15.0):
+        """
+            Args:
+                links (list): KISSClient objects, or (host, port) tuples.
+                output_dir (str): Directory to write decoded images to.
+                callsign (str): Our callsign, used as the source of resend requests.
+                resend_timeout (float): If set, request resends of incomplete images automatically (see
+                    arq.py) - once no packets have been heard for an image for this many seconds, or end_delay
+                    seconds after its end was heard. Unanswered requests are repeated after twice this.
+                stats_interval (float): If set, log per-link statistics at this interval (seconds).
+                ssdv_rx (SSDVRX): Receiver to use. A new one is created if not supplied.
+                burst_size (int): If set, resend requests due at the same time are sent together, in
+                    bursts of up to this many bytes.
+                max_rounds (int): Most resend requests to make per image.
+                end_delay (float): Seconds to wait after the last packet of an image (or of a resend) is
+                    heard before requesting its missing packets.
+        """
+        from .aggregator import RXAggregator
+
+        self.aggregator = RXAggregator(links, ssdv_rx=ssdv_rx, callback=self.handle_update, stats_interval=stats_interval)
+        self.ssdv_rx = self.aggregator.ssdv_rx
+        self.output_dir = output_dir
+        self.callsign = callsign
+        self.resend_timeout = resend_timeout
+        self.burst_size = burst_size
+
+        self.arq = None
+        if resend_timeout:
+            self.arq = ARQRequester(self.ssdv_rx, callsign, end_delay=end_delay, idle_timeout=resend_timeout,
+                retry_timeout=2 * resend_timeout, max_rounds=max_rounds)
+
+
+    def image_filename(self, image):
+        return os.path.join(self.output_dir, f"{image.time}_{image.callsign}_{image.id}.jpg")
+
+
+    def handle_update(self, resp):
+        """ Handle the result of SSDVRX.addPacket """
+        if self.arq:
+            self.arq.heard(resp)
+
+        for _resp in iter_responses(resp):
+            if _resp['type'] == 'image_update':
+                _image = _resp['latest']
+                self.ssdv_rx.decode(_image, outfile=self.image_filename(_image))
+
+            elif _resp['type'] == 'resend':
+                logging.info(f"Heard resend request for {_resp['data']['dst_call']} image {_resp['data']['img_id']}.")
+
+
+    async def check_resends(self):
+        """ Request resends for incomplete images which have gone quiet """
+        _requests = self.arq.due()
+        for _frame, _count in burst_frames(_requests, self.burst_size):
+            await self.aggregator.links[0].write(_frame)
+
+
+    async def _resend_loop(self):
+        import asyncio
+
+        while True:
+            await asyncio.sleep(1.0)
+            await self.check_resends()
+
+
+    async def _compact_loop(self):
+        """ Compact the journal from time to time, between packets rather than as they are written """
+        import asyncio
+
+        while True:
+            await asyncio.sleep(60.0)
+            self.ssdv_rx.journal.compact_if_due()
+
+
+    async def run(self):
+        """ Receive until cancelled """
+        import asyncio
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        _tasks = [asyncio.ensure_future(self.aggregator.run())]
+        if self.resend_timeout:
+            _tasks.append(asyncio.ensure_future(self._resend_loop()))
+        if self.ssdv_rx.journal:
+            _tasks.append(asyncio.ensure_future(self._compact_loop()))
+
+        try:
+            await asyncio.gather(*_tasks)
+        finally:
+            for _task in _tasks:
+                _task.cancel()
+            await asyncio.gather(*_tasks, return_exceptions=True)
+
+
+class TXDaemon(object):
+    """ Headless transmitter - sends a list of images, and optionally answers resend requests. """
+
+    def __init__(self, tnc, callsign="N0CALL", quality=4, fec=False, delay=7, max_size=None, processes=None,
+        time_budget=None, cache=None, pacer=None, burst_size=None, fountain_overhead=None, allowlist=None,
+        max_rounds=None, min_interval=None, max_resend_packets=None):
+        """
+            Args:
+                tnc (KISSClient): TNC to transmit through.
+                callsign (str): Our callsign.
+                quality (int): SSDV quality level, 0-7.
+                fec (bool): Transmit FEC (Reed-Solomon) packets.
+                delay (float): Delay between packets (seconds).
+                max_size (tuple): If set, shrink images to fit within (width, height) pixels.
+                processes (int): Number of image encoder processes. Defaults to the number of CPUs.
+                time_budget (float): If set, pick each image's size and quality so it transmits
+                    within this many seconds. quality is then ignored.
+                cache (PacketCache): If set, encoded images are cached here, and resend requests for
+                    images sent before a restart are answered from it.
+                pacer (TransmitPacer): If set, pace packets to the modem's bitrate, rather than waiting delay between them.
+                burst_size (int): If set, send several packets per TNC frame, in frames of up to this many bytes.
+                fountain_overhead (float): If set, follow each image with this fraction of its packet count in
+                    fountain-coded repair packets. Counted against time_budget.
+                allowlist (list): If set, only answer resend requests from these callsigns.
+                max_rounds (int): If set, answer at most this many resend requests per station per image.
+                min_interval (float): If set, ignore repeats of a station's resend request within this many seconds.
+                max_resend_packets (int): If set, resend at most this many packets per hour.
+        """
+        self.tnc = tnc
+        self.callsign = callsign
+        self.quality = quality
+        self.fec = fec
+        self.delay = delay
+        self.max_size = max_size
+        self.processes = processes
+        # Time to send each packet - the modem's airtime per packet, if we are pacing to it.
+        _packet_time = pacer.airtime(SSDV_PACKET_SIZE) if pacer else delay
+        _packet_time *= 1 + (fountain_overhead or 0)
+        self.max_packets = max(1, int(time_budget // _packet_time)) if time_budget else None
+
+        self.ssdv_tx = SSDVTX(cache=cache, pacer=pacer, burst_size=burst_size, fountain_overhead=fountain_overhead)
+        self.arq = ARQResponder(self.ssdv_tx, callsign, allowlist=allowlist, max_rounds=max_rounds,
+            min_interval=min_interval, max_packets=max_resend_packets)
+
+
+    def handle_frame(self, frame):
+        """ Check a received frame for a resend request, returning (image ID, packet list) to resend, or None """
+        if not is_resend_packet(frame[1:]):
+            return None
+
+        try:
+            _request = decode_resend_packet(frame[1:])
+        except Exception as e:
+            logging.error(f"Could not decode resend request: {str(e)}")
+            return None
+
+        logging.info(f"Got resend request: {str(_request)}")
+
+        _packets = self.arq.handle(_request)
+        if not _packets:
+            return None
+
+        return (_request['img_id'], _packets)
+
+
+    async def transmit_images(self, paths):
+        """ Transmit images, in order. They are encoded in the background, while earlier images are sent. """
+        import asyncio
+
+        _loader = BatchLoader(self.ssdv_tx, self.callsign, self.quality, self.fec,
+            max_size=self.max_size, max_packets=self.max_packets, processes=self.processes)
+        try:
+            _loader.load(paths)
+
+            while _loader.pending or not self.ssdv_tx.ready_queue.empty():
+                try:
+                    self.ssdv_tx.current_image = self.ssdv_tx.ready_queue.get_nowait()
+                except queue.Empty:
+                    # Waiting on the encoder.
+                    await asyncio.sleep(0.1)
+                    continue
+
+                await self.ssdv_tx.transmit_current_image_async(self.tnc, self.delay)
+        finally:
+            _loader.stop(wait=False)
+
+
+    async def answer_resends(self):
+        """ Answer resend requests until cancelled """
+        while True:
+            _frame = await self.tnc.read()
+            try:
+                _frames = list(iter_frames(_frame))
+            except ValueError as e:
+                logging.error(f"Discarding malformed burst: {str(e)}")
+                continue
+
+            for _frame in _frames:
+                _resend = self.handle_frame(_frame)
+                if _resend:
+                    await self.ssdv_tx.transmit_image_subset_async(_resend[0], _resend[1], self.tnc, self.delay)
+
+
+    async def run(self, filenames, listen=False):
+        """ Transmit the supplied images, then answer resend requests if listen is set """
+        self.tnc.start()
+        try:
+            await self.tnc.connected.wait()
+            await self.transmit_images(filenames)
+            if listen:
+                await self.answer_resends()
+            await self.tnc.flush()
+        finally:
+            await self.tnc.stop()
+
+
+def rx_main(args=None):
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Receive SSDV images from one or more KISS TNCs.")
+    parser.add_argument("--tnc", type=parse_tnc, action="append", metavar="HOST:PORT",
+        help="KISS TNC to receive from. May be given more than once. (default: localhost:8001)")
+    parser.add_argument("-o", "--output", default="rx_images", help="Directory to write received images to. (default: rx_images)")
+    parser.add_argument("-c", "--callsign", default=None, help="Our callsign, required to send resend requests.")
+    parser.add_argument("--resend-timeout", type=float, default=None,
+        help="Request resends of incomplete images automatically, after this many quiet seconds. (default: disabled)")
+    parser.add_argument("--end-delay", type=float, default=15.0,
+        help="Request a resend this many seconds after the last packet of an image, or of a resend, is heard. "
+        "Must be longer than the time between packets. (default: 15)")
+    parser.add_argument("--max-rounds", type=int, default=5, help="Most resend requests to make per image. (default: 5)")
+    parser.add_argument("--stats", type=float, default=None, help="Log per-TNC statistics at this interval (seconds).")
+    parser.add_argument("--max-images", type=int, default=100, help="Maximum number of images to hold in memory. (default: 100)")
+    parser.add_argument("--max-age", type=float, default=None,
+        help="Drop images from memory once they have not been updated for this many seconds. (default: disabled)")
+    parser.add_argument("--archive", default=None, help="Write the packets of images dropped from memory to this directory.")
+    parser.add_argument("--import", dest="import_files", action="append", default=[], metavar="FILE",
+        help="Load the packets from a SSDV .bin file (e.g. from --archive) into the image store on startup. May be given more than once.")
+    parser.add_argument("--journal", default=None,
+        help="Journal received packets to this file, and rebuild the image store from it on startup.")
+    parser.add_argument("--burst-size", type=int, default=None, metavar="BYTES",
+        help="Send resend requests due at the same time together, in TNC frames of up to this many bytes. (default: disabled)")
+    parser.add_argument("--resend-v1", action="store_true", default=False,
+        help="Send resend requests in the original format, for senders without compact request support. "
+        "Only the first 120 missing packets are requested at a time.")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Verbose output.")
+    args = parser.parse_args(args)
+
+    setup_logging(args.verbose)
+
+    if args.resend_timeout and not args.callsign:
+        parser.error("--resend-timeout requires --callsign.")
+
+    _journal = PacketJournal(args.journal) if args.journal else None
+    _ssdv_rx = SSDVRX(max_images=args.max_images, max_age=args.max_age, archive_dir=args.archive, journal=_journal,
+        resend_version=1 if args.resend_v1 else 2)
+    for _filename in args.import_files:
+        with open(_filename, 'rb') as _f:
+            logging.info(f"Imported {_ssdv_rx.importPackets(_f.read())} packets from {_filename}.")
+    if _journal:
+        _journal.replay(_ssdv_rx)
+
+    _daemon = RXDaemon(
+        args.tnc if args.tnc else [('localhost', 8001)],
+        output_dir=args.output,
+        callsign=args.callsign,
+        resend_timeout=args.resend_timeout,
+        stats_interval=args.stats,
+        ssdv_rx=_ssdv_rx,
+        burst_size=args.burst_size,
+        max_rounds=args.max_rounds,
+        end_delay=args.end_delay
+    )
+
+    try:
+        asyncio.run(_daemon.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _daemon.aggregator.log_stats()
+        if _daemon.arq:
+            logging.info(f"ARQ summary: {_daemon.arq.summary()}")
+        if _journal:
+            _journal.close()
+
+
+def tx_main(args=None):
+    import argparse
+    import asyncio
+    from .kiss import KISSClient
+
+    parser = argparse.ArgumentParser(description="Transmit images as SSDV through a KISS TNC.")
+    parser.add_argument("images", nargs="*",
+        help="Image files, directories or glob patterns to transmit, in order. Images are encoded in parallel.")
+    parser.add_argument("--tnc", type=parse_tnc, default=('localhost', 8001), metavar="HOST:PORT",
+        help="KISS TNC to transmit through. (default: localhost:8001)")
+    parser.add_argument("-c", "--callsign", required=True, help="Our callsign.")
+    parser.add_argument("-q", "--quality", type=int, default=4, choices=range(8), help="SSDV quality level, 0-7. (default: 4)")
+    parser.add_argument("--fec", action="store_true", default=False, help="Transmit FEC (Reed-Solomon) packets.")
+    parser.add_argument("-d", "--delay", type=float, default=7, help="Delay between packets (seconds). (default: 7)")
+    parser.add_argument("--bitrate", type=float, default=None,
+        help="Modem bitrate (bits/s). If set, packets are paced to keep the TNC just busy, instead of using --delay.")
+    parser.add_argument("--modem-frame", type=int, default=None, metavar="BYTES",
+        help="Modem frame payload size, for modems with fixed-size frames (e.g. FreeDV data modes). (default: none)")
+    parser.add_argument("--frame-overhead", type=float, default=0.0, metavar="SECONDS",
+        help="Preamble/sync time per modem frame. (default: 0)")
+    parser.add_argument("--burst-size", type=int, default=None, metavar="BYTES",
+        help="Send several packets per TNC frame, in frames of up to this many bytes, to save per-frame modem "
+        "overhead. Receivers must support bursts. (default: one packet per frame)")
+    parser.add_argument("--fountain", type=float, default=None, metavar="OVERHEAD",
+        help="Follow each image with fountain-coded repair packets, this fraction of its packet count (e.g. 0.1), "
+        "so receivers can rebuild lost packets without a resend request. Receivers must support them. (default: none)")
+    parser.add_argument("--max-size", type=parse_size, default=None, metavar="WxH",
+        help="Shrink images to fit within this size (pixels). (default: only limit to the SSDV maximum)")
+    parser.add_argument("--processes", type=int, default=None,
+        help="Number of image encoder processes. (default: number of CPUs)")
+    parser.add_argument("--time-budget", type=float, default=None, metavar="SECONDS",
+        help="Pick each image's size and quality so it transmits within this many seconds. Overrides --quality.")
+    parser.add_argument("--cache", default=None, metavar="DIR",
+        help="Cache encoded images in this directory, so re-sent images are not re-encoded, and resend requests "
+        "can be answered after a restart. (default: disabled)")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_BYTES / 1e6, metavar="MB",
+        help=f"Maximum size of the cache (MB). (default: {DEFAULT_CACHE_BYTES / 1e6:.0f})")
+    parser.add_argument("--listen", action="store_true", default=False,
+        help="After transmitting, stay running and answer resend requests.")
+    parser.add_argument("--allow", action="append", default=None, metavar="CALLSIGN",
+        help="Only answer resend requests from this callsign. May be given more than once. (default: answer anyone)")
+    parser.add_argument("--max-rounds", type=int, default=None,
+        help="Answer at most this many resend requests per station per image. (default: no limit)")
+    parser.add_argument("--min-interval", type=float, default=None, metavar="SECONDS",
+        help="Ignore repeats of a station's resend request for an image within this many seconds. (default: disabled)")
+    parser.add_argument("--resend-limit", type=int, default=None, metavar="PACKETS",
+        help="Resend at most this many packets per hour. (default: no limit)")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Verbose output.")
+    args = parser.parse_args(args)
+
+    setup_logging(args.verbose)
+
+    if not args.images and not args.listen:
+        parser.error("No images to transmit.")
+
+    _daemon = TXDaemon(
+        KISSClient(host=args.tnc[0], port=args.tnc[1]),
+        callsign=args.callsign,
+        quality=args.quality,
+        fec=args.fec,
+        delay=args.delay,
+        max_size=args.max_size,
+        processes=args.processes,
+        time_budget=args.time_budget,
+        cache=PacketCache(args.cache, max_bytes=int(args.cache_size * 1e6)) if args.cache else None,
+        pacer=TransmitPacer(args.bitrate, modem_frame=args.modem_frame, frame_overhead=args.frame_overhead) if args.bitrate else None,
+        burst_size=args.burst_size,
+        fountain_overhead=args.fountain,
+        allowlist=args.allow,
+        max_rounds=args.max_rounds,
+        min_interval=args.min_interval,
+        max_resend_packets=args.resend_limit
+    )
+
+    try:
+        asyncio.run(_daemon.run(args.images, listen=args.listen))
+    except KeyboardInterrupt:
+        pass
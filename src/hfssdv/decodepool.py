@@ -0,0 +1,164 @@
+#
+#   Process Pool Decode Backend
+#
+#   Decodes received images in worker processes, so images from several
+#   stations can be decoded on several cores at once. Used by a
+#   DecodeScheduler in place of decoding in-process.
+#
+#   Each image's packet slab is copied into a shared memory block, and only
+#   the block's name is sent to the worker, so packets are never pickled.
+#   Each image is always decoded by the same worker, which keeps the image's
+#   SSDVDecoder between decodes, so decoding stays incremental - a worker only
+#   decodes the packets which have arrived since it last saw the image.
+#
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from .packets import *
+
+
+# Worker process state - (callsign, image ID, epoch) -> SSDVDecoder, and shared memory name -> SharedMemory.
+_worker_decoders = {}
+_worker_blocks = {}
+
+
+def _worker_attach(name):
+    """ Attach to a shared memory block created by the parent process """
+    _block = _worker_blocks.get(name)
+    if _block is None:
+        # Workers share the parent's resource tracker, so the block is still only unlinked by the parent.
+        _block = shared_memory.SharedMemory(name=name)
+        _worker_blocks[name] = _block
+    return _block
+
+
+def _worker_decode(key, name, length):
+    """ Decode an image from its packets in shared memory. Runs in a worker process.
+
+        Returns:
+            tuple: (JPEG bytes, changed region)
+    """
+    from .decoder import SSDVDecoder
+
+    _decoder = _worker_decoders.get(key)
+    if _decoder is None:
+        _decoder = _worker_decoders[key] = SSDVDecoder()
+
+    _view = _worker_attach(name).buf
+    try:
+        for _offset in range(0, length - SSDV_PACKET_SIZE + 1, SSDV_PACKET_SIZE):
+            # Empty slots are zero-filled.
+            if _view[_offset] == SSDV_HEADER and (_offset // SSDV_PACKET_SIZE) not in _decoder.packets:
+                _decoder.add_packet(bytes(_view[_offset:_offset + SSDV_PACKET_SIZE]))
+    finally:
+        del _view
+
+    return (_decoder.get_jpeg(), _decoder.take_region())
+
+
+def _worker_forget(key, names):
+    """ Drop an image's decoder, and detach from shared memory blocks which are no longer used """
+    _worker_decoders.pop(key, None)
+    for _name in names:
+        _block = _worker_blocks.pop(_name, None)
+        if _block is not None:
+            _block.close()
+
+
+class ProcessDecodeBackend(object):
+    """ Decode images in a pool of worker processes """
+
+    def __init__(self, processes=2):
+        """
+            Args:
+                processes (int): Number of worker processes.
+        """
+        # One single-process pool per worker, so each image always goes to the worker holding its decoder.
+        # Workers are spawned rather than forked, as the receiver is multi-threaded.
+        _context = multiprocessing.get_context('spawn')
+        self._pools = [ProcessPoolExecutor(max_workers=1, mp_context=_context) for _i in range(processes)]
+
+        # Image key -> (shared memory block, worker index).
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+
+    def _key(self, image):
+        return (image.callsign, image.id, image.epoch)
+
+
+    def _block(self, image, size):
+        """ Return the shared memory block for an image, and its worker, making sure the block has room for size bytes.
+
+            Returns:
+                tuple: (block, worker index, old block to release or None)
+        """
+        _key = self._key(image)
+        with self._lock:
+            _block, _worker = self._blocks.get(_key, (None, hash(_key) % len(self._pools)))
+            _old = None
+            if _block is None or _block.size < size:
+                # The slab has grown - move to a bigger block.
+                _old = _block
+                _block = shared_memory.SharedMemory(create=True, size=size)
+                self._blocks[_key] = (_block, _worker)
+        return (_block, _worker, _old)
+
+
+    def decode(self, image):
+        """ Decode an image in a worker process. Blocks until the decode is done.
+
+            Returns:
+                tuple: (JPEG bytes, changed region), or None if the image could not be decoded.
+        """
+        # The receive thread replaces the slab when it grows, so only look it up once.
+        _slab = image.slab
+        _length = len(_slab)
+
+        _block, _worker, _old = self._block(image, _length)
+        _pool = self._pools[_worker]
+
+        if _old is not None:
+            self._release(_worker, None, _old)
+
+        try:
+            # Copy the slab across - a single memcpy.
+            _block.buf[:_length] = _slab
+            return _pool.submit(_worker_decode, self._key(image), _block.name, _length).result()
+        except Exception as e:
+            logging.error(f"Could not decode image: {str(e)}")
+            return None
+
+
+    def _release(self, worker, key, block):
+        """ Have a worker drop an image's decoder (if key is set) and detach from a block, then free the block """
+        try:
+            self._pools[worker].submit(_worker_forget, key, [block.name]).result()
+        except Exception as e:
+            logging.error(f"Could not release decode worker state: {str(e)}")
+        block.close()
+        block.unlink()
+
+
+    def prune(self, image_store):
+        """ Free the worker state and shared memory held for images which are no longer in the image store """
+        with self._lock:
+            _gone = [_key for _key in self._blocks if _key not in image_store]
+            _entries = [(_key, self._blocks.pop(_key)) for _key in _gone]
+
+        for _key, (_block, _worker) in _entries:
+            self._release(_worker, _key, _block)
+
+
+    def stop(self):
+        for _pool in self._pools:
+            _pool.shutdown(wait=True)
+
+        with self._lock:
+            for _block, _worker in self._blocks.values():
+                _block.close()
+                _block.unlink()
+            self._blocks = {}
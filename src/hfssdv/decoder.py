@@ -0,0 +1,537 @@
+#
+#   SSDV Decoder
+#
+#   Rebuilds a JPEG from a set of SSDV packets in-process, without
+#   shelling out to the ssdv binary.
+#
+#   The entropy-coded data in a SSDV payload uses the same Huffman tables as
+#   the JPEG we produce, so AC coefficients are copied through as-is. Only the
+#   DC values need re-coding: the first MCU starting in each packet carries
+#   absolute DC values (so a packet can be decoded after a gap), and missing
+#   MCUs are filled by repeating the previous DC value.
+#
+#   Decoding is incremental: Huffman state is kept at each packet boundary, so
+#   a new packet only decodes the MCUs it contributes.
+#
+
+import io
+import logging
+import numpy as np
+from PIL import Image
+from .jpeg import *
+from .packets import *
+
+
+class SSDVDecodeError(Exception):
+    pass
+
+
+def _payload_length(packet):
+    """ Length of the payload section for a packet, based on its type byte """
+    if packet[1] == SSDV_TYPE_FEC:
+        return SSDV_PAYLOAD_FEC
+    else:
+        return SSDV_PAYLOAD_NOFEC
+
+
+def _bit_string(data):
+    """ Convert bytes into a string of '0'/'1' characters """
+    if not data:
+        return ''
+    return format(int.from_bytes(data, 'big'), '0%db' % (len(data) * 8))
+
+
+def _fill(values, valid):
+    """ Carry the last decoded DC value forward over missing blocks. """
+    _idx = np.where(valid, np.arange(len(values)), -1)
+    np.maximum.accumulate(_idx, out=_idx)
+    return np.where(_idx >= 0, values[np.maximum(_idx, 0)], 0)
+
+
+def _dc_diff(values):
+    """ Convert absolute DC values into JPEG DC differences. """
+    return np.clip(np.diff(values, prepend=0), -2047, 2047)
+
+
+class _Segment(object):
+    """ A run of entropy-coded data, starting at an MCU boundary marked in a packet header.
+
+        The segment continues through consecutive packets until the next marked
+        MCU. Decoding state is kept at the last complete MCU, so it can be
+        resumed as more packets arrive.
+    """
+    __slots__ = ('mcu_id', 'bits', 'next_packet', 'limit', 'count', 'dc', 'failed')
+
+    def __init__(self, mcu_id, bits, next_packet, limit):
+        self.mcu_id = mcu_id
+        # Undecoded data, from the end of the last complete MCU.
+        self.bits = bits
+        # Packet ID needed to extend this segment, or None if the segment is complete.
+        self.next_packet = next_packet
+        # Maximum number of MCUs in this segment.
+        self.limit = limit
+        # Number of MCUs decoded so far, and the DC predictors after the last one.
+        self.count = 0
+        self.dc = [0, 0, 0]
+        self.failed = False
+
+
+class SSDVDecoder(object):
+    """ Reassemble a JPEG image from SSDV packets.
+
+        Decoding is incremental - each new packet only decodes the MCUs it
+        contributes. The JPEG output is cached, packed, up to the last MCU
+        decoded, and only re-packed from the first MCU that changes, so for a
+        linear reception each get_jpeg() only encodes the newly arrived MCUs.
+        (Assembling the output is still a copy of the whole JPEG.)
+    """
+
+    def __init__(self, packets=None, store=None):
+        """
+            Args:
+                packets: SSDV packets to decode - an iterable of 256-byte packets, or one buffer of
+                    concatenated packets (such as SSDVImage.buffer()), in which zero-filled gaps are skipped.
+                store: Where the packets are already held, as a mapping of packet ID to packet (such
+                    as a SSDVImage). If not supplied, the decoder keeps its own copy of each packet.
+        """
+
+        # Packet ID -> 256-byte SSDV packet.
+        self.packets = {} if store is None else store
+        self._copy = store is None
+        # IDs of the packets added so far.
+        self._added = set()
+
+        # Image parameters, populated from the first packet.
+        self.width = None
+        self.height = None
+        self.quality = None
+        self.mode = None
+        self.mcu_count = None
+        self.ycparts = None
+
+        # Incomplete segments, by the packet ID they are waiting on.
+        self._waiting = {}
+
+        # Pixel region (x, y, width, height) changed since take_region() was last called.
+        self._region = None
+
+        if isinstance(packets, (bytes, bytearray, memoryview)):
+            _view = memoryview(packets)
+            for _offset in range(0, len(_view) - SSDV_PACKET_SIZE + 1, SSDV_PACKET_SIZE):
+                if _view[_offset] == SSDV_HEADER:
+                    self.add_packet(_view[_offset:_offset + SSDV_PACKET_SIZE])
+
+        elif packets:
+            for _packet in packets:
+                self.add_packet(_packet)
+
+
+    def _setup(self, width, height, quality, mode):
+        """ Allocate decode state once the image parameters are known """
+        _h, _v = SSDV_MCU_MODES[mode]
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.mode = mode
+        self.ycparts = _h * _v
+        self.mcu_width = 8 * _h
+        self.mcu_height = 8 * _v
+        self.mcu_count = (width // self.mcu_width) * (height // self.mcu_height)
+
+        _blocks = self.ycparts + 2
+
+        # Decoded MCUs - a list of (absolute DC, AC bit string) per block, or None if missing.
+        self._mcus = [None] * self.mcu_count
+        self._dc = np.zeros((self.mcu_count, _blocks), dtype=np.int32)
+        self._valid = np.zeros(self.mcu_count, dtype=bool)
+        self._new = []
+
+        # JPEG output state, as of the last get_jpeg() call.
+        self._header = jpeg_header(width, height, quality, mode)
+        self._filled = np.zeros((self.mcu_count, _blocks), dtype=np.int32)
+        self._diffs = np.zeros((self.mcu_count, _blocks), dtype=np.int32)
+
+        _dc_luma, _ac_luma, _dc_chroma, _ac_chroma = huffman_tables()
+        self._dc_tables = [_dc_luma] * self.ycparts + [_dc_chroma, _dc_chroma]
+        self._eob = [_ac_luma.encode[0x00]] * self.ycparts + [_ac_chroma.encode[0x00]] * 2
+        # Bits for a missing MCU following its neighbour's DC values - as every MCU after the last decoded one is.
+        self._missing = ''.join(self._dc_tables[_b].dc_code(0) + self._eob[_b] for _b in range(_blocks))
+        self._mcu_bits = [self._missing] * self.mcu_count
+
+        # Packed entropy-coded data for MCUs up to self._packed_mcu, less the bits that don't fill a byte.
+        self._packed = bytearray()
+        self._packed_bits = ''
+        self._packed_mcu = 0
+        # (packed length, leftover bits) at the start of each packed MCU, to rewind to.
+        self._checkpoints = [(0, '')]
+        # One past the last MCU decoded, as of the last get_jpeg() call.
+        self._end = 0
+        # Leftover bits -> packed bytes for 8 missing MCUs following them, for _pack_missing().
+        self._missing_blocks = {}
+
+
+    @property
+    def mcus_decoded(self):
+        """ Number of MCUs decoded so far """
+        return 0 if self.width is None else int(self._valid.sum())
+
+
+    def add_packet(self, packet):
+        """ Add a SSDV packet to the decoder, and decode any MCUs it completes.
+
+            Returns the packet ID, or None if the packet was rejected.
+        """
+        if len(packet) != SSDV_PACKET_SIZE or packet[0] != SSDV_HEADER:
+            return None
+
+        _width = packet[9] * SSDV_RES_MULTIPLE
+        _height = packet[10] * SSDV_RES_MULTIPLE
+        _quality = ((packet[11] >> 3) & 0x07) ^ 0x04
+        _mode = packet[11] & 0x03
+
+        if self.width is None:
+            if _width == 0 or _height == 0:
+                return None
+            self._setup(_width, _height, _quality, _mode)
+
+        elif (_width, _height, _mode) != (self.width, self.height, self.mode):
+            logging.error("SSDV packet does not match image dimensions, discarding.")
+            return None
+
+        _pkt_id = (packet[7] << 8) | packet[8]
+        if _pkt_id in self._added:
+            # Nothing new here.
+            return _pkt_id
+
+        self._added.add(_pkt_id)
+        if self._copy:
+            self.packets[_pkt_id] = bytes(packet)
+
+        # Continue the segment running into this packet.
+        if _pkt_id in self._waiting:
+            self._extend(self._waiting.pop(_pkt_id))
+
+        # Start a new segment if an MCU begins in this packet.
+        _offset = packet[12]
+        _mcu_id = (packet[13] << 8) | packet[14]
+        if _offset != SSDV_NO_MCU_OFFSET and _mcu_id < self.mcu_count:
+            _data = packet[SSDV_HEADER_SIZE + _offset:SSDV_HEADER_SIZE + _payload_length(packet)]
+            self._extend(_Segment(_mcu_id, _bit_string(_data), _pkt_id + 1, self.mcu_count - _mcu_id))
+
+        return _pkt_id
+
+
+    def sync(self):
+        """ Add any packets held in the store which have not been added to the decoder yet.
+
+            Returns the number of packets added.
+        """
+        if len(self._added) == len(self.packets):
+            return 0
+
+        _count = 0
+        for _pkt_id in list(self.packets):
+            if _pkt_id not in self._added:
+                self.add_packet(self.packets[_pkt_id])
+                _count += 1
+        return _count
+
+
+    def _extend(self, segment):
+        """ Append any consecutive packets we hold to a segment, then decode as far as possible. """
+        _data = []
+        _next = segment.next_packet
+
+        while _next in self.packets:
+            _packet = self.packets[_next]
+            _offset = _packet[12]
+            if _offset == SSDV_NO_MCU_OFFSET:
+                _data.append(_packet[SSDV_HEADER_SIZE:SSDV_HEADER_SIZE + _payload_length(_packet)])
+                _next += 1
+            else:
+                # The next segment starts here - this is the end of our data.
+                _data.append(_packet[SSDV_HEADER_SIZE:SSDV_HEADER_SIZE + _offset])
+                segment.limit = min(segment.limit, ((_packet[13] << 8) | _packet[14]) - segment.mcu_id)
+                _next = None
+                break
+
+        segment.next_packet = _next
+        if _next is not None:
+            self._waiting[_next] = segment
+
+        segment.bits += _bit_string(b''.join(_data))
+        self._decode_segment(segment)
+
+
+    def _decode_segment(self, segment):
+        """ Huffman-decode as many MCUs as possible from a segment, resuming from where it last stopped.
+
+            The first MCU of a segment carries absolute DC values.
+        """
+        if segment.failed:
+            return
+
+        _dc_luma, _ac_luma, _dc_chroma, _ac_chroma = huffman_tables()
+        _layout = [(_dc_luma.lookup, _ac_luma.lookup, 0)] * self.ycparts
+        _layout += [(_dc_chroma.lookup, _ac_chroma.lookup, 1), (_dc_chroma.lookup, _ac_chroma.lookup, 2)]
+
+        _end = len(segment.bits)
+        # Pad with 1s, so lookahead near the end of the data never runs short.
+        bits = segment.bits + '1' * 32
+
+        _dc = segment.dc
+        _pos = 0
+        _boundary = 0
+
+        while segment.count < segment.limit:
+            _blocks = []
+            _mcu_dc = list(_dc)
+            _reset = segment.count == 0
+            try:
+                for _b, (_dc_lookup, _ac_lookup, _comp) in enumerate(_layout):
+                    # DC coefficient
+                    _code = _dc_lookup[int(bits[_pos:_pos + 16], 2)]
+                    if _code == 0:
+                        raise SSDVDecodeError("Invalid DC code.")
+                    _pos += _code >> 8
+                    _size = _code & 0xFF
+                    if _size:
+                        _value = extend_value(int(bits[_pos:_pos + _size], 2), _size)
+                        _pos += _size
+                    else:
+                        _value = 0
+
+                    if _reset and (_b == 0 or _comp > 0):
+                        _mcu_dc[_comp] = _value
+                    else:
+                        _mcu_dc[_comp] += _value
+
+                    # AC coefficients - these are copied through verbatim.
+                    _ac_start = _pos
+                    _k = 1
+                    while _k < 64:
+                        _code = _ac_lookup[int(bits[_pos:_pos + 16], 2)]
+                        if _code == 0:
+                            raise SSDVDecodeError("Invalid AC code.")
+                        _pos += _code >> 8
+                        _symbol = _code & 0xFF
+                        if _symbol == 0x00:
+                            break
+                        _k += (_symbol >> 4) + 1
+                        _pos += _symbol & 0x0F
+
+                    if _k > 64:
+                        raise SSDVDecodeError("AC coefficient overrun.")
+
+                    _blocks.append((_mcu_dc[_comp], bits[_ac_start:_pos]))
+
+            except (SSDVDecodeError, ValueError) as e:
+                if _pos + 16 <= _end or segment.next_packet is None:
+                    # Corrupt data, rather than just running out.
+                    logging.debug(f"SSDV decode error in MCU {segment.mcu_id + segment.count}: {str(e)}")
+                    segment.failed = True
+                break
+
+            if _pos > _end:
+                # Ran out of data part-way through this MCU.
+                break
+
+            _mcu_id = segment.mcu_id + segment.count
+            self._mcus[_mcu_id] = _blocks
+            self._dc[_mcu_id] = [_block[0] for _block in _blocks]
+            self._valid[_mcu_id] = True
+            self._new.append(_mcu_id)
+
+            _dc = _mcu_dc
+            _boundary = _pos
+            segment.count += 1
+
+        segment.dc = _dc
+        if segment.count >= segment.limit or segment.failed:
+            segment.bits = ''
+        else:
+            segment.bits = segment.bits[_boundary:]
+
+
+    def _encode_mcu(self, mcu_id, diffs):
+        """ Produce the JPEG entropy-coded bits for a single MCU """
+        _mcu = self._mcus[mcu_id]
+        _bits = []
+        for _b, _diff in enumerate(diffs):
+            _bits.append(self._dc_tables[_b].dc_code(_diff))
+            _bits.append(_mcu[_b][1] if _mcu else self._eob[_b])
+        return ''.join(_bits)
+
+
+    def _mark_region(self, first, last):
+        """ Expand the changed region to cover MCUs first to last inclusive """
+        _cols = self.width // self.mcu_width
+        _row_first, _row_last = first // _cols, last // _cols
+
+        if _row_first == _row_last:
+            _x0 = (first % _cols) * self.mcu_width
+            _x1 = (last % _cols + 1) * self.mcu_width
+        else:
+            _x0, _x1 = 0, self.width
+        _y0 = _row_first * self.mcu_height
+        _y1 = (_row_last + 1) * self.mcu_height
+
+        if self._region:
+            _x, _y, _w, _h = self._region
+            _x0, _y0 = min(_x0, _x), min(_y0, _y)
+            _x1, _y1 = max(_x1, _x + _w), max(_y1, _y + _h)
+
+        self._region = (_x0, _y0, _x1 - _x0, _y1 - _y0)
+
+
+    def take_region(self):
+        """ Return the pixel region (x, y, width, height) that has changed in the JPEG output
+            since this was last called, or None if nothing has changed.
+        """
+        _region = self._region
+        self._region = None
+        return _region
+
+
+    def _update_dc(self, start, end):
+        """ Recompute the filled DC values and JPEG DC differences for MCUs start to end.
+
+            Every MCU after the last one decoded repeats its DC values, so end need go no further than that.
+
+            Returns:
+                tuple: (filled, diffs) for MCUs start to end.
+        """
+        _yc = self.ycparts
+
+        # Begin from the previous MCU's filled values, which are unaffected by anything after them.
+        _seed = self._filled[start - 1:start] if start > 0 else np.zeros((1, self._dc.shape[1]), dtype=np.int32)
+        _dc = np.concatenate((_seed, self._dc[start:end]))
+        _valid = np.concatenate(([True], self._valid[start:end]))
+        _rows = len(_dc)
+
+        # Absolute DC values with missing blocks repeating the previous DC, and JPEG DC differences.
+        _filled = np.empty_like(_dc)
+        _filled[:, :_yc] = _fill(_dc[:, :_yc].ravel(), np.repeat(_valid, _yc)).reshape(_rows, _yc)
+        _filled[:, -2] = _fill(_dc[:, -2], _valid)
+        _filled[:, -1] = _fill(_dc[:, -1], _valid)
+
+        _diffs = np.empty_like(_filled)
+        _diffs[:, :_yc] = _dc_diff(_filled[:, :_yc].ravel()).reshape(_rows, _yc)
+        _diffs[:, -2] = _dc_diff(_filled[:, -2])
+        _diffs[:, -1] = _dc_diff(_filled[:, -1])
+
+        return _filled[1:], _diffs[1:]
+
+
+    def _pack(self, first_changed, end):
+        """ Bring the packed data up to date for MCUs before end, re-packing from first_changed onwards """
+        if first_changed < self._packed_mcu:
+            _length, self._packed_bits = self._checkpoints[first_changed]
+            del self._packed[_length:]
+            del self._checkpoints[first_changed + 1:]
+            self._packed_mcu = first_changed
+
+        for _mcu_id in range(self._packed_mcu, end):
+            _bits = self._packed_bits + self._mcu_bits[_mcu_id]
+            _whole = len(_bits) - len(_bits) % 8
+            self._packed += pack_bits(_bits[:_whole])
+            self._packed_bits = _bits[_whole:]
+            self._checkpoints.append((len(self._packed), self._packed_bits))
+
+        self._packed_mcu = max(self._packed_mcu, end)
+
+
+    def _pack_missing(self, bits, count):
+        """ Pack leftover bits followed by count missing MCUs, padding the final byte.
+
+            Eight missing MCUs pack into a whole number of bytes, so after the first eight the
+            packed bytes repeat, and are only produced once.
+        """
+        _blocks, _rest = divmod(count, 8)
+        if _blocks == 0:
+            return pack_bits(bits + self._missing * _rest)
+
+        _block = self._missing * 8
+        if bits not in self._missing_blocks:
+            # The leftover bits after each block are the last len(bits) bits of the block.
+            _after = _block[len(_block) - len(bits):] if bits else ''
+            self._missing_blocks[bits] = (pack_bits(bits + _block)[:len(_block) // 8],
+                pack_bits(_after + _block)[:len(_block) // 8] if bits else None, _after)
+
+        _first, _repeat, _after = self._missing_blocks[bits]
+        if _repeat is None:
+            # Already byte-aligned, so every block packs the same.
+            _repeat = _first
+        return _first + _repeat * (_blocks - 1) + pack_bits(_after + self._missing * _rest)
+
+
+    def get_jpeg(self):
+        """ Produce a JPEG from the received packets.
+
+            Only the MCUs from the first one changed since the last call are re-encoded and re-packed.
+            The MCUs after the last one decoded are all alike, and are packed from a cached block.
+
+            Returns:
+                bytes: JPEG file contents, or None if no packets have been received.
+
+        """
+        if self.width is None:
+            return None
+
+        _first_changed = self.mcu_count
+        if self._new:
+            _start = min(self._new)
+            _end = max(self._end, max(self._new) + 1)
+            _filled, _diffs = self._update_dc(_start, _end)
+
+            # Re-encode only the MCUs that have changed.
+            _new = np.asarray(self._new) - _start
+            _changed = (_diffs != self._diffs[_start:_end]).any(axis=1)
+            _changed[_new] = True
+            _changed = np.flatnonzero(_changed) + _start
+            for _mcu_id in _changed.tolist():
+                self._mcu_bits[_mcu_id] = self._encode_mcu(_mcu_id, _diffs[_mcu_id - _start].tolist())
+            if len(_changed):
+                _first_changed = int(_changed[0])
+
+            # Note which part of the image has visibly changed - including the missing MCUs after
+            # the last one decoded, if the DC values they repeat have changed.
+            _touched = (_filled != self._filled[_start:_end]).any(axis=1)
+            _touched[_new] = True
+            _touched = np.flatnonzero(_touched) + _start
+            _carry = _filled[-1].copy()
+            _carry[:self.ycparts] = _carry[self.ycparts - 1]
+            if _end < self.mcu_count and (_carry != self._filled[_end]).any():
+                self._filled[_end:] = _carry
+                self._mark_region(int(_touched[0]) if len(_touched) else _end, self.mcu_count - 1)
+            elif len(_touched):
+                self._mark_region(int(_touched[0]), int(_touched[-1]))
+
+            self._filled[_start:_end] = _filled
+            self._diffs[_start:_end] = _diffs
+            self._end = _end
+            self._new = []
+
+        self._pack(_first_changed, self._end)
+
+        _tail = self._pack_missing(self._packed_bits, self.mcu_count - self._packed_mcu)
+        return self._header + bytes(self._packed) + _tail + b'\xff\xd9'
+
+
+    def get_image(self):
+        """ Produce a PIL Image from the received packets, or None if no packets have been received. """
+        _jpeg = self.get_jpeg()
+        if _jpeg is None:
+            return None
+
+        return Image.open(io.BytesIO(_jpeg))
+
+
+def decode_packets(packets):
+    """ Decode an iterable of 256-byte SSDV packets into JPEG bytes """
+    return SSDVDecoder(packets).get_jpeg()
+
+
+def decode_to_image(packets):
+    """ Decode an iterable of 256-byte SSDV packets into a PIL Image """
+    return SSDVDecoder(packets).get_image()
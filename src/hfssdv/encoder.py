@@ -0,0 +1,353 @@
+#
+#   SSDV Encoder
+#
+#   Converts a PIL image straight into a list of 256-byte SSDV packets,
+#   entirely in memory.
+#
+
+import logging
+import struct
+import numpy as np
+from .fec import *
+from .jpeg import *
+from .packets import *
+
+# Largest image dimension that fits in the SSDV width/height fields.
+SSDV_MAX_DIMENSION = 255 * SSDV_RES_MULTIPLE
+
+
+def _dct_matrix():
+    """ Orthonormal 8-point DCT-II matrix """
+    _n = np.arange(8)
+    _matrix = np.cos((2 * _n[None, :] + 1) * _n[:, None] * np.pi / 16) / 2
+    _matrix[0, :] /= np.sqrt(2)
+    return _matrix
+
+_DCT = _dct_matrix()
+
+# Pre-computed (category, additional bits) for every baseline coefficient value.
+_VALUE_BITS = {_v: value_bits(_v) for _v in range(-2047, 2048)}
+
+
+def prepare_image(image, scale=1.0):
+    """ Convert an image to RGB, scale it, and round its size to multiples of 16 pixels.
+
+        Args:
+            image (PIL.Image): Source image.
+            scale (float): Optional scaling factor to apply.
+
+        Returns:
+            PIL.Image: An RGB image suitable for SSDV encoding.
+
+    """
+    width, height = image.size
+
+    _new_width = int(round(width * scale / SSDV_RES_MULTIPLE) * SSDV_RES_MULTIPLE)
+    _new_height = int(round(height * scale / SSDV_RES_MULTIPLE) * SSDV_RES_MULTIPLE)
+    _new_width = max(SSDV_RES_MULTIPLE, min(SSDV_MAX_DIMENSION, _new_width))
+    _new_height = max(SSDV_RES_MULTIPLE, min(SSDV_MAX_DIMENSION, _new_height))
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    if (_new_width != width) or (_new_height != height):
+        logging.info(f"Resizing image to {_new_width}x{_new_height} for transmission.")
+        image = image.resize((_new_width, _new_height))
+
+    return image
+
+
+def _blocks(plane):
+    """ Split a 2D plane into 8x8 blocks, shape (rows, cols, 8, 8) """
+    _h, _w = plane.shape
+    return plane.reshape(_h // 8, 8, _w // 8, 8).swapaxes(1, 2)
+
+
+def image_transform(image):
+    """ Colour-convert and DCT an image, ready for quantisation.
+
+        Args:
+            image (PIL.Image): RGB image, with dimensions that are multiples of 16.
+
+        Returns:
+            numpy.ndarray: DCT coefficients, shape (MCUs, 6, 64), natural order,
+                with 4 luma blocks then Cb and Cr per 16x16 MCU.
+
+    """
+    _ycbcr = np.asarray(image.convert('YCbCr'), dtype=np.float32)
+    _height, _width = _ycbcr.shape[:2]
+
+    _luma = _ycbcr[:, :, 0] - 128.0
+    # 2x2 chroma subsampling.
+    _chroma = _ycbcr[:, :, 1:].reshape(_height // 2, 2, _width // 2, 2, 2).mean(axis=(1, 3)) - 128.0
+
+    _y = _blocks(_luma)
+    _cb = _blocks(_chroma[:, :, 0])
+    _cr = _blocks(_chroma[:, :, 1])
+
+    # Group the luma blocks into MCUs - top-left, top-right, bottom-left, bottom-right.
+    _rows, _cols = _height // 16, _width // 16
+    _y = _y.reshape(_rows, 2, _cols, 2, 8, 8).swapaxes(1, 2).reshape(_rows * _cols, 4, 8, 8)
+    _mcus = np.concatenate([
+        _y,
+        _cb.reshape(_rows * _cols, 1, 8, 8),
+        _cr.reshape(_rows * _cols, 1, 8, 8)
+    ], axis=1)
+
+    _coefs = np.einsum('ux,mbxy,vy->mbuv', _DCT, _mcus, _DCT, optimize=True)
+    return _coefs.reshape(_rows * _cols, 6, 64)
+
+
+def quantise(coefs, quality=4):
+    """ Quantise DCT coefficients for a SSDV quality level, returning integers in zig-zag order. """
+    _dqt = np.array([ssdv_dqt(quality)] * 4 + [ssdv_dqt(quality, chroma=True)] * 2, dtype=np.float32)
+    _quant = np.rint(coefs / _dqt).astype(np.int32)
+    _quant[:, :, 0] = np.clip(_quant[:, :, 0], -1023, 1023)
+    _quant[:, :, 1:] = np.clip(_quant[:, :, 1:], -1023, 1023)
+    return _quant[:, :, ZIGZAG]
+
+
+def _packet_header(callsign_code, image_id, packet_id, width, height, quality, eoi, fec, mcu_offset, mcu_id):
+    return struct.pack('>BBIBHBBBBH',
+        SSDV_HEADER,
+        SSDV_TYPE_FEC if fec else SSDV_TYPE_NOFEC,
+        callsign_code,
+        image_id,
+        packet_id,
+        width // SSDV_RES_MULTIPLE,
+        height // SSDV_RES_MULTIPLE,
+        (((quality - 4) & 0x07) << 3) | (0x04 if eoi else 0x00),    # MCU mode 0 (2x2)
+        mcu_offset,
+        mcu_id)
+
+
+def encode_coefficients(coefs, width, height, callsign="N0CALL", image_id=0, quality=4, fec=False):
+    """ Huffman-code quantised coefficients into SSDV packets.
+
+        Args:
+            coefs (numpy.ndarray): Output of quantise()
+            width (int): Image width in pixels.
+            height (int): Image height in pixels.
+            callsign (str): Callsign, up to 6 characters.
+            image_id (int): Image ID, 0-255.
+            quality (int): SSDV quality level the coefficients were quantised with.
+            fec (bool): Produce FEC (Reed-Solomon) packets.
+
+        Returns:
+            list: 256-byte SSDV packets.
+
+    """
+    _payload_len = SSDV_PAYLOAD_FEC if fec else SSDV_PAYLOAD_NOFEC
+    _payload_bits = _payload_len * 8
+
+    _dc_luma, _ac_luma, _dc_chroma, _ac_chroma = huffman_tables()
+    _tables = [(_dc_luma, _ac_luma.encode, 0)] * 4
+    _tables += [(_dc_chroma, _ac_chroma.encode, 1), (_dc_chroma, _ac_chroma.encode, 2)]
+
+    # Index of the last non-zero AC coefficient in each block.
+    _last = np.where(coefs[:, :, 1:] != 0, np.arange(1, 64), 0).max(axis=2).tolist()
+
+    # (payload bit string, (mcu offset, mcu id) or None)
+    _payloads = []
+    _pending = ''
+    _mcu_start = None
+    _dc = [0, 0, 0]
+
+    for _mcu_id, _mcu in enumerate(coefs.tolist()):
+        _reset = False
+        if _mcu_start is None:
+            # The first MCU in each packet starts on a byte boundary, with absolute DC values.
+            _pending += '1' * ((-len(_pending)) % 8)
+            while len(_pending) >= _payload_bits:
+                _payloads.append((_pending[:_payload_bits], None))
+                _pending = _pending[_payload_bits:]
+            _mcu_start = (len(_pending) // 8, _mcu_id)
+            _reset = True
+
+        _bits = []
+        for _b, (_dc_table, _ac_codes, _comp) in enumerate(_tables):
+            _block = _mcu[_b]
+
+            if _reset and (_b == 0 or _comp > 0):
+                _bits.append(_dc_table.dc_code(_block[0]))
+            else:
+                _bits.append(_dc_table.dc_code(_block[0] - _dc[_comp]))
+            _dc[_comp] = _block[0]
+
+            _run = 0
+            _end = _last[_mcu_id][_b]
+            for _k in range(1, _end + 1):
+                _value = _block[_k]
+                if _value == 0:
+                    _run += 1
+                    continue
+                while _run > 15:
+                    _bits.append(_ac_codes[0xF0])
+                    _run -= 16
+                _size, _value_bits = _VALUE_BITS[_value]
+                _bits.append(_ac_codes[(_run << 4) | _size])
+                _bits.append(_value_bits)
+                _run = 0
+
+            if _end < 63:
+                _bits.append(_ac_codes[0x00])
+
+        _pending += ''.join(_bits)
+
+        while len(_pending) >= _payload_bits:
+            _payloads.append((_pending[:_payload_bits], _mcu_start))
+            _mcu_start = None
+            _pending = _pending[_payload_bits:]
+
+    if _pending:
+        _pending += '1' * ((-len(_pending)) % 8)
+        _payloads.append((_pending, _mcu_start))
+
+    # Assemble the packets.
+    _callsign = ssdv_encode_callsign(callsign)
+    _packets = []
+    for _pkt_id, (_bits, _start) in enumerate(_payloads):
+        if _start is None:
+            _mcu_offset, _mcu_index = SSDV_NO_MCU_OFFSET, SSDV_NO_MCU_ID
+        else:
+            _mcu_offset, _mcu_index = _start
+
+        _packet = _packet_header(_callsign, image_id, _pkt_id, width, height, quality,
+            _pkt_id == len(_payloads) - 1, fec, _mcu_offset, _mcu_index)
+        _packet += int(_bits, 2).to_bytes(len(_bits) // 8, 'big').ljust(_payload_len, b'\x00')
+        _packet += struct.pack('>I', ssdv_crc32(_packet[1:]))
+        if fec:
+            _packet += rs_encode(_packet[1:])
+
+        _packets.append(_packet)
+
+    return _packets
+
+
+def encode_image(image, callsign="N0CALL", image_id=0, quality=4, fec=False, scale=1.0):
+    """ Encode an image into SSDV packets.
+
+        Args:
+            image (PIL.Image): Image to encode. It will be resized to multiples of 16 pixels if necessary.
+            callsign (str): Callsign, up to 6 characters.
+            image_id (int): Image ID, 0-255.
+            quality (int): SSDV quality level, 0-7.
+            fec (bool): Produce FEC (Reed-Solomon) packets.
+            scale (float): Optional scaling factor to apply to the image.
+
+        Returns:
+            list: 256-byte SSDV packets.
+
+    """
+    image = prepare_image(image, scale)
+    _width, _height = image.size
+
+    _coefs = quantise(image_transform(image), quality)
+
+    return encode_coefficients(_coefs, _width, _height,
+        callsign=callsign, image_id=image_id % 256, quality=quality, fec=fec)
+
+
+def budget_scales(width, height, min_size=64, step=0.85, max_scale=1.0):
+    """ Candidate scaling factors for encode_image_budget, largest first.
+
+        Factors start at max_scale and shrink geometrically by 'step', until the shorter side of the
+        image would drop below min_size pixels. Factors which round to the
+        same SSDV image size as a larger factor are skipped.
+    """
+    _scales = []
+    _sizes = set()
+    _scale = min(max_scale, SSDV_MAX_DIMENSION / max(width, height))
+    while True:
+        _size = (round(width * _scale / SSDV_RES_MULTIPLE), round(height * _scale / SSDV_RES_MULTIPLE))
+        if _size not in _sizes:
+            _sizes.add(_size)
+            _scales.append(_scale)
+        if min(width, height) * _scale * step < min_size:
+            return _scales
+        _scale *= step
+
+
+def encode_image_budget(image, max_packets, callsign="N0CALL", image_id=0, fec=False, min_quality=2, min_size=64,
+    max_scale=1.0):
+    """ Encode an image into at most max_packets SSDV packets, picking the image size and quality level.
+
+        Detail is kept in preference to quality: we binary search for the largest
+        image size that fits at min_quality, then for the highest quality that
+        fits at that size. Each size is only colour-converted and transformed
+        once, and each (size, quality) only encoded once.
+
+        Args:
+            image (PIL.Image): Image to encode.
+            max_packets (int): Packet budget, e.g. the time available divided by the delay between packets.
+            callsign (str): Callsign, up to 6 characters.
+            image_id (int): Image ID, 0-255.
+            fec (bool): Produce FEC (Reed-Solomon) packets.
+            min_quality (int): Lowest quality level to use before shrinking the image further.
+            min_size (int): Smallest size (pixels) to shrink the shorter side of the image to.
+            max_scale (float): Largest scaling factor to try.
+
+        Returns:
+            tuple: (list of 256-byte SSDV packets, dict of the settings chosen - 'quality', 'scale',
+                'width', 'height', 'packets', and 'fits', False if even the smallest, lowest quality
+                encoding is over budget).
+
+    """
+    _scales = budget_scales(image.size[0], image.size[1], min_size=min_size, max_scale=max_scale)
+    _transforms = {}
+    _encodings = {}
+
+    def _encode(scale_index, quality):
+        if (scale_index, quality) not in _encodings:
+            if scale_index not in _transforms:
+                _prepared = prepare_image(image, _scales[scale_index])
+                _transforms[scale_index] = (image_transform(_prepared), _prepared.size)
+            _coefs, _size = _transforms[scale_index]
+            _encodings[(scale_index, quality)] = encode_coefficients(quantise(_coefs, quality), _size[0], _size[1],
+                callsign=callsign, image_id=image_id % 256, quality=quality, fec=fec)
+        return _encodings[(scale_index, quality)]
+
+    def _fits(scale_index, quality):
+        return len(_encode(scale_index, quality)) <= max_packets
+
+    # Largest size (lowest index) that fits at min_quality. Packet counts shrink with the image.
+    _low, _high = 0, len(_scales) - 1
+    while _low < _high:
+        _mid = (_low + _high) // 2
+        if _fits(_mid, min_quality):
+            _high = _mid
+        else:
+            _low = _mid + 1
+    _scale_index = _low
+
+    # Highest quality that fits at that size - or, at the smallest size, the highest quality below min_quality that fits.
+    if _fits(_scale_index, min_quality):
+        _low, _high = min_quality, 7
+    else:
+        _low, _high = 0, min_quality
+    while _low < _high:
+        _mid = (_low + _high + 1) // 2
+        if _fits(_scale_index, _mid):
+            _low = _mid
+        else:
+            _high = _mid - 1
+    _quality = _low
+
+    _packets = _encode(_scale_index, _quality)
+    _size = _transforms[_scale_index][1]
+    _settings = {
+        'quality': _quality,
+        'scale': _scales[_scale_index],
+        'width': _size[0],
+        'height': _size[1],
+        'packets': len(_packets),
+        'fits': len(_packets) <= max_packets
+    }
+
+    if not _settings['fits']:
+        logging.warning(f"Image does not fit in {max_packets} packets, even at {_size[0]}x{_size[1]}, quality {_quality}.")
+
+    logging.info(f"Encoded image at {_size[0]}x{_size[1]}, quality {_quality}: {len(_packets)}/{max_packets} packets "
+        f"({len(_encodings)} trial encodings).")
+
+    return (_packets, _settings)
@@ -0,0 +1,294 @@
+#
+#   SSDV Packet Integrity - CRC32 and Reed-Solomon FEC
+#
+#   FEC packets carry a RS(255,223) code over bytes 1-255 of the packet,
+#   using the CCSDS field (x^8 + x^7 + x^2 + x + 1), with a first consecutive
+#   root of 112 and a primitive element of 11 - as per Phil Karn's encode_rs_8.
+#
+
+import struct
+import zlib
+from .packets import *
+
+RS_NN = 255
+RS_NROOTS = 32
+RS_FCR = 112
+RS_PRIM = 11
+RS_GFPOLY = 0x187
+
+# Galois field tables. RS_A0 is the log of zero.
+RS_A0 = RS_NN
+RS_ALPHA_TO = [0] * (RS_NN + 1)
+RS_INDEX_OF = [0] * (RS_NN + 1)
+
+_sr = 1
+for _i in range(RS_NN):
+    RS_INDEX_OF[_sr] = _i
+    RS_ALPHA_TO[_i] = _sr
+    _sr <<= 1
+    if _sr & 0x100:
+        _sr ^= RS_GFPOLY
+RS_INDEX_OF[0] = RS_A0
+RS_ALPHA_TO[RS_A0] = 0
+
+
+def _gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return RS_ALPHA_TO[(RS_INDEX_OF[a] + RS_INDEX_OF[b]) % RS_NN]
+
+
+# Generator polynomial, coefficients in polynomial form, lowest order first.
+RS_GENPOLY = [1] + [0] * RS_NROOTS
+_root = RS_FCR * RS_PRIM
+for _i in range(RS_NROOTS):
+    RS_GENPOLY[_i + 1] = 1
+    for _j in range(_i, 0, -1):
+        RS_GENPOLY[_j] = RS_GENPOLY[_j - 1] ^ _gf_mul(RS_GENPOLY[_j], RS_ALPHA_TO[_root % RS_NN])
+    RS_GENPOLY[0] = _gf_mul(RS_GENPOLY[0], RS_ALPHA_TO[_root % RS_NN])
+    _root += RS_PRIM
+
+# Byte-wise LFSR feedback table. The parity register is held as a single
+# 256-bit integer, with parity[0] in the most significant byte.
+_RS_FEEDBACK = [
+    int.from_bytes(bytes(_gf_mul(_v, RS_GENPOLY[RS_NROOTS - 1 - _k]) for _k in range(RS_NROOTS)), 'big')
+    for _v in range(256)
+]
+_RS_MASK = (1 << (8 * RS_NROOTS)) - 1
+
+
+def rs_encode(data):
+    """ Calculate Reed-Solomon parity for a block of data.
+
+        Args:
+            data (bytes): Up to 223 bytes of data. Shorter blocks are treated as zero-padded at the start.
+
+        Returns:
+            bytes: 32 bytes of parity.
+
+    """
+    _parity = 0
+    for _byte in data:
+        _feedback = _byte ^ (_parity >> (8 * (RS_NROOTS - 1)))
+        _parity = ((_parity << 8) & _RS_MASK) ^ _RS_FEEDBACK[_feedback]
+
+    return _parity.to_bytes(RS_NROOTS, 'big')
+
+
+def ssdv_crc32(data):
+    """ CRC32 as used by SSDV (standard zlib CRC32) """
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+
+# Multiplicative inverse of RS_PRIM, modulo RS_NN.
+RS_IPRIM = next(_i for _i in range(1, RS_NN + 1) if (_i * RS_PRIM) % RS_NN == 1)
+
+# Roots of the generator polynomial, in index form.
+_RS_ROOTS = [((RS_FCR + _i) * RS_PRIM) % RS_NN for _i in range(RS_NROOTS)]
+
+
+def rs_syndromes(block):
+    """ Calculate the syndromes of a 255-byte RS codeword, in index form.
+
+        The remainder of the codeword modulo the generator polynomial is found
+        with the (fast) encoder, and the syndromes are evaluated from those 32
+        coefficients rather than from all 255 bytes.
+
+        Returns:
+            list: 32 syndromes, in index form. All RS_A0 if the codeword is valid.
+
+    """
+    _remainder = bytes(_a ^ _b for _a, _b in zip(rs_encode(block[:RS_NN - RS_NROOTS]), block[RS_NN - RS_NROOTS:]))
+
+    _syndromes = []
+    for _root in _RS_ROOTS:
+        # Horner's method, highest order coefficient first.
+        _s = 0
+        for _coef in _remainder:
+            if _s:
+                _s = RS_ALPHA_TO[(RS_INDEX_OF[_s] + _root) % RS_NN]
+            _s ^= _coef
+        _syndromes.append(RS_INDEX_OF[_s])
+
+    return _syndromes
+
+
+def rs_decode(block):
+    """ Correct errors in a 255-byte RS(255,223) codeword (data followed by parity).
+
+        A Berlekamp-Massey / Chien search / Forney decoder, following Phil
+        Karn's decode_rs_8.
+
+        Args:
+            block (bytes): 255-byte codeword.
+
+        Returns:
+            tuple: (corrected codeword as bytes, number of symbols corrected), or (None, -1) if the
+                errors could not be corrected (more than 16 bad symbols).
+
+    """
+    if len(block) != RS_NN:
+        return (None, -1)
+
+    _s = rs_syndromes(block)
+    if all(_si == RS_A0 for _si in _s):
+        return (bytes(block), 0)
+
+    # Berlekamp-Massey - find the error locator polynomial, lambda (polynomial form).
+    _lambda = [1] + [0] * RS_NROOTS
+    _b = [RS_INDEX_OF[_v] for _v in _lambda]
+    _el = 0
+
+    for _r in range(1, RS_NROOTS + 1):
+        _discr = 0
+        for _i in range(_r):
+            if _lambda[_i] != 0 and _s[_r - _i - 1] != RS_A0:
+                _discr ^= RS_ALPHA_TO[(RS_INDEX_OF[_lambda[_i]] + _s[_r - _i - 1]) % RS_NN]
+        _discr = RS_INDEX_OF[_discr]
+
+        if _discr == RS_A0:
+            _b = [RS_A0] + _b[:-1]
+            continue
+
+        _t = [_lambda[0]]
+        for _i in range(RS_NROOTS):
+            if _b[_i] != RS_A0:
+                _t.append(_lambda[_i + 1] ^ RS_ALPHA_TO[(_discr + _b[_i]) % RS_NN])
+            else:
+                _t.append(_lambda[_i + 1])
+
+        if 2 * _el <= _r - 1:
+            _el = _r - _el
+            _b = [RS_A0 if _l == 0 else (RS_INDEX_OF[_l] - _discr + RS_NN) % RS_NN for _l in _lambda]
+        else:
+            _b = [RS_A0] + _b[:-1]
+
+        _lambda = _t
+
+    # Convert lambda to index form.
+    _lambda = [RS_INDEX_OF[_l] for _l in _lambda]
+    _deg_lambda = max(_i for _i in range(RS_NROOTS + 1) if _lambda[_i] != RS_A0)
+    if _deg_lambda == 0:
+        return (None, -1)
+
+    # Chien search - find the roots of lambda, which give the error locations.
+    _reg = list(_lambda)
+    _roots = []
+    _locs = []
+    _k = RS_IPRIM - 1
+    for _i in range(1, RS_NN + 1):
+        _q = 1
+        for _j in range(_deg_lambda, 0, -1):
+            if _reg[_j] != RS_A0:
+                _reg[_j] = (_reg[_j] + _j) % RS_NN
+                _q ^= RS_ALPHA_TO[_reg[_j]]
+        if _q == 0:
+            _roots.append(_i)
+            _locs.append(_k)
+            if len(_roots) == _deg_lambda:
+                break
+        _k = (_k + RS_IPRIM) % RS_NN
+
+    if len(_roots) != _deg_lambda:
+        # Uncorrectable.
+        return (None, -1)
+
+    # Error evaluator polynomial, omega = s * lambda mod x^NROOTS (index form).
+    _deg_omega = _deg_lambda - 1
+    _omega = []
+    for _i in range(_deg_omega + 1):
+        _tmp = 0
+        for _j in range(_i, -1, -1):
+            if _s[_i - _j] != RS_A0 and _lambda[_j] != RS_A0:
+                _tmp ^= RS_ALPHA_TO[(_s[_i - _j] + _lambda[_j]) % RS_NN]
+        _omega.append(RS_INDEX_OF[_tmp])
+
+    # Forney - compute the error values, and correct them.
+    _data = bytearray(block)
+    for _root, _loc in zip(_roots, _locs):
+        _num1 = 0
+        for _i in range(_deg_omega, -1, -1):
+            if _omega[_i] != RS_A0:
+                _num1 ^= RS_ALPHA_TO[(_omega[_i] + _i * _root) % RS_NN]
+        _num2 = RS_ALPHA_TO[(_root * (RS_FCR - 1) + RS_NN) % RS_NN]
+
+        _den = 0
+        for _i in range(min(_deg_lambda, RS_NROOTS - 1) & ~1, -1, -2):
+            if _lambda[_i + 1] != RS_A0:
+                _den ^= RS_ALPHA_TO[(_lambda[_i + 1] + _i * _root) % RS_NN]
+        if _den == 0:
+            return (None, -1)
+
+        if _num1 != 0:
+            _data[_loc] ^= RS_ALPHA_TO[(RS_INDEX_OF[_num1] + RS_INDEX_OF[_num2] + RS_NN - RS_INDEX_OF[_den]) % RS_NN]
+
+    return (bytes(_data), len(_roots))
+
+
+def _crc_ok(packet, payload_length):
+    _end = SSDV_HEADER_SIZE + payload_length
+    return ssdv_crc32(packet[1:_end]) == struct.unpack('>I', packet[_end:_end + SSDV_CRC_SIZE])[0]
+
+
+def ssdv_verify_packet(packet):
+    """ Check a SSDV packet's CRC, using the Reed-Solomon code to correct errors in FEC packets.
+
+        As with the ssdv utility, the sync and packet type bytes are not
+        trusted - the packet is tested as a no-FEC packet and as a FEC packet.
+
+        Args:
+            packet (bytes): 256-byte SSDV packet.
+
+        Returns:
+            tuple: (packet, corrected) - the (corrected) packet, and the number of symbols the RS
+                decoder corrected. (None, -1) if the packet is corrupt and could not be corrected.
+
+    """
+    if len(packet) != SSDV_PACKET_SIZE:
+        return (None, -1)
+
+    _sync = bytes([SSDV_HEADER])
+
+    # No-FEC packet.
+    _nofec = _sync + bytes([SSDV_TYPE_NOFEC]) + bytes(packet[2:])
+    if _crc_ok(_nofec, SSDV_PAYLOAD_NOFEC):
+        return (_nofec, 0)
+
+    # FEC packet, without errors.
+    _fec = _sync + bytes([SSDV_TYPE_FEC]) + bytes(packet[2:])
+    if _crc_ok(_fec, SSDV_PAYLOAD_FEC):
+        return (_fec, 0)
+
+    # FEC packet, with errors we may be able to correct.
+    _block, _corrected = rs_decode(_fec[1:])
+    if _block is None:
+        return (None, -1)
+
+    _fec = _sync + _block
+    if _crc_ok(_fec, SSDV_PAYLOAD_FEC):
+        return (_fec, _corrected)
+
+    return (None, -1)
+
+
+def ssdv_set_image_id(packet, image_id):
+    """ Change the image ID of a SSDV packet, recalculating its CRC, and its Reed-Solomon parity if it is a FEC packet.
+
+        Args:
+            packet (bytes): 256-byte SSDV packet.
+            image_id (int): New image ID, 0-255.
+
+        Returns:
+            bytes: The renumbered packet.
+
+    """
+    _packet = bytearray(packet)
+    _packet[6] = image_id
+
+    _fec = _packet[1] == SSDV_TYPE_FEC
+    _end = SSDV_HEADER_SIZE + (SSDV_PAYLOAD_FEC if _fec else SSDV_PAYLOAD_NOFEC)
+    _packet[_end:_end + SSDV_CRC_SIZE] = struct.pack('>I', ssdv_crc32(_packet[1:_end]))
+    if _fec:
+        _packet[_end + SSDV_CRC_SIZE:] = rs_encode(_packet[1:_end + SSDV_CRC_SIZE])
+
+    return bytes(_packet)
@@ -0,0 +1,241 @@
+#
+#   Fountain-Coded SSDV Repair Packets
+#
+#   A random linear fountain code over an image's SSDV packets. After sending
+#   an image's K packets, the sender can send any number of repair packets,
+#   each the XOR of a pseudo-random half of the image's packets. A receiver
+#   missing u packets can rebuild them all from any u repair packets, plus a
+#   few spare (each spare repair packet halves the chance of failing), without
+#   a resend request round trip.
+#
+#   Which packets go into a repair packet is worked out from its 32-bit seed,
+#   by repair_row(), so the receiver knows from the seed alone.
+#
+#   Repair packet format (272 bytes):
+#       1 byte      - FOUNTAIN_HEADER (0x46)
+#       4 bytes     - Callsign (SSDV encoding, big-endian)
+#       1 byte      - Image ID
+#       2 bytes     - Number of source packets in the image, K (big-endian)
+#       4 bytes     - Seed (big-endian)
+#       256 bytes   - XOR of the source packets chosen by the seed
+#       4 bytes     - CRC32 of the preceding bytes, from the callsign on
+#
+#   Encoding and decoding work on whole arrays of packets with NumPy. The
+#   XOR of many packets is done as a matrix product of the packets' bits,
+#   and decoding is Gaussian elimination over GF(2), on bit-packed rows.
+#
+
+import hashlib
+import logging
+import struct
+import numpy as np
+from .fec import ssdv_crc32
+from .packets import *
+
+FOUNTAIN_HEADER_SIZE = 12
+FOUNTAIN_PACKET_SIZE = FOUNTAIN_HEADER_SIZE + SSDV_PACKET_SIZE + SSDV_CRC_SIZE
+
+# Packets per image is sent in 2 bytes.
+FOUNTAIN_MAX_PACKETS = 65535
+
+# Repair packets a decoder holds beyond the image's packet count. Each one spare halves the chance of failing.
+FOUNTAIN_SPARE_REPAIR = 32
+
+_FOUNTAIN_FIELDS = struct.Struct('>BIBHI')
+
+
+def repair_row(seed, source_count):
+    """ Which of the source packets are XORed into the repair packet with this seed.
+
+        Derived from a SHAKE-256 hash of the seed and packet count, so every station agrees.
+
+        Returns:
+            numpy.ndarray: Boolean array, one entry per source packet.
+    """
+    _digest = hashlib.shake_256(struct.pack('>4sHI', b'SSDV', source_count, seed)).digest((source_count + 7) // 8)
+    return np.unpackbits(np.frombuffer(_digest, dtype=np.uint8), count=source_count).astype(bool)
+
+
+def repair_matrix(seeds, source_count):
+    """ repair_row() for each seed, as a (len(seeds), source_count) boolean array """
+    _matrix = np.zeros((len(seeds), source_count), dtype=bool)
+    for _i, _seed in enumerate(seeds):
+        _matrix[_i] = repair_row(_seed, source_count)
+    return _matrix
+
+
+def xor_combine(matrix, packets):
+    """ XOR together the packets selected by each row of a boolean matrix.
+
+        Done as a product of the matrix and the packets' bits, taking each
+        count mod 2, which is far faster than XORing packets one by one.
+
+        Args:
+            matrix (numpy.ndarray): (N, K) boolean array.
+            packets (numpy.ndarray): (K, L) uint8 array.
+
+        Returns:
+            numpy.ndarray: (N, L) uint8 array.
+    """
+    if matrix.shape[1] == 0:
+        return np.zeros((matrix.shape[0], packets.shape[1]), dtype=np.uint8)
+
+    # float32 counts are exact up to 2**24, well above FOUNTAIN_MAX_PACKETS.
+    _bits = np.unpackbits(packets, axis=1).astype(np.float32)
+    _counts = matrix.astype(np.float32) @ _bits
+    return np.packbits(_counts.astype(np.int32) & 1, axis=1)
+
+
+def packet_array(packets):
+    """ Stack a list of 256-byte packets into a (K, 256) uint8 array """
+    return np.frombuffer(b''.join(packets), dtype=np.uint8).reshape(len(packets), SSDV_PACKET_SIZE)
+
+
+def encode_repair_packets(packets, callsign, image_id, seeds):
+    """ Produce repair packets for an image.
+
+        Args:
+            packets (list): The image's SSDV packets, 256 bytes each.
+            callsign (str): Callsign the image was sent with.
+            image_id (int): Image ID, 0-255.
+            seeds (list): Seeds of the repair packets to produce. Each seed gives a different repair packet.
+
+        Returns:
+            list: Repair packets (bytes).
+    """
+    if len(packets) > FOUNTAIN_MAX_PACKETS:
+        raise ValueError(f"Too many packets for fountain coding: {len(packets)}")
+
+    _payloads = xor_combine(repair_matrix(seeds, len(packets)), packet_array(packets))
+
+    _callsign = ssdv_encode_callsign(callsign)
+    _repair = []
+    for _seed, _payload in zip(seeds, _payloads):
+        _packet = _FOUNTAIN_FIELDS.pack(FOUNTAIN_HEADER, _callsign, image_id % 256, len(packets), _seed) + _payload.tobytes()
+        _repair.append(_packet + struct.pack('>I', ssdv_crc32(_packet[1:])))
+    return _repair
+
+
+def fountain_packet_info(packet):
+    """ Check and unpack a repair packet. Returns None if it is corrupt. """
+    if len(packet) != FOUNTAIN_PACKET_SIZE or packet[0] != FOUNTAIN_HEADER:
+        return None
+
+    _end = FOUNTAIN_PACKET_SIZE - SSDV_CRC_SIZE
+    if ssdv_crc32(bytes(packet[1:_end])) != struct.unpack('>I', packet[_end:])[0]:
+        return None
+
+    _header, _callsign, _image_id, _source_count, _seed = _FOUNTAIN_FIELDS.unpack_from(packet)
+    if _source_count == 0:
+        return None
+
+    return {
+        'callsign': ssdv_decode_callsign(struct.pack('>I', _callsign)),
+        'image_id': _image_id,
+        'source_count': _source_count,
+        'seed': _seed,
+        'payload': bytes(packet[FOUNTAIN_HEADER_SIZE:_end])
+    }
+
+
+def gf2_solve(matrix, values):
+    """ Solve matrix . x = values over GF(2), where '+' is XOR.
+
+        Args:
+            matrix (numpy.ndarray): (N, U) boolean array, N >= U.
+            values (numpy.ndarray): (N, L) uint8 array.
+
+        Returns:
+            numpy.ndarray: (U, L) uint8 array, or None if the matrix does not have full column rank.
+    """
+    _rows, _unknowns = matrix.shape
+    if _rows < _unknowns:
+        return None
+
+    # Each row is the packed matrix row, followed by its value, so one XOR updates both.
+    _width = (_unknowns + 7) // 8
+    _aug = np.concatenate([np.packbits(matrix, axis=1), values], axis=1)
+
+    for _c in range(_unknowns):
+        _byte = _c >> 3
+        _bit = np.uint8(0x80 >> (_c & 7))
+
+        _candidates = np.flatnonzero(_aug[_c:, _byte] & _bit)
+        if len(_candidates) == 0:
+            logging.debug(f"Fountain decode - rank deficient at column {_c}/{_unknowns}.")
+            return None
+        _pivot = _c + _candidates[0]
+        if _pivot != _c:
+            _aug[[_c, _pivot]] = _aug[[_pivot, _c]]
+
+        # Earlier columns are already clear in the pivot row, so only XOR from this column's byte on.
+        _others = np.flatnonzero(_aug[:, _byte] & _bit)
+        _others = _others[_others != _c]
+        if len(_others):
+            _aug[_others, _byte:] ^= _aug[_c, _byte:]
+
+    return _aug[:_unknowns, _width:]
+
+
+class FountainDecoder(object):
+    """ Collects the repair packets for one image, and rebuilds its missing packets from them """
+
+    def __init__(self, source_count, max_repair=None):
+        """
+            Args:
+                source_count (int): Number of packets in the image, K.
+                max_repair (int): Most repair packets to hold. Defaults to K + FOUNTAIN_SPARE_REPAIR, which
+                    is enough to rebuild the whole image with near certainty.
+        """
+        self.source_count = source_count
+        self.max_repair = max_repair or source_count + FOUNTAIN_SPARE_REPAIR
+
+        self._seeds = []
+        self._seen = set()
+        self._rows = []
+        self._payloads = []
+
+
+    def __len__(self):
+        """ Number of repair packets held """
+        return len(self._seeds)
+
+
+    def add(self, seed, payload):
+        """ Add a repair packet. Returns False if we already have it, or have enough. """
+        if seed in self._seen or len(self._seeds) >= self.max_repair:
+            return False
+        self._seen.add(seed)
+        self._seeds.append(seed)
+        self._rows.append(repair_row(seed, self.source_count))
+        self._payloads.append(payload)
+        return True
+
+
+    def decode(self, known, source):
+        """ Rebuild the missing source packets, if we have enough repair packets.
+
+            Args:
+                known (numpy.ndarray): Boolean, which of the K source packets we have.
+                source (numpy.ndarray): (K, 256) uint8 array of the source packets, with the ones
+                    we have filled in. Rebuilt packets are written into it.
+
+            Returns:
+                list: Indices of the source packets rebuilt. Empty if they could not all be rebuilt yet.
+        """
+        _unknown = np.flatnonzero(~known)
+        if len(_unknown) == 0 or len(_unknown) > len(self._seeds):
+            return []
+
+        _matrix = np.array(self._rows)
+        _values = packet_array(self._payloads).copy()
+
+        # Take the packets we have out of the repair packets, leaving just the unknowns.
+        _values ^= xor_combine(_matrix[:, known], source[known])
+
+        _solved = gf2_solve(_matrix[:, _unknown], _values)
+        if _solved is None:
+            return []
+
+        source[_unknown] = _solved
+        return _unknown.tolist()
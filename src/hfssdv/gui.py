@@ -4,6 +4,9 @@
 #
 #   Mark Jessop <vk5qi@rfhead.net>
 #
+#   Importing this module is cheap - Qt, pyqtgraph and the KISS TNC library
+#   are only loaded once main() builds the application.
+#
 
 
 # Python 3 check
@@ -13,27 +16,20 @@ if sys.version_info < (3, 0):
     print("This script requires Python 3!")
     sys.exit(1)
 
-import glob
-import kissfix
+import argparse
 import logging
-import pyqtgraph as pg
-import numpy as np
-from queue import Queue
-from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
-from pyqtgraph.dockarea import *
+from queue import Full, Queue
 from threading import Thread
 
-from .widgets import *
 from .packets import *
+from .pacing import *
 from .transmit import *
 from .receive import *
+from .batch import *
+from .journal import *
+from .scheduler import *
 
 
-# Setup Logging
-logging.basicConfig(
-    format="%(asctime)s %(levelname)s: %(message)s", level=logging.DEBUG
-)
-
 # Defaults
 
 DEFAULT_TNC_HOST = 'localhost'
@@ -41,346 +37,543 @@ DEFAULT_TNC_PORT = 8001
 
 VALID_IMAGE_QUALITY = [0,1,2,3,4,5,5,6,7]
 DEFAULT_IMAGE_QUALITY = 4
+# Quality selector entry which picks the image size and quality to fit the max TX time.
+AUTO_IMAGE_QUALITY = 'Auto'
+DEFAULT_MAX_TX_TIME = 5 # minutes
 
 DEFAULT_CALLSIGN = 'N0CALL'
 
-# Singleton instances of TNC Connection, SSDV TX/RX Objects, to be instantiated later.
-tnc = None
-ssdv_tx = SSDVTX()
-ssdv_rx = SSDVRX()
+# Received packets are journalled here, so received images survive a restart.
+DEFAULT_JOURNAL_FILE = 'rx_journal.bin'
 
-# Thread to deal with packets from the KISS TNC
-ssdv_rx_thread = None
-ssdv_rx_thread_running = True
+# Encoded TX images are cached here, so they can be resent after a restart.
+DEFAULT_TX_CACHE_DIR = 'tx_cache'
 
-ssdv_tx_thread = None
-ssdv_tx_thread_running = False
+# Maximum decodes per second of each received image. The display is updated 4 times a second.
+DEFAULT_DECODE_RATE = 4.0
 
+# How long background threads wait for room in the GUI's update queues, before dropping an update (seconds).
+UPDATE_QUEUE_TIMEOUT = 10.0
 
-# Queues for handling updates to image / status indications.
-image_update_queue = Queue(256)
-status_update_queue = Queue(256)
+# Qt modules, populated by load_qt()
+pg = None
+QtCore = None
+QtGui = None
+QtWidgets = None
 
-image_store = {}
-latest_image = None
 
+def load_qt():
+    """ Import Qt and pyqtgraph. These take a few seconds to load, so are only imported when the GUI is started. """
+    global pg, QtCore, QtGui, QtWidgets
 
-
-#
-#   GUI Creation - The Bad way.
-#
-
-# Create a Qt App.
-pg.mkQApp()
-
-# GUI LAYOUT - Gtk Style!
-win = QtGui.QMainWindow()
-area = DockArea()
-win.setCentralWidget(area)
-win.setWindowTitle("HF SSDV")
-
-# Create multiple dock areas, for displaying our data.
-d0 = Dock("Controls", size=(300,800))
-d1 = Dock("Image List", size=(300,800))
-d2 = Dock("RX Image", size=(800, 800))
-d3 = Dock("Image Metadata",size=(800,50))
-area.addDock(d0, "left")
-area.addDock(d1, "right", d0)
-area.addDock(d2, "right", d1)
-area.addDock(d3, "bottom", d2)
-
-
-
-# Controls
-w1 = pg.LayoutWidget()
-# TNC Connection
-tncHostLabel = QtGui.QLabel("<b>TNC Host:</b>")
-tncHostEntry = QtGui.QLineEdit(DEFAULT_TNC_HOST)
-tncPortLabel = QtGui.QLabel("<b>TNC Port:</b>")
-tncPortEntry = QtGui.QLineEdit(str(DEFAULT_TNC_PORT))
-tncConnectButton = QtGui.QPushButton("Connect")
-tncStatusLabel = QtGui.QLabel("Not Connected")
-
-# User Information & Image TX Settings
-
-userCallLabel = QtGui.QLabel("<b>Callsign:</b>")
-userCallEntry = QtGui.QLineEdit(DEFAULT_CALLSIGN)
-userCallEntry.setMaxLength(6) # Maximum SSDV callsign length.
-
-imageQualityLabel = QtGui.QLabel("<b>Img Quality:</b>")
-imageQualitySelector = QtGui.QComboBox()
-for _qual in VALID_IMAGE_QUALITY:
-    imageQualitySelector.addItem(str(_qual))
-imageQualitySelector.setCurrentIndex(
-    imageQualitySelector.findText(str(DEFAULT_IMAGE_QUALITY))
-)
-packetDelayLabel = QtGui.QLabel("<b>Delay (s)</b>")
-packetDelayEntry = QtGui.QLineEdit("8")
-
-
-# Load Image
-loadImageButton = QtGui.QPushButton("Load JPEG")
-loadImageStatus = QtGui.QLabel("No Image Loaded")
-
-txImageButton = QtGui.QPushButton("Transmit")
-txImageStatus = QtGui.QLabel("Not TXing.")
-abortTxButton = QtGui.QPushButton("Halt TX")
-
-# Layout the Control pane.
-w1.addWidget(tncHostLabel, 0, 0, 1, 1)
-w1.addWidget(tncHostEntry, 0, 1, 1, 1)
-w1.addWidget(tncPortLabel, 1, 0, 1, 1)
-w1.addWidget(tncPortEntry, 1, 1, 1, 1)
-w1.addWidget(tncConnectButton, 2, 0, 1, 2)
-w1.addWidget(tncStatusLabel, 3, 0, 1, 2)
-w1.addWidget(QHLine(), 4, 0, 1, 2)
-w1.addWidget(userCallLabel, 5, 0, 1, 1)
-w1.addWidget(userCallEntry, 5, 1, 1, 1)
-w1.addWidget(imageQualityLabel, 6, 0, 1, 1)
-w1.addWidget(imageQualitySelector, 6, 1, 1, 1)
-w1.addWidget(packetDelayLabel, 7, 0, 1, 1)
-w1.addWidget(packetDelayEntry, 7, 1, 1, 1)
-w1.addWidget(QHLine(), 8, 0, 1, 2)
-w1.addWidget(loadImageButton, 9, 0, 1, 2)
-w1.addWidget(loadImageStatus, 10, 0, 1, 2)
-w1.addWidget(QHLine(), 11, 0, 1, 2)
-w1.addWidget(txImageButton, 12, 0, 1, 2)
-w1.addWidget(txImageStatus, 13, 0, 1, 2)
-w1.addWidget(abortTxButton, 14, 0, 1, 2)
-w1.layout.setSpacing(1)
-d0.addWidget(w1)
-
-
-# Received Image List
-w2 = pg.LayoutWidget()
-
-rxImageList = QtGui.QListWidget()
-rxImageList.addItem('No Images')
-resendButton = QtGui.QPushButton("Request Resend")
-saveImageButton = QtGui.QPushButton("Save Image")
-
-# Layout
-w2.addWidget(rxImageList,0,0,1,1)
-w2.addWidget(resendButton,1,0,1,1)
-w2.addWidget(saveImageButton,2,0,1,1)
-
-d1.addWidget(w2)
-
-
-# Image Pane - Just the one ImageLabel
-w3 = pg.LayoutWidget()
-rxImageLabel = ImageLabel()
-w3.addWidget(rxImageLabel, 0, 0, 1, 1)
-d2.addWidget(w3)
-
-# Image Metadata
-w4 = pg.LayoutWidget()
-rxImageStatus = QtGui.QLabel("No Image Data Yet.")
-w4.addWidget(rxImageStatus, 0, 0, 1, 1)
-d3.addWidget(w4)
-
-# Resize window to final resolution, and display.
-logging.info("Starting GUI.")
-win.resize(1500, 800)
-win.show()
+    if pg is None:
+        import pyqtgraph
+        from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
+        pg = pyqtgraph
 
 
+class HFSSDVApp(object):
+    """ The HF SSDV GUI. load_qt() must have been called before this is created. """
 
-# Image Update Functions
+    def __init__(self, decode_processes=0):
+        """
+            Args:
+                decode_processes (int): Decode received images in this many worker processes, rather
+                    than in threads in this process. Useful when receiving from several stations at once.
+        """
 
-def changeImage(filename):
-    """ Load and display the supplied image, and update the status text field. """
-    global rxImageLabel
-
-    logging.debug(f"Loading image: {filename}")
-    pixmap = QtGui.QPixmap(filename)
-
-    rxImageLabel.pixmap = pixmap
-    rxImageLabel.repaint()
+        # TNC Connection, and SSDV TX/RX Objects.
+        self.tnc = None
+        self.ssdv_tx = SSDVTX(cache=PacketCache(DEFAULT_TX_CACHE_DIR))
+        self.journal = PacketJournal(DEFAULT_JOURNAL_FILE)
+        # Images are decoded by the decode scheduler, off the TNC read thread.
+        self.ssdv_rx = SSDVRX(journal=self.journal, defer_decode=True)
+        if decode_processes:
+            from .decodepool import ProcessDecodeBackend
+            self.decode_scheduler = DecodeScheduler(self.ssdv_rx, self.imageDecoded, max_rate=DEFAULT_DECODE_RATE,
+                workers=decode_processes, backend=ProcessDecodeBackend(decode_processes))
+        else:
+            self.decode_scheduler = DecodeScheduler(self.ssdv_rx, self.imageDecoded, max_rate=DEFAULT_DECODE_RATE)
+
+        # Thread to deal with packets from the KISS TNC
+        self.ssdv_rx_thread = None
+
+        self.ssdv_tx_thread = None
+        self.ssdv_tx_thread_running = False
+
+        # Encodes folders of images in the background. Created when first used.
+        self.batch_loader = None
+
+        # Queues for handling updates to image / status indications.
+        self.image_update_queue = Queue(256)
+        self.status_update_queue = Queue(256)
+
+        self.image_store = self.ssdv_rx.image_store
+        # Image list entry -> image store key.
+        self.image_list_keys = {}
+        self.latest_image = None
+        # (callsign, image ID, epoch) of the image currently being displayed, and the generation displayed.
+        self.displayed_image = None
+        self.displayed_generation = -1
+
+        self.resend_image_info = None
+
+        # Create a Qt App.
+        pg.mkQApp()
+
+        self.build_window()
+
+        # Recover any images received before the last restart.
+        if self.journal.replay(self.ssdv_rx):
+            self.latest_image = self.ssdv_rx.latest_update
+            self.updateImageList()
+
+        self.image_update_timer = QtCore.QTimer()
+        self.image_update_timer.timeout.connect(self.processQueues)
+        self.image_update_timer.start(250)
+
+
+    def build_window(self):
+        """ Create the window, and lay out the widgets """
+        from pyqtgraph.dockarea import DockArea, Dock
+        from .widgets import QHLine, ImageLabel
+
+        # GUI LAYOUT - Gtk Style!
+        self.win = QtGui.QMainWindow()
+        area = DockArea()
+        self.win.setCentralWidget(area)
+        self.win.setWindowTitle("HF SSDV")
+
+        # Create multiple dock areas, for displaying our data.
+        d0 = Dock("Controls", size=(300,800))
+        d1 = Dock("Image List", size=(300,800))
+        d2 = Dock("RX Image", size=(800, 800))
+        d3 = Dock("Image Metadata",size=(800,50))
+        area.addDock(d0, "left")
+        area.addDock(d1, "right", d0)
+        area.addDock(d2, "right", d1)
+        area.addDock(d3, "bottom", d2)
+
+
+        # Controls
+        w1 = pg.LayoutWidget()
+        # TNC Connection
+        tncHostLabel = QtGui.QLabel("<b>TNC Host:</b>")
+        self.tncHostEntry = QtGui.QLineEdit(DEFAULT_TNC_HOST)
+        tncPortLabel = QtGui.QLabel("<b>TNC Port:</b>")
+        self.tncPortEntry = QtGui.QLineEdit(str(DEFAULT_TNC_PORT))
+        tncConnectButton = QtGui.QPushButton("Connect")
+        self.tncStatusLabel = QtGui.QLabel("Not Connected")
+
+        # User Information & Image TX Settings
+
+        userCallLabel = QtGui.QLabel("<b>Callsign:</b>")
+        self.userCallEntry = QtGui.QLineEdit(DEFAULT_CALLSIGN)
+        self.userCallEntry.setMaxLength(6) # Maximum SSDV callsign length.
+
+        imageQualityLabel = QtGui.QLabel("<b>Img Quality:</b>")
+        self.imageQualitySelector = QtGui.QComboBox()
+        for _qual in VALID_IMAGE_QUALITY:
+            self.imageQualitySelector.addItem(str(_qual))
+        self.imageQualitySelector.addItem(AUTO_IMAGE_QUALITY)
+        self.imageQualitySelector.setCurrentIndex(
+            self.imageQualitySelector.findText(str(DEFAULT_IMAGE_QUALITY))
+        )
+        packetDelayLabel = QtGui.QLabel("<b>Delay (s)</b>")
+        self.packetDelayEntry = QtGui.QLineEdit("8")
+        bitrateLabel = QtGui.QLabel("<b>Modem Bitrate (bps)</b>")
+        self.bitrateEntry = QtGui.QLineEdit("")
+        self.bitrateEntry.setPlaceholderText("Use fixed delay")
+        maxTxTimeLabel = QtGui.QLabel("<b>Max TX Time (min)</b>")
+        self.maxTxTimeEntry = QtGui.QLineEdit(str(DEFAULT_MAX_TX_TIME))
+        repairLabel = QtGui.QLabel("<b>Repair Packets (%)</b>")
+        self.repairEntry = QtGui.QLineEdit("")
+        self.repairEntry.setPlaceholderText("None")
+
+
+        # Load Image
+        loadImageButton = QtGui.QPushButton("Load JPEG")
+        loadFolderButton = QtGui.QPushButton("Load Folder")
+        self.loadImageStatus = QtGui.QLabel("No Image Loaded")
+
+        txImageButton = QtGui.QPushButton("Transmit")
+        self.txImageStatus = QtGui.QLabel("Not TXing.")
+        abortTxButton = QtGui.QPushButton("Halt TX")
+
+        # Layout the Control pane.
+        w1.addWidget(tncHostLabel, 0, 0, 1, 1)
+        w1.addWidget(self.tncHostEntry, 0, 1, 1, 1)
+        w1.addWidget(tncPortLabel, 1, 0, 1, 1)
+        w1.addWidget(self.tncPortEntry, 1, 1, 1, 1)
+        w1.addWidget(tncConnectButton, 2, 0, 1, 2)
+        w1.addWidget(self.tncStatusLabel, 3, 0, 1, 2)
+        w1.addWidget(QHLine(), 4, 0, 1, 2)
+        w1.addWidget(userCallLabel, 5, 0, 1, 1)
+        w1.addWidget(self.userCallEntry, 5, 1, 1, 1)
+        w1.addWidget(imageQualityLabel, 6, 0, 1, 1)
+        w1.addWidget(self.imageQualitySelector, 6, 1, 1, 1)
+        w1.addWidget(packetDelayLabel, 7, 0, 1, 1)
+        w1.addWidget(self.packetDelayEntry, 7, 1, 1, 1)
+        w1.addWidget(bitrateLabel, 8, 0, 1, 1)
+        w1.addWidget(self.bitrateEntry, 8, 1, 1, 1)
+        w1.addWidget(maxTxTimeLabel, 9, 0, 1, 1)
+        w1.addWidget(self.maxTxTimeEntry, 9, 1, 1, 1)
+        w1.addWidget(repairLabel, 10, 0, 1, 1)
+        w1.addWidget(self.repairEntry, 10, 1, 1, 1)
+        w1.addWidget(QHLine(), 11, 0, 1, 2)
+        w1.addWidget(loadImageButton, 12, 0, 1, 1)
+        w1.addWidget(loadFolderButton, 12, 1, 1, 1)
+        w1.addWidget(self.loadImageStatus, 13, 0, 1, 2)
+        w1.addWidget(QHLine(), 14, 0, 1, 2)
+        w1.addWidget(txImageButton, 15, 0, 1, 2)
+        w1.addWidget(self.txImageStatus, 16, 0, 1, 2)
+        w1.addWidget(abortTxButton, 17, 0, 1, 2)
+        w1.layout.setSpacing(1)
+        d0.addWidget(w1)
+
+
+        # Received Image List
+        w2 = pg.LayoutWidget()
+
+        self.rxImageList = QtGui.QListWidget()
+        self.rxImageList.addItem('No Images')
+        resendButton = QtGui.QPushButton("Request Resend")
+        # Senders from before the compact resend request format ignore it.
+        self.resendV1Checkbox = QtGui.QCheckBox("Original Resend Format")
+        self.resendV1Checkbox.setToolTip("For senders without compact resend request support. "
+            "Only the first 120 missing packets are requested at a time.")
+        saveImageButton = QtGui.QPushButton("Save Image")
+
+        # Layout
+        w2.addWidget(self.rxImageList,0,0,1,1)
+        w2.addWidget(resendButton,1,0,1,1)
+        w2.addWidget(self.resendV1Checkbox,2,0,1,1)
+        w2.addWidget(saveImageButton,3,0,1,1)
+
+        d1.addWidget(w2)
+
+
+        # Image Pane - Just the one ImageLabel
+        w3 = pg.LayoutWidget()
+        self.rxImageLabel = ImageLabel()
+        w3.addWidget(self.rxImageLabel, 0, 0, 1, 1)
+        d2.addWidget(w3)
+
+        # Image Metadata
+        w4 = pg.LayoutWidget()
+        self.rxImageStatus = QtGui.QLabel("No Image Data Yet.")
+        w4.addWidget(self.rxImageStatus, 0, 0, 1, 1)
+        d3.addWidget(w4)
+
+        # Connect up the buttons.
+        tncConnectButton.clicked.connect(self.connectTNC)
+        loadImageButton.clicked.connect(self.loadNewImage)
+        loadFolderButton.clicked.connect(self.loadImageFolder)
+        txImageButton.clicked.connect(self.transmitImage)
+        abortTxButton.clicked.connect(self.abortTransmit)
+        resendButton.clicked.connect(self.requestResend)
+        self.resendV1Checkbox.toggled.connect(self.setResendVersion)
+        saveImageButton.clicked.connect(self.saveImage)
+
+
+    def show(self):
+        """ Resize window to final resolution, and display. """
+        logging.info("Starting GUI.")
+        self.win.resize(1500, 800)
+        self.win.show()
+
+
+    def close(self):
+        try:
+            self.tnc.stop()
+        except:
+            pass
+
+        self.decode_scheduler.stop(wait=False)
+        if self.batch_loader:
+            self.batch_loader.stop(wait=False)
+        self.journal.close()
+
+
+    # Image Update Functions
+
+    def changeImage(self, jpeg, region=None):
+        """ Display the supplied image (JPEG bytes, decoded in memory).
+
+            If a region (x, y, width, height) is supplied, only that part of the
+            currently displayed image is updated.
+        """
+        logging.debug(f"Loading image: {len(jpeg)} bytes")
+
+        if region and not self.rxImageLabel.pixmap.isNull():
+            _image = QtGui.QImage.fromData(jpeg, 'JPG')
+            if _image.size() == self.rxImageLabel.pixmap.size():
+                _x, _y, _w, _h = region
+                _painter = QtGui.QPainter(self.rxImageLabel.pixmap)
+                _painter.drawImage(_x, _y, _image, _x, _y, _w, _h)
+                _painter.end()
+                self.rxImageLabel.repaint()
+                return
 
+        pixmap = QtGui.QPixmap()
+        pixmap.loadFromData(jpeg, 'JPG')
 
+        self.rxImageLabel.pixmap = pixmap
+        self.rxImageLabel.repaint()
 
-# Load an image
-def loadNewImage():
-    """ Attempt to load a new image file into the TX image store. """
-    global ssdv_tx, loadImageStatus, userCallEntry, imageQualitySelector
-
-    fname = QtWidgets.QFileDialog.getOpenFileName(None,'Open Image','.',"Image files (*.jpg *.jpeg)")
 
-    if fname[0] != '':
-
-        _call = userCallEntry.text()
-        _quality = int(imageQualitySelector.currentText())
+    def showError(self, message):
+        error_dialog = QtWidgets.QErrorMessage()
+        error_dialog.showMessage(message)
+        error_dialog.exec_()
 
-        _result = ssdv_tx.load_new_image(
-            filename=fname[0],
-            callsign=_call,
-            quality=_quality
-        )
 
-        loadImageStatus.setText(_result)
-    else:
-        logging.error("No file selected.")
-        
-loadImageButton.clicked.connect(loadNewImage)
+    def imageSettings(self):
+        """ Read the image quality, and packet budget (None unless the quality is Auto), from the TX settings """
+        if self.imageQualitySelector.currentText() != AUTO_IMAGE_QUALITY:
+            return (int(self.imageQualitySelector.currentText()), None)
 
+        _pacer = self.txPacer()
+        try:
+            _budget = float(self.maxTxTimeEntry.text()) * 60
+            _delay = _pacer.airtime(SSDV_PACKET_SIZE) if _pacer else float(self.packetDelayEntry.text())
+        except ValueError:
+            logging.error("Invalid max TX time or delay, using the default max TX time.")
+            _budget = DEFAULT_MAX_TX_TIME * 60
+            _delay = 8
 
-def transmitImageThread():
-    global ssdv_tx, txImageStatus, tnc
+        # Repair packets are sent within the budget too.
+        _delay *= 1 + (self.fountainOverhead() or 0)
 
-    ssdv_tx_thread_running = True
+        return (DEFAULT_IMAGE_QUALITY, max(1, int(_budget // _delay)))
 
-    try:
-        _delay = int(packetDelayEntry.text())
-        _callback = txImageStatus.setText
-        ssdv_tx.transmit_current_image(
-            tnc=tnc,
-            delay=_delay,
-            status_callback=_callback
-        )
-    except Exception as e:
-        _error = f"Error sending image: {str(e)}"
-        logging.error(_error)
 
+    def txPacer(self):
+        """ A transmit pacer for the modem bitrate setting, or None to use the fixed delay """
+        try:
+            _bitrate = float(self.bitrateEntry.text())
+        except ValueError:
+            return None
 
-    ssdv_tx_thread_running = False
+        return TransmitPacer(_bitrate) if _bitrate > 0 else None
 
 
-def transmitImage():
-    global ssdv_tx, txImageStatus, tnc, ssdv_tx_thread
+    def fountainOverhead(self):
+        """ Repair packets to send after each image, as a fraction of its packet count, or None to send none """
+        try:
+            _percent = float(self.repairEntry.text())
+        except ValueError:
+            return None
 
-    if tnc is None:
-        error_dialog = QtWidgets.QErrorMessage()
-        error_dialog.showMessage('No TNC Connected!')
-        error_dialog.exec_()
-        return
+        return _percent / 100 if _percent > 0 else None
 
-    # Start up a thread to transmit an image
-    if ssdv_tx_thread_running:
-        error_dialog = QtWidgets.QErrorMessage()
-        error_dialog.showMessage('Transmission in progress!')
-        error_dialog.exec_()
-        return
 
-    else:
-        ssdv_tx_thread = Thread(target=transmitImageThread)
-        ssdv_tx_thread.start()
+    # Load an image
+    def loadNewImage(self):
+        """ Attempt to load a new image file into the TX image store. """
+        fname = QtWidgets.QFileDialog.getOpenFileName(None,'Open Image','.',"Image files (*.jpg *.jpeg *.png)")
 
+        if fname[0] != '':
 
-txImageButton.clicked.connect(transmitImage)
+            _call = self.userCallEntry.text()
+            _quality, _max_packets = self.imageSettings()
 
+            _result = self.ssdv_tx.load_new_image(
+                filename=fname[0],
+                callsign=_call,
+                quality=_quality,
+                max_packets=_max_packets
+            )
+
+            self.loadImageStatus.setText(_result)
+        else:
+            logging.error("No file selected.")
 
 
-def abortTransmit():
-    global ssdv_tx
-    logging.info("Aborting current transmission.")
-    ssdv_tx.abort()
+    def loadImageFolder(self):
+        """ Encode a folder of images into the TX image store, in the background. They are queued for transmission. """
+        _dirname = QtWidgets.QFileDialog.getExistingDirectory(None, 'Open Image Folder', '.')
 
-abortTxButton.clicked.connect(abortTransmit)
+        if _dirname == '':
+            logging.error("No folder selected.")
+            return
+
+        if self.batch_loader is None:
+            self.batch_loader = BatchLoader(self.ssdv_tx,
+                status_callback=lambda _text: self.queueStatusUpdate({'type': 'load_status', 'text': _text}, wait=False))
 
+        self.batch_loader.callsign = self.userCallEntry.text()
+        self.batch_loader.quality, self.batch_loader.max_packets = self.imageSettings()
 
-def updateImageList():
-    """ Update the Image list based on data from an image store dict """
-    global rxImageList, image_store
+        _ids = self.batch_loader.load([_dirname])
+        self.loadImageStatus.setText(f"Encoding {len(_ids)} images...")
 
-    # Get current selection
-    _selection = rxImageList.currentItem()
-    if _selection:
-        _selected_text = _selection.text()
-    else:
-        _selected_text = None
-    
-    # Clear list and re-populate from image store.
-    rxImageList.clear()
-    
-    _callsigns = list(image_store.keys())
-    _callsigns.sort()
 
-    for _call in _callsigns:
-        _images = list(image_store[_call].keys())
-        _images.sort()
+    def transmitImageThread(self):
+        self.ssdv_tx_thread_running = True
 
-        for _img in _images:
-            _width = image_store[_call][_img]['width']
-            _height = image_store[_call][_img]['height']
+        try:
+            _delay = int(self.packetDelayEntry.text())
+            self.ssdv_tx.pacer = self.txPacer()
+            self.ssdv_tx.fountain_overhead = self.fountainOverhead()
+            _callback = self.txImageStatus.setText
+            if not self.ssdv_tx.ready_queue.empty():
+                # Send the images loaded from a folder, in turn.
+                self.ssdv_tx.transmit_queued_images(
+                    tnc=self.tnc,
+                    delay=_delay,
+                    status_callback=_callback
+                )
+            else:
+                self.ssdv_tx.transmit_current_image(
+                    tnc=self.tnc,
+                    delay=_delay,
+                    status_callback=_callback
+                )
+        except Exception as e:
+            _error = f"Error sending image: {str(e)}"
+            logging.error(_error)
+
+        self.ssdv_tx_thread_running = False
+
+
+    def transmitImage(self):
+        if self.tnc is None:
+            self.showError('No TNC Connected!')
+            return
+
+        # Start up a thread to transmit an image
+        if self.ssdv_tx_thread_running:
+            self.showError('Transmission in progress!')
+            return
+
+        else:
+            self.ssdv_tx_thread = Thread(target=self.transmitImageThread)
+            self.ssdv_tx_thread.start()
+
+
+    def abortTransmit(self):
+        logging.info("Aborting current transmission.")
+        self.ssdv_tx.abort()
+
+
+    def updateImageList(self):
+        """ Update the Image list based on data from an image store dict """
+
+        # Get current selection
+        _selection = self.rxImageList.currentItem()
+        if _selection:
+            _selected_text = _selection.text()
+        else:
+            _selected_text = None
+
+        # Clear list and re-populate from image store.
+        self.rxImageList.clear()
+        self.image_list_keys = {}
+
+        for _key in sorted(self.image_store.keys()):
+            _call, _img, _epoch = _key
+            _width = self.image_store[_key].width
+            _height = self.image_store[_key].height
             _entry = f"{_call}, {_img}, {_width}x{_height}"
-            rxImageList.addItem(_entry)
-    
+            if _epoch > 0:
+                # Image ID has been re-used.
+                _entry += f" (#{_epoch})"
+            self.image_list_keys[_entry] = _key
+            self.rxImageList.addItem(_entry)
 
-    rxImageList.addItem('Latest')
 
-    # Iterate through the list and select the item which was previously selected
-    if _selected_text:
-        for i in range(rxImageList.count()):
-            if rxImageList.item(i).text() == _selected_text:
-                rxImageList.setCurrentRow(i)
+        self.rxImageList.addItem('Latest')
 
+        # Iterate through the list and select the item which was previously selected
+        if _selected_text:
+            for i in range(self.rxImageList.count()):
+                if self.rxImageList.item(i).text() == _selected_text:
+                    self.rxImageList.setCurrentRow(i)
 
 
-# Callback functions for receiving packets.
-def rxPacketHandler(packet):
-    """ Handle a received packet """
-    global ssdv_rx, image_store, latest_image
-    logging.debug(f"Received New Packet: {str(packet)}")
+    # Callback functions for receiving packets.
+    def rxPacketHandler(self, packet):
+        """ Handle a received packet """
+        logging.debug(f"Received New Packet: {str(packet)}")
 
-    # Add to SSDV RX object
-    if ssdv_rx:
-        _resp = ssdv_rx.addPacket(packet)
-        
-        if _resp:
+        # Add to SSDV RX object. Bursts give a response per packet.
+        for _resp in iter_responses(self.ssdv_rx.addPacket(packet)):
             if _resp['type'] == 'image_update':
-                # Try and writeout the current image.
-                _outfile = ssdv_rx.decode(_resp['latest'])
-
-                image_store = _resp['store']
-                latest_image = _resp['latest']
+                self.image_store = _resp['store']
+                self.latest_image = _resp['latest']
 
-                if _outfile:
-                    _status = f"Callsign: {_resp['latest']['callsign']}, ID: {_resp['latest']['id']}, Size: {_resp['latest']['width']}x{_resp['latest']['height']}px, Packets: {len(_resp['latest']['packets'])}, Missing: {len(_resp['latest']['missing'])}"
+                # Decoded in memory, in the background - nothing is written to disk until it is saved.
+                self.decode_scheduler.submit(_resp['latest'])
 
-                    image_update_queue.put_nowait(
-                        {'filename': _outfile,
-                        'status': _status})
             elif _resp['type'] == 'resend':
-                status_update_queue.put_nowait(
-                    _resp
-                )
-                    
+                self.queueStatusUpdate(_resp)
 
-def rxPacketLoop():
-    """ Pass on a received packet to rxPacketHandler """
-    global tnc
-    tnc.read(callback=rxPacketHandler)
 
+    def queueStatusUpdate(self, data, wait=True):
+        """ Pass a status update from a background thread on to the GUI, waiting if it is behind.
 
-def saveImage():
-    """ Save a selected image to a file. """
-    global rxImageList, image_store, latest_image
+            Args:
+                wait (bool): Wait for room in the queue. If False, the update is dropped when the GUI is behind -
+                    for progress updates, which may be sent while the GUI thread itself is busy.
+        """
+        try:
+            if wait:
+                self.status_update_queue.put(data, timeout=UPDATE_QUEUE_TIMEOUT)
+            else:
+                self.status_update_queue.put_nowait(data)
+        except Full:
+            logging.error(f"GUI not keeping up, dropped {data['type']} status update.")
+
+
+    def imageDecoded(self, result):
+        """ Pass a decoded image from the decode scheduler on to the GUI """
+        _image = result['image']
+        _status = f"Callsign: {_image.callsign}, ID: {_image.id}, Size: {_image.width}x{_image.height}px, Packets: {len(_image)}, Missing: {len(_image.missing)}, FEC Corrected: {_image.corrected}"
+
+        # Called on a decode thread, which waits while the GUI catches up, rather than failing.
+        try:
+            self.image_update_queue.put(
+                {'jpeg': result['jpeg'],
+                'image': (_image.callsign, _image.id, _image.epoch),
+                'generation': result['generation'],
+                'region': result['region'],
+                'status': _status},
+                timeout=UPDATE_QUEUE_TIMEOUT)
+        except Full:
+            logging.error(f"GUI not keeping up, dropped decoded image {_image.callsign} {_image.id}.")
 
-    # Get current selection
-    _selection = rxImageList.currentItem()
-    if _selection:
-        _selected_text = _selection.text()
-    else:
-        _selected_text = None
 
-    if _selected_text:
+    def rxPacketLoop(self):
+        """ Pass on a received packet to rxPacketHandler """
+        self.tnc.read(callback=self.rxPacketHandler)
+
+
+    def selectedImage(self):
+        """ Return the image currently selected in the image list, or None """
+
+        # Get current selection
+        _selection = self.rxImageList.currentItem()
+        if _selection:
+            _selected_text = _selection.text()
+        else:
+            return None
+
         if _selected_text == 'Latest':
-            if latest_image:
-                _outimg = latest_image
-            else:
-                return
-        elif _selected_text == 'No Images':
-            return
+            return self.latest_image
         else:
-            # Determine image based on call and ID
-            _fields = _selected_text.split(',')
-            _call = _fields[0]
-            _id = int(_fields[1])
+            # The image may have been dropped from the store since the list was populated.
+            _key = self.image_list_keys.get(_selected_text)
+            return self.image_store.images.get(_key)
+
 
-            _outimg = image_store[_call][_id]
-        
-        _filename = f"./{_outimg['time']}_{_outimg['callsign']}_{_outimg['id']}.jpg"
+    def saveImage(self):
+        """ Save a selected image to a file. """
+        _outimg = self.selectedImage()
+        if _outimg is None:
+            return
+
+        _filename = f"./{_outimg.time}_{_outimg.callsign}_{_outimg.id}.jpg"
 
         # Prompt for save location
         fname = QtWidgets.QFileDialog.getSaveFileName(None,'Save Image',_filename,"Image files (*.jpg *.jpeg)")
@@ -389,198 +582,167 @@ def saveImage():
             _filename = fname[0]
 
             # Decode and save file!
-            if ssdv_rx.decode(_outimg, outfile=_filename):
+            if self.ssdv_rx.decode(_outimg, outfile=_filename):
                 logging.info(f"Saved image to {_filename}")
             else:
                 logging.error("Could not save image.")
 
 
-saveImageButton.clicked.connect(saveImage)
-
+    def setResendVersion(self, v1):
+        """ Switch between the original (v1) and compact (v2) resend request formats """
+        self.ssdv_rx.resend_version = 1 if v1 else 2
+        logging.info(f"Sending v{self.ssdv_rx.resend_version} resend requests.")
 
-def requestResend():
-    global rxImageList, userCallEntry, image_store, latest_image, tnc
 
-    # Get current selection
-    _selection = rxImageList.currentItem()
-    if _selection:
-        _selected_text = _selection.text()
-    else:
-        _selected_text = None
-
-    if _selected_text:
-        if _selected_text == 'Latest':
-            if latest_image:
-                _outimg = latest_image
-            else:
-                return
-        elif _selected_text == 'No Images':
+    def requestResend(self):
+        _outimg = self.selectedImage()
+        if _outimg is None:
             return
-        else:
-            # Determine image based on call and ID
-            _fields = _selected_text.split(',')
-            _call = _fields[0]
-            _id = int(_fields[1])
-
-            _outimg = image_store[_call][_id]
 
-        _mycall = userCallEntry.text()
-        _theircall = _outimg['callsign']
-        _id = _outimg['id']
-        _lastpacket = max(list(_outimg['packets'].keys()))
-        _missing = _outimg['missing']
+        _resend_packet = self.ssdv_rx.resendRequest(_outimg, self.userCallEntry.text())
 
-        _resend_packet = encode_resend_packet(_theircall, _mycall, _id, _lastpacket, _missing)
+        if self.tnc:
+            self.tnc.write(_resend_packet)
 
-        if tnc:
-            tnc.write(_resend_packet)
 
-resendButton.clicked.connect(requestResend)
+    def handleStatusUpdate(self, data):
+        """ Handle a status update message """
+        if (data['type'] == 'load_status'):
+            # Progress from the batch image loader.
+            self.loadImageStatus.setText(data['text'])
 
-resend_image_info = None
+        elif (data['type'] == 'resend'):
+            # Someone else has requested a resend of parts of an image.
 
-def handleStatusUpdate(data):
-    """ Handle a status update message """
-    global ssdv_tx, tnc, userCallEntry, resend_image_info
-    if (data['type'] == 'resend'):
-        # Someone else has requested a resend of parts of an image.
+            _src_call = data['data']['src_call']
+            _img_id = data['data']['img_id']
 
-        # Check re-send request is for us.
-        _call = data['data']['dst_call']
-        if _call != userCallEntry.text():
-            logging.info(f"Got Resend request for {_call}, discarding.")
-            return
-
-        _src_call = data['data']['src_call']
-        _img_id = data['data']['img_id']
-        _last_pkt = data['data']['last_packet']
-        _missing = data['data']['missing']
-
-        # Check if we have image data to resend.
-        _resend_list = ssdv_tx.check_resend_ability(_img_id, _last_pkt, _missing)
-
-        if _resend_list:
-            # Check with the user to confirm resend.
-            msgBox = QtWidgets.QMessageBox()
-            msgBox.setText(f"Re-send {len(_resend_list)} packets of Image {_img_id} to {_src_call}?")
-            msgBox.setStandardButtons(QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
-            msgBox.setDefaultButton(QtWidgets.QMessageBox.No)
-            reply = msgBox.exec_()
-            if reply == QtWidgets.QMessageBox.No:
-                return
-            else:
-                # Resend.
-                resend_image_info = {'img_id': _img_id, 'packets':_resend_list}
-                if tnc is None:
-                    error_dialog = QtWidgets.QErrorMessage()
-                    error_dialog.showMessage('No TNC Connected!')
-                    error_dialog.exec_()
-                    return
+            # Check the request is for us, and that we have image data to resend.
+            _resend_list = self.ssdv_tx.resend_request_packets(data['data'], self.userCallEntry.text())
 
-                # Start up a thread to transmit an image
-                if ssdv_tx_thread_running:
-                    error_dialog = QtWidgets.QErrorMessage()
-                    error_dialog.showMessage('Transmission already in progress!')
-                    error_dialog.exec_()
+            if _resend_list:
+                # Check with the user to confirm resend.
+                msgBox = QtWidgets.QMessageBox()
+                msgBox.setText(f"Re-send {len(_resend_list)} packets of Image {_img_id} to {_src_call}?")
+                msgBox.setStandardButtons(QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+                msgBox.setDefaultButton(QtWidgets.QMessageBox.No)
+                reply = msgBox.exec_()
+                if reply == QtWidgets.QMessageBox.No:
                     return
-
                 else:
-                    ssdv_tx_thread = Thread(target=resendImageThread)
-                    ssdv_tx_thread.start()
+                    # Resend.
+                    self.resend_image_info = {'img_id': _img_id, 'packets':_resend_list}
+                    if self.tnc is None:
+                        self.showError('No TNC Connected!')
+                        return
+
+                    # Start up a thread to transmit an image
+                    if self.ssdv_tx_thread_running:
+                        self.showError('Transmission already in progress!')
+                        return
+
+                    else:
+                        self.ssdv_tx_thread = Thread(target=self.resendImageThread)
+                        self.ssdv_tx_thread.start()
+
+
+    def resendImageThread(self):
+        self.ssdv_tx_thread_running = True
+
+        if self.resend_image_info:
+            try:
+                _delay = int(self.packetDelayEntry.text())
+                self.ssdv_tx.pacer = self.txPacer()
+                _callback = self.txImageStatus.setText
+                self.ssdv_tx.transmit_image_subset(
+                    image_id=self.resend_image_info['img_id'],
+                    packets=self.resend_image_info['packets'],
+                    tnc=self.tnc,
+                    delay=_delay,
+                    status_callback=_callback
+                )
+            except Exception as e:
+                _error = f"Error sending image: {str(e)}"
+                logging.error(_error)
 
-        else:
-            logging.info(f"Received resend request for img ID {_img_id}, but not in database.")
+        self.resend_image_info = None
+        self.ssdv_tx_thread_running = False
 
 
-def resendImageThread():
-    global ssdv_tx, txImageStatus, tnc, resend_image_info
+    # TNC Connect Function.
+    def connectTNC(self):
+        """ Attempt to Connect to a TCP KISS TNC """
+        import kissfix
 
-    ssdv_tx_thread_running = True
+        _host = self.tncHostEntry.text()
+        _port = int(self.tncPortEntry.text())
 
-    if resend_image_info:
         try:
-            _delay = int(packetDelayEntry.text())
-            _callback = txImageStatus.setText
-            ssdv_tx.transmit_image_subset(
-                image_id=resend_image_info['img_id'],
-                packets=resend_image_info['packets'],
-                tnc=tnc,
-                delay=_delay,
-                status_callback=_callback
-            )
+            self.tnc = kissfix.TCPKISS(host=_host, port=_port)
+            self.tnc.start()
         except Exception as e:
-            _error = f"Error sending image: {str(e)}"
+            _error = f"Could not connect to TNC: {str(e)}"
             logging.error(_error)
+            self.tncStatusLabel.setText(_error)
+            return
 
-    resend_image_info = None
-    ssdv_tx_thread_running = False
-
-
-
-
-
-# TNC Connect Function.
-def connectTNC():
-    """ Attempt to Connect to a TCP KISS TNC """
-    global tncHostEntry, tncPortEntry, tncStatusLabel, tnc, ssdv_rx_thread
-    _host = tncHostEntry.text()
-    _port = int(tncPortEntry.text())
+        # Connected! Start up RX thread.
+        self.ssdv_rx_thread = Thread(target=self.rxPacketLoop)
+        self.ssdv_rx_thread.start()
 
-    try:
-        tnc = kissfix.TCPKISS(host=_host, port=_port)
-        tnc.start()
-    except Exception as e:
-        _error = f"Could not connect to TNC: {str(e)}"
-        logging.error(_error)
-        tncStatusLabel.setText(_error)
-        return
-    
-    # Connected! Start up RX thread.
-    ssdv_rx_thread = Thread(target=rxPacketLoop)
-    ssdv_rx_thread.start()
+        _status = f"Connected: {_host}:{_port}"
+        self.tncStatusLabel.setText(_status)
+        logging.info(_status)
 
-    _status = f"Connected: {_host}:{_port}"
-    tncStatusLabel.setText(_status)
-    logging.info(_status)
 
-tncConnectButton.clicked.connect(connectTNC)
+    # GUI Image Update Loop
+    def processQueues(self):
+        """ Read in data from the queues, this decouples the GUI and async inputs somewhat. """
 
+        while self.image_update_queue.qsize() > 0:
+            _data = self.image_update_queue.get()
 
-# GUI Image Update Loop
-def processQueues():
-    """ Read in data from the queues, this decouples the GUI and async inputs somewhat. """
-    global image_update_queue, status_update_queue, rxImageStatus
+            # Only patch the changed region if we are still showing the same image.
+            if _data['image'] == self.displayed_image:
+                if _data['generation'] < self.displayed_generation:
+                    # Older than what is on screen.
+                    continue
+                self.changeImage(_data['jpeg'], _data['region'])
+            else:
+                self.changeImage(_data['jpeg'])
+                self.displayed_image = _data['image']
+            self.displayed_generation = _data['generation']
+            self.rxImageStatus.setText(_data['status'])
 
-    while image_update_queue.qsize() > 0:
-        _data = image_update_queue.get()
+            self.updateImageList()
 
-        changeImage(_data['filename'])
-        rxImageStatus.setText(_data['status'])
+        while self.status_update_queue.qsize() > 0:
+            self.handleStatusUpdate(self.status_update_queue.get())
 
-        updateImageList()
 
-    while status_update_queue.qsize() > 0:
-        handleStatusUpdate(status_update_queue.get())
+# Main
+def main():
+    parser = argparse.ArgumentParser(description="HF SSDV GUI")
+    parser.add_argument("--decode-processes", type=int, default=0,
+        help="Decode received images in this many worker processes. (default: 0, decode in-process)")
+    args = parser.parse_args()
 
+    # Setup Logging
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s: %(message)s", level=logging.DEBUG
+    )
 
-image_update_timer = QtCore.QTimer()
-image_update_timer.timeout.connect(processQueues)
-image_update_timer.start(250)
+    load_qt()
 
+    app = HFSSDVApp(decode_processes=args.decode_processes)
+    app.show()
 
-# Main
-def main():
     # Start the Qt Loop
     if (sys.flags.interactive != 1) or not hasattr(QtCore, "PYQT_VERSION"):
         QtGui.QApplication.instance().exec_()
-    
-    try:
-        tnc.stop()
-    except:
-        pass
+
+    app.close()
 
 
 if __name__ == "__main__":
     main()
-
-
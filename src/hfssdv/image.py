@@ -0,0 +1,224 @@
+#
+#   Received SSDV Image
+#
+#   The packets of a received image are kept in one contiguous buffer (a
+#   'slab'), with packet N at offset N*256, and a bitmap of which packet IDs
+#   have been received. Missing packets are left zero-filled. The slab grows
+#   geometrically as higher packet IDs arrive.
+#
+#   Packets, and the slab as a whole, are handed out as memoryviews, so
+#   decoding and archiving an image does not copy its packets. When the slab
+#   grows a new buffer is allocated, so views handed out earlier stay valid.
+#
+
+import datetime
+import threading
+from .packets import *
+
+# Packets to allocate room for when an image is created.
+IMAGE_INITIAL_PACKETS = 16
+
+
+class MissingPackets(object):
+    """ Track the missing packets of an image, as a bitmap of received packet IDs.
+
+        Marking a packet as received is O(1). A packet is missing if it has not
+        been received, and a higher packet ID has. len() gives the number of
+        missing packets, and iterating yields the missing packet IDs, which are
+        produced on demand from the bitmap.
+    """
+
+    __slots__ = ('bitmap', 'received', 'highest')
+
+    def __init__(self):
+        # One byte per packet ID, non-zero if received.
+        self.bitmap = bytearray()
+        self.received = 0
+        self.highest = -1
+
+
+    def add(self, packet_id):
+        """ Mark a packet as received. Returns False if it had already been received. """
+        if packet_id >= len(self.bitmap):
+            # Grow by at least doubling, so extending the bitmap is amortised O(1).
+            self.bitmap.extend(bytes(max(packet_id + 1, 2 * len(self.bitmap)) - len(self.bitmap)))
+
+        if self.bitmap[packet_id]:
+            return False
+
+        self.bitmap[packet_id] = 1
+        self.received += 1
+        if packet_id > self.highest:
+            self.highest = packet_id
+        return True
+
+
+    def __contains__(self, packet_id):
+        return 0 <= packet_id < self.highest and not self.bitmap[packet_id]
+
+
+    def __len__(self):
+        return self.highest + 1 - self.received
+
+
+    def __iter__(self):
+        for _start, _end in self.ranges():
+            yield from range(_start, _end)
+
+
+    def ranges(self):
+        """ Yield the missing packets as (first, last + 1) ranges """
+        _start = self.bitmap.find(0, 0, self.highest)
+        while _start != -1:
+            _end = self.bitmap.find(1, _start, self.highest)
+            if _end == -1:
+                _end = self.highest
+            yield (_start, _end)
+            _start = self.bitmap.find(0, _end, self.highest)
+
+
+    def received_ranges(self):
+        """ Yield the received packets as (first, last + 1) ranges """
+        _start = self.bitmap.find(1, 0, self.highest + 1)
+        while _start != -1:
+            _end = self.bitmap.find(0, _start, self.highest + 1)
+            if _end == -1:
+                _end = self.highest + 1
+            yield (_start, _end)
+            _start = self.bitmap.find(1, _end, self.highest + 1)
+
+
+    def packets(self, limit=None):
+        """ Return a list of the missing packet IDs, or just the first 'limit' of them """
+        _packets = []
+        for _start, _end in self.ranges():
+            _packets.extend(range(_start, _end))
+            if limit is not None and len(_packets) >= limit:
+                return _packets[:limit]
+        return _packets
+
+
+class SSDVImage(object):
+    """ A received SSDV image - its packets, and what we know about it.
+
+        Supports 'packet_id in image', image[packet_id] (a memoryview of the
+        packet), len() (the number of packets received), and iterating over
+        the received packet IDs.
+    """
+
+    __slots__ = ('callsign', 'id', 'width', 'height', 'time', 'slab', 'missing', 'generation',
+        'decoder', 'decode_lock', 'corrected', 'epoch', 'last_update')
+
+    def __init__(self, callsign, image_id, width, height, timestamp=None, capacity=IMAGE_INITIAL_PACKETS):
+        """
+            Args:
+                callsign (str): Transmitting callsign.
+                image_id (int): SSDV image ID.
+                width (int): Image width (pixels).
+                height (int): Image height (pixels).
+                timestamp (float): Time the image was first heard. Defaults to now.
+                capacity (int): Number of packets to allocate room for up front.
+        """
+        if timestamp is None:
+            _time = datetime.datetime.utcnow()
+        else:
+            _time = datetime.datetime.utcfromtimestamp(timestamp)
+
+        self.callsign = callsign
+        self.id = image_id
+        self.width = width
+        self.height = height
+        self.time = _time.strftime("%Y-%m-%dT%H%M%S")
+
+        # Packet data, packet N at N * SSDV_PACKET_SIZE.
+        self.slab = bytearray(capacity * SSDV_PACKET_SIZE)
+        # Doubles as the bitmap of packets present in the slab.
+        self.missing = MissingPackets()
+        # Incremented for every new packet, so decodes can tell which packet set they used.
+        self.generation = 0
+
+        # Created by SSDVRX.imageDecoder() when first needed.
+        self.decoder = None
+        # Held while the decoder is in use, as images may be decoded off the receive thread.
+        self.decode_lock = threading.Lock()
+        # Symbols corrected by FEC, over all packets.
+        self.corrected = 0
+
+        # Set by the ImageStore.
+        self.epoch = None
+        self.last_update = None
+
+
+    @property
+    def capacity(self):
+        """ Number of packets the slab currently has room for """
+        return len(self.slab) // SSDV_PACKET_SIZE
+
+
+    @property
+    def nbytes(self):
+        """ Memory used by the slab (bytes) """
+        return len(self.slab)
+
+
+    def add_packet(self, packet_id, packet):
+        """ Store a packet. Returns False if it had already been received. """
+        if packet_id >= self.capacity:
+            # Copy into a new, at least doubled, slab. Resizing in place would fail while views of it are held.
+            _slab = bytearray(max(packet_id + 1, 2 * self.capacity) * SSDV_PACKET_SIZE)
+            _slab[:len(self.slab)] = self.slab
+            self.slab = _slab
+
+        if packet_id in self:
+            return False
+
+        # Fill the slot before marking it present, so a decoder on another thread never sees an empty packet.
+        _offset = packet_id * SSDV_PACKET_SIZE
+        self.slab[_offset:_offset + SSDV_PACKET_SIZE] = packet
+        self.missing.add(packet_id)
+        self.generation += 1
+        return True
+
+
+    def __contains__(self, packet_id):
+        return 0 <= packet_id < len(self.missing.bitmap) and self.missing.bitmap[packet_id] != 0
+
+
+    def __getitem__(self, packet_id):
+        if packet_id not in self:
+            raise KeyError(packet_id)
+        _offset = packet_id * SSDV_PACKET_SIZE
+        return memoryview(self.slab)[_offset:_offset + SSDV_PACKET_SIZE]
+
+
+    def __len__(self):
+        return self.missing.received
+
+
+    def __iter__(self):
+        return self.packet_ids()
+
+
+    def packet_ids(self):
+        """ Yield the IDs of the received packets, in order """
+        for _start, _end in self.missing.received_ranges():
+            yield from range(_start, _end)
+
+
+    def packets(self):
+        """ Yield views of the received packets, in packet ID order """
+        _view = memoryview(self.slab)
+        for _pkt_id in self.packet_ids():
+            yield _view[_pkt_id * SSDV_PACKET_SIZE:(_pkt_id + 1) * SSDV_PACKET_SIZE]
+
+
+    def buffer(self):
+        """ A view of the whole image, up to the highest packet received, with missing packets zero-filled """
+        return memoryview(self.slab)[:(self.missing.highest + 1) * SSDV_PACKET_SIZE]
+
+
+    def runs(self):
+        """ Yield views of each run of consecutive received packets - the image with its gaps left out """
+        _view = memoryview(self.slab)
+        for _start, _end in self.missing.received_ranges():
+            yield _view[_start * SSDV_PACKET_SIZE:_end * SSDV_PACKET_SIZE]
@@ -0,0 +1,229 @@
+#
+#   Received Packet Journal
+#
+#   An append-only binary log of received KISS frames, so the image store can
+#   be rebuilt after a crash or restart.
+#
+#   File format:
+#       8 bytes     - Magic, b'HFSSDVJ1'
+#       Records, each:
+#           8 bytes - Receive time (UNIX time, big-endian double)
+#           1 byte  - Link ID
+#           2 bytes - Frame length (big-endian)
+#           N bytes - Raw KISS frame, including the leading port byte
+#
+#   Every record is written straight through to the OS, so a crash of this
+#   process loses nothing. fsync is batched, so a power failure can lose up to
+#   fsync_interval seconds (or fsync_records records) of packets.
+#
+#   Compaction rewrites the whole file, so it is kept off the receive path:
+#   the journal is compacted when opened, and by compact_if_due(), which the
+#   owner calls when idle.
+#
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+JOURNAL_MAGIC = b'HFSSDVJ1'
+
+_RECORD_HEADER = struct.Struct('>dBH')
+
+# Anything longer than this is not a KISS frame we would have journalled - the file is corrupt from here on.
+JOURNAL_MAX_FRAME = 1024
+
+
+def scan_journal(filename):
+    """ Read all records from a journal file, using a memory-mapped scan.
+
+        A truncated or corrupt tail (e.g. from a crash part way through a
+        write) is ignored.
+
+        Args:
+            filename (str): Journal file.
+
+        Returns:
+            tuple: (list of (timestamp, link, frame) tuples, offset of the end of the last good record)
+
+    """
+    _records = []
+
+    try:
+        _f = open(filename, 'rb')
+    except FileNotFoundError:
+        return (_records, 0)
+
+    with _f:
+        _size = os.fstat(_f.fileno()).st_size
+        if _size < len(JOURNAL_MAGIC):
+            return (_records, 0)
+
+        with mmap.mmap(_f.fileno(), 0, access=mmap.ACCESS_READ) as _map:
+            if _map[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+                logging.error(f"{filename} is not a packet journal.")
+                return (_records, 0)
+
+            _offset = len(JOURNAL_MAGIC)
+            _unpack = _RECORD_HEADER.unpack_from
+            _header_len = _RECORD_HEADER.size
+
+            while _offset + _header_len <= _size:
+                _timestamp, _link, _length = _unpack(_map, _offset)
+                _start = _offset + _header_len
+                if _length > JOURNAL_MAX_FRAME or _start + _length > _size:
+                    break
+
+                _records.append((_timestamp, _link, _map[_start:_start + _length]))
+                _offset = _start + _length
+
+    if _offset != _size:
+        logging.warning(f"Ignoring {_size - _offset} bytes of incomplete data at the end of {filename}.")
+
+    return (_records, _offset)
+
+
+class PacketJournal(object):
+    """ Append-only journal of received KISS frames. """
+
+    def __init__(self, filename, fsync_interval=1.0, fsync_records=64, retention=86400, compact_interval=3600):
+        """
+            Args:
+                filename (str): Journal file. Created if it does not exist.
+                fsync_interval (float): Maximum time between fsyncs (seconds).
+                fsync_records (int): Maximum number of records between fsyncs.
+                retention (float): Records older than this (seconds) are dropped when the journal is compacted.
+                compact_interval (float): Compact the journal when opened, then this often (seconds) when
+                    compact_if_due() is called. None to disable.
+        """
+        self.filename = filename
+        self.fsync_interval = fsync_interval
+        self.fsync_records = fsync_records
+        self.retention = retention
+        self.compact_interval = compact_interval
+
+        self.records = 0
+        self._unsynced = 0
+        self._last_sync = time.time()
+        self._last_compact = time.time()
+        self._file = None
+
+        self._open()
+
+
+    def _open(self):
+        _records, _end = scan_journal(self.filename)
+        self.records = len(_records)
+
+        if _end == 0:
+            # New (or unusable) journal.
+            self._file = open(self.filename, 'wb')
+            self._file.write(JOURNAL_MAGIC)
+            self._file.flush()
+        else:
+            self._file = open(self.filename, 'r+b')
+            # Drop any incomplete record left by a crash.
+            self._file.truncate(_end)
+            self._file.seek(_end)
+
+            if self.compact_interval:
+                self.compact()
+
+
+    def append(self, frame, link=0, timestamp=None):
+        """ Add a received frame to the journal """
+        _timestamp = time.time() if timestamp is None else timestamp
+
+        self._file.write(_RECORD_HEADER.pack(_timestamp, link, len(frame)) + bytes(frame))
+        self._file.flush()
+        self.records += 1
+        self._unsynced += 1
+
+        if (self._unsynced >= self.fsync_records) or (_timestamp - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+
+    def sync(self):
+        """ Flush the journal to disk """
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.time()
+
+
+    def read(self):
+        """ Return all records in the journal, as (timestamp, link, frame) tuples """
+        self._file.flush()
+        return scan_journal(self.filename)[0]
+
+
+    def replay(self, ssdv_rx):
+        """ Rebuild a SSDVRX image store from the journal. Returns the number of frames replayed. """
+        _start = time.time()
+        _records = self.read()
+
+        for _timestamp, _link, _frame in _records:
+            ssdv_rx.addPacket(_frame, timestamp=_timestamp, replay=True)
+
+        logging.info(f"Replayed {len(_records)} frames from {self.filename} in {time.time() - _start:.3f} s.")
+        return len(_records)
+
+
+    def compact_if_due(self, now=None):
+        """ Compact the journal if compact_interval has passed since it was last compacted.
+
+            Returns:
+                int: The number of frames dropped.
+        """
+        _now = time.time() if now is None else now
+        if self.compact_interval and (_now - self._last_compact >= self.compact_interval):
+            return self.compact(now=_now)
+        return 0
+
+
+    def compact(self, now=None):
+        """ Rewrite the journal without duplicate frames, or frames older than the retention period """
+        _now = time.time() if now is None else now
+        self._last_compact = _now
+
+        _records = self.read()
+        _seen = set()
+        _kept = []
+        for _timestamp, _link, _frame in _records:
+            if self.retention and (_now - _timestamp > self.retention):
+                continue
+            if _frame in _seen:
+                continue
+            _seen.add(_frame)
+            _kept.append((_timestamp, _link, _frame))
+
+        if len(_kept) == len(_records):
+            return 0
+
+        # Write the new journal alongside, then swap it in.
+        _tempfile = self.filename + '.tmp'
+        with open(_tempfile, 'wb') as _f:
+            _f.write(JOURNAL_MAGIC)
+            for _timestamp, _link, _frame in _kept:
+                _f.write(_RECORD_HEADER.pack(_timestamp, _link, len(_frame)) + _frame)
+            _f.flush()
+            os.fsync(_f.fileno())
+
+        self._file.close()
+        os.replace(_tempfile, self.filename)
+        self._file = open(self.filename, 'r+b')
+        self._file.seek(0, os.SEEK_END)
+        self.records = len(_kept)
+        self._unsynced = 0
+
+        logging.info(f"Compacted {self.filename}, dropped {len(_records) - len(_kept)} of {len(_records)} frames.")
+        return len(_records) - len(_kept)
+
+
+    def close(self):
+        if self._file:
+            self.sync()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,267 @@
+#
+#   JPEG Tables and Bitstream Helpers
+#
+#   SSDV carries baseline JPEG entropy-coded data using the standard
+#   Huffman tables from ITU T.81 Annex K, and quantisation tables scaled by
+#   the SSDV quality level. These are shared by the encoder and decoder.
+#
+
+import struct
+
+# Natural (row-major) coefficient index for each zig-zag position.
+ZIGZAG = [
+     0,  1,  8, 16,  9,  2,  3, 10,
+    17, 24, 32, 25, 18, 11,  4,  5,
+    12, 19, 26, 33, 40, 48, 41, 34,
+    27, 20, 13,  6,  7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36,
+    29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46,
+    53, 60, 61, 54, 47, 55, 62, 63,
+]
+
+# Standard quantisation tables (50% quality), natural order.
+STD_DQT_LUMA = [
+    16, 11, 10, 16,  24,  40,  51,  61,
+    12, 12, 14, 19,  26,  58,  60,  55,
+    14, 13, 16, 24,  40,  57,  69,  56,
+    14, 17, 22, 29,  51,  87,  80,  62,
+    18, 22, 37, 56,  68, 109, 103,  77,
+    24, 35, 55, 64,  81, 104, 113,  92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103,  99,
+]
+
+STD_DQT_CHROMA = [
+    17, 18, 24, 47, 99, 99, 99, 99,
+    18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99,
+    47, 66, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+]
+
+# libjpeg-style quality percentage for each SSDV quality level (0-7).
+SSDV_QUALITY_PERCENT = [13, 18, 29, 43, 50, 71, 86, 100]
+
+# Standard Huffman tables - (code counts per length 1-16, symbol values)
+DHT_DC_LUMA = (
+    [0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0],
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+)
+
+DHT_DC_CHROMA = (
+    [0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+)
+
+DHT_AC_LUMA = (
+    [0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7D],
+    [
+        0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+        0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xA1, 0x08, 0x23, 0x42, 0xB1, 0xC1, 0x15, 0x52, 0xD1, 0xF0,
+        0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0A, 0x16, 0x17, 0x18, 0x19, 0x1A, 0x25, 0x26, 0x27, 0x28,
+        0x29, 0x2A, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+        0x4A, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+        0x6A, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7A, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+        0x8A, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9A, 0xA2, 0xA3, 0xA4, 0xA5, 0xA6, 0xA7,
+        0xA8, 0xA9, 0xAA, 0xB2, 0xB3, 0xB4, 0xB5, 0xB6, 0xB7, 0xB8, 0xB9, 0xBA, 0xC2, 0xC3, 0xC4, 0xC5,
+        0xC6, 0xC7, 0xC8, 0xC9, 0xCA, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9, 0xDA, 0xE1, 0xE2,
+        0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9, 0xEA, 0xF1, 0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7, 0xF8,
+        0xF9, 0xFA,
+    ],
+)
+
+DHT_AC_CHROMA = (
+    [0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 0x77],
+    [
+        0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21, 0x31, 0x06, 0x12, 0x41, 0x51, 0x07, 0x61, 0x71,
+        0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91, 0xA1, 0xB1, 0xC1, 0x09, 0x23, 0x33, 0x52, 0xF0,
+        0x15, 0x62, 0x72, 0xD1, 0x0A, 0x16, 0x24, 0x34, 0xE1, 0x25, 0xF1, 0x17, 0x18, 0x19, 0x1A, 0x26,
+        0x27, 0x28, 0x29, 0x2A, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48,
+        0x49, 0x4A, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68,
+        0x69, 0x6A, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7A, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87,
+        0x88, 0x89, 0x8A, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9A, 0xA2, 0xA3, 0xA4, 0xA5,
+        0xA6, 0xA7, 0xA8, 0xA9, 0xAA, 0xB2, 0xB3, 0xB4, 0xB5, 0xB6, 0xB7, 0xB8, 0xB9, 0xBA, 0xC2, 0xC3,
+        0xC4, 0xC5, 0xC6, 0xC7, 0xC8, 0xC9, 0xCA, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9, 0xDA,
+        0xE2, 0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9, 0xEA, 0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7, 0xF8,
+        0xF9, 0xFA,
+    ],
+)
+
+# SSDV MCU modes -> (horizontal, vertical) luma sampling factors.
+SSDV_MCU_MODES = {
+    0: (2, 2),
+    1: (1, 2),
+    2: (2, 1),
+    3: (1, 1),
+}
+
+
+def ssdv_dqt(quality, chroma=False):
+    """ Produce a quantisation table for a SSDV quality level.
+
+        Args:
+            quality (int): SSDV quality level, 0-7.
+            chroma (bool): Produce the chrominance table instead of luminance.
+
+        Returns:
+            list: 64 quantisation values, in natural order.
+
+    """
+    _percent = SSDV_QUALITY_PERCENT[max(0, min(7, quality))]
+
+    if _percent < 50:
+        _scale = 5000 // _percent
+    else:
+        _scale = 200 - _percent * 2
+
+    _table = STD_DQT_CHROMA if chroma else STD_DQT_LUMA
+
+    return [max(1, min(255, (_q * _scale + 50) // 100)) for _q in _table]
+
+
+def _huffman_codes(table):
+    """ Generate canonical Huffman codes for a DHT (counts, values) pair.
+
+        Returns a dict of symbol -> (code, length)
+    """
+    _counts, _values = table
+    _codes = {}
+    _code = 0
+    _i = 0
+    for _length in range(1, 17):
+        for _n in range(_counts[_length - 1]):
+            _codes[_values[_i]] = (_code, _length)
+            _code += 1
+            _i += 1
+        _code <<= 1
+
+    return _codes
+
+
+def value_bits(value):
+    """ Return the JPEG magnitude category and additional bits (as a string) for a coefficient """
+    _size = abs(value).bit_length()
+    if _size == 0:
+        return 0, ''
+    if value < 0:
+        value += (1 << _size) - 1
+    return _size, format(value, '0%db' % _size)
+
+
+def extend_value(bits, size):
+    """ Convert JPEG additional bits back into a signed coefficient value """
+    if bits < (1 << (size - 1)):
+        return bits - (1 << size) + 1
+    return bits
+
+
+class HuffmanTable(object):
+    """ Encode and decode lookups for a single JPEG Huffman table. """
+
+    def __init__(self, table):
+        self.table = table
+        self.codes = _huffman_codes(table)
+
+        # Symbol -> code as a bit string.
+        self.encode = {}
+        for _symbol, (_code, _length) in self.codes.items():
+            self.encode[_symbol] = format(_code, '0%db' % _length)
+
+        # 16-bit lookahead -> (length << 8) | symbol. Zero marks an invalid code.
+        self.lookup = [0] * 65536
+        for _symbol, (_code, _length) in self.codes.items():
+            _start = _code << (16 - _length)
+            _span = 1 << (16 - _length)
+            self.lookup[_start:_start + _span] = [(_length << 8) | _symbol] * _span
+
+        # Coefficient (DC difference) -> full code string, built on first use.
+        self._dc_cache = None
+
+
+    def dc_code(self, diff):
+        """ Encode a DC difference value """
+        if self._dc_cache is None:
+            self._dc_cache = {}
+            for _value in range(-2047, 2048):
+                _size, _bits = value_bits(_value)
+                self._dc_cache[_value] = self.encode[_size] + _bits
+
+        return self._dc_cache[diff]
+
+
+_huffman_tables = None
+
+def huffman_tables():
+    """ Return the (dc_luma, ac_luma, dc_chroma, ac_chroma) HuffmanTable objects, building them on first use. """
+    global _huffman_tables
+    if _huffman_tables is None:
+        _huffman_tables = (
+            HuffmanTable(DHT_DC_LUMA),
+            HuffmanTable(DHT_AC_LUMA),
+            HuffmanTable(DHT_DC_CHROMA),
+            HuffmanTable(DHT_AC_CHROMA),
+        )
+    return _huffman_tables
+
+
+def _segment(marker, data):
+    return struct.pack('>BBH', 0xFF, marker, len(data) + 2) + data
+
+
+def jpeg_header(width, height, quality, mode=0):
+    """ Produce the JPEG headers (SOI through SOS) for a SSDV image.
+
+        Args:
+            width (int): Image width in pixels.
+            height (int): Image height in pixels.
+            quality (int): SSDV quality level, 0-7.
+            mode (int): SSDV MCU mode (luma subsampling), 0-3.
+
+        Returns:
+            bytes: JPEG header, ready for entropy-coded data to be appended.
+
+    """
+    _h, _v = SSDV_MCU_MODES[mode]
+
+    _header = b'\xff\xd8'
+
+    # JFIF APP0
+    _header += _segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+
+    # Quantisation tables, zig-zag order.
+    _luma = ssdv_dqt(quality)
+    _chroma = ssdv_dqt(quality, chroma=True)
+    _header += _segment(0xDB,
+        b'\x00' + bytes(_luma[_i] for _i in ZIGZAG)
+        + b'\x01' + bytes(_chroma[_i] for _i in ZIGZAG))
+
+    # Start of Frame (Baseline)
+    _header += _segment(0xC0, struct.pack('>BHHB', 8, height, width, 3)
+        + bytes([1, (_h << 4) | _v, 0, 2, 0x11, 1, 3, 0x11, 1]))
+
+    # Huffman tables
+    for _class_id, _table in ((0x00, DHT_DC_LUMA), (0x10, DHT_AC_LUMA), (0x01, DHT_DC_CHROMA), (0x11, DHT_AC_CHROMA)):
+        _header += _segment(0xC4, bytes([_class_id]) + bytes(_table[0]) + bytes(_table[1]))
+
+    # Start of Scan
+    _header += _segment(0xDA, bytes([3, 1, 0x00, 2, 0x11, 3, 0x11, 0, 63, 0]))
+
+    return _header
+
+
+def pack_bits(bits):
+    """ Pack a string of '0'/'1' characters into JPEG entropy-coded bytes.
+
+        The final byte is padded with 1 bits, and 0xFF bytes are stuffed.
+    """
+    _pad = (-len(bits)) % 8
+    bits += '1' * _pad
+    if not bits:
+        return b''
+
+    _data = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+    return _data.replace(b'\xff', b'\xff\x00')
@@ -0,0 +1,236 @@
+#
+#   Asyncio KISS TNC Interface
+#
+#   A KISS-over-TCP client with separate RX/TX queues, reconnection with
+#   backoff, and all writes serialised through a single task. Also includes
+#   a stand-in TNC server, for testing without a radio.
+#
+
+import asyncio
+import logging
+
+KISS_FEND = 0xC0
+KISS_FESC = 0xDB
+KISS_TFEND = 0xDC
+KISS_TFESC = 0xDD
+
+# Command byte for a data frame on TNC port 0.
+KISS_DATA_FRAME = 0x00
+
+
+def kiss_escape(data):
+    """ Escape FEND/FESC bytes within a KISS frame """
+    return bytes(data).replace(b'\xdb', b'\xdb\xdd').replace(b'\xc0', b'\xdb\xdc')
+
+
+def kiss_unescape(data):
+    """ Reverse kiss_escape """
+    return bytes(data).replace(b'\xdb\xdc', b'\xc0').replace(b'\xdb\xdd', b'\xdb')
+
+
+def kiss_frame(data, port=0):
+    """ Produce a complete KISS data frame (with delimiters) for a packet """
+    return bytes([KISS_FEND, KISS_DATA_FRAME | (port << 4)]) + kiss_escape(data) + bytes([KISS_FEND])
+
+
+class KISSDeframer(object):
+    """ Split a KISS byte stream into frames. """
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data):
+        """ Add received data, and return a list of complete frames.
+
+            Frames are unescaped, and include the leading command (port) byte,
+            the same as kissfix provides.
+        """
+        self.buffer += data
+        _parts = self.buffer.split(bytes([KISS_FEND]))
+        # The last part is either empty, or an incomplete frame.
+        self.buffer = _parts.pop()
+        return [kiss_unescape(_part) for _part in _parts if _part]
+
+
+class KISSClient(object):
+    """ Asyncio KISS TNC client, over TCP.
+
+        Received frames are placed on rx_queue (including the command byte).
+        Frames to send are placed on tx_queue, and written by a single writer
+        task. Both queues are bounded, so a slow consumer or a slow TNC applies
+        backpressure rather than growing memory.
+    """
+
+    def __init__(self, host='localhost', port=8001, name=None,
+        rx_queue_size=256, tx_queue_size=16, reconnect_delay=1.0, max_reconnect_delay=60.0):
+
+        self.host = host
+        self.port = port
+        self.name = name if name else f"{host}:{port}"
+
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.rx_queue = asyncio.Queue(rx_queue_size)
+        self.tx_queue = asyncio.Queue(tx_queue_size)
+
+        self.connected = asyncio.Event()
+
+        # Statistics
+        self.frames_rx = 0
+        self.frames_tx = 0
+        self.reconnects = 0
+
+        self._task = None
+        # A frame taken from the TX queue, but not yet written.
+        self._pending = None
+
+
+    def start(self):
+        """ Start the connection task. Must be called from within a running event loop. """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+
+    async def stop(self):
+        """ Close the connection, and stop reconnecting. """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected.clear()
+
+
+    async def read(self):
+        """ Wait for, and return, the next received frame """
+        return await self.rx_queue.get()
+
+
+    async def write(self, frame, port=0):
+        """ Queue a frame for transmission. Waits if the TX queue is full. """
+        await self.tx_queue.put(kiss_frame(frame, port))
+
+
+    async def flush(self):
+        """ Wait until all queued frames have been written to the TNC """
+        await self.tx_queue.join()
+
+
+    async def _run(self):
+        """ Connect, run the reader and writer, and reconnect with backoff on failure. """
+        _delay = self.reconnect_delay
+
+        while True:
+            try:
+                _reader, _writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                logging.error(f"KISS {self.name} - Could not connect: {str(e)}, retrying in {_delay:.1f} s.")
+                await asyncio.sleep(_delay)
+                _delay = min(_delay * 2, self.max_reconnect_delay)
+                continue
+
+            logging.info(f"KISS {self.name} - Connected.")
+            _delay = self.reconnect_delay
+            self.connected.set()
+
+            _tasks = [
+                asyncio.ensure_future(self._reader(_reader)),
+                asyncio.ensure_future(self._writer(_writer))
+            ]
+            try:
+                await asyncio.wait(_tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                self.connected.clear()
+                for _task in _tasks:
+                    _task.cancel()
+                await asyncio.gather(*_tasks, return_exceptions=True)
+                _writer.close()
+
+            logging.error(f"KISS {self.name} - Connection lost, reconnecting.")
+            self.reconnects += 1
+            await asyncio.sleep(_delay)
+
+
+    async def _reader(self, reader):
+        _deframer = KISSDeframer()
+        while True:
+            _data = await reader.read(4096)
+            if not _data:
+                return
+
+            for _frame in _deframer.feed(_data):
+                self.frames_rx += 1
+                await self.rx_queue.put(_frame)
+
+
+    async def _writer(self, writer):
+        while True:
+            if self._pending is None:
+                self._pending = await self.tx_queue.get()
+
+            writer.write(self._pending)
+            await writer.drain()
+            self._pending = None
+            self.frames_tx += 1
+            self.tx_queue.task_done()
+
+
+class KISSServer(object):
+    """ A stand-in KISS TNC, for testing.
+
+        Every frame received from a client is relayed to all other connected
+        clients, as if it had been sent over the air.
+    """
+
+    def __init__(self, host='localhost', port=0):
+        self.host = host
+        self.port = port
+        self.clients = set()
+        self._server = None
+        self._handlers = set()
+
+
+    async def start(self):
+        """ Start listening. If port 0 was requested, self.port is updated with the real port. """
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+
+    async def stop(self):
+        self._server.close()
+        for _writer in list(self.clients):
+            _writer.close()
+        if self._handlers:
+            await asyncio.wait(self._handlers)
+        await self._server.wait_closed()
+
+
+    def relay(self, frame, source=None):
+        """ Send a frame (unescaped, including the command byte) to all clients except the source """
+        _data = bytes([KISS_FEND]) + bytes(frame[:1]) + kiss_escape(frame[1:]) + bytes([KISS_FEND])
+        for _writer in self.clients:
+            if _writer is not source:
+                _writer.write(_data)
+
+
+    async def _handle(self, reader, writer):
+        self.clients.add(writer)
+        self._handlers.add(asyncio.current_task())
+        _deframer = KISSDeframer()
+        try:
+            while True:
+                _data = await reader.read(4096)
+                if not _data:
+                    break
+                for _frame in _deframer.feed(_data):
+                    self.relay(_frame, source=writer)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
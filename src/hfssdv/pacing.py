@@ -0,0 +1,234 @@
+#
+#   Transmit Pacing
+#
+#   Works out how long to wait between writing packets to the TNC, from the
+#   modem's bitrate and frame size, instead of a fixed, guessed delay. A model
+#   of the TNC's transmit queue is kept - when each frame written will have
+#   finished going out over the air - and the next frame is written once the
+#   queue has drained to target_depth frames. The TNC then always has the
+#   next frame ready (no idle gaps on air), but its buffer is never flooded.
+#
+#   If the TNC can report how many frames it has queued (buffer occupancy,
+#   or acknowledgements of transmitted frames), pass it to feedback(). The
+#   model is re-synchronised, and its airtime estimates scaled to match the
+#   drain rate actually measured, so a mis-configured bitrate corrects itself.
+#   A TNC which acknowledges each frame as it is sent can be turned into a
+#   queue depth by counting frames written minus frames acknowledged.
+#
+#   SimulatedTNC is a stand-in TNC which drains frames at a configurable
+#   rate, for testing and benchmarking pacing without a radio.
+#
+
+import logging
+import math
+import time
+from collections import deque
+
+
+def frame_airtime(nbytes, bitrate, modem_frame=None, frame_overhead=0.0):
+    """ Time taken to send a frame over the air (seconds).
+
+        Args:
+            nbytes (int): Frame length (bytes).
+            bitrate (float): Modem payload bitrate (bits/second).
+            modem_frame (int): Payload bytes per modem frame, if the modem sends fixed-size frames
+                (e.g. FreeDV data modes). Frames are padded out to a whole number of modem frames.
+            frame_overhead (float): Preamble/sync time per modem frame (seconds).
+    """
+    if modem_frame:
+        _frames = max(1, math.ceil(nbytes / modem_frame))
+        return _frames * (frame_overhead + modem_frame * 8 / bitrate)
+
+    return frame_overhead + nbytes * 8 / bitrate
+
+
+class TransmitPacer(object):
+    """ Paces writes to a TNC, keeping its transmit queue just full enough to avoid idle air time """
+
+    def __init__(self, bitrate, modem_frame=None, frame_overhead=0.0, target_depth=2,
+        min_delay=0.0, max_delay=60.0, feedback_gain=0.25, queue_depth=None, clock=time.monotonic):
+        """
+            Args:
+                bitrate (float): Modem payload bitrate (bits/second).
+                modem_frame (int): Payload bytes per modem frame, for modems with fixed-size frames.
+                frame_overhead (float): Preamble/sync time per modem frame (seconds).
+                target_depth (int): Frames to keep queued in the TNC - the one on air, and the ones waiting.
+                min_delay (float): Shortest delay between writes (seconds).
+                max_delay (float): Longest delay between writes (seconds).
+                feedback_gain (float): How far each feedback() measurement moves the airtime estimate, 0-1.
+                queue_depth (function): For TNCs which can report their buffer occupancy - returns the
+                    number of frames the TNC holds. Polled, and passed to feedback(), after every write.
+                clock (function): Time source, in seconds. Replaceable for simulation.
+        """
+        self.bitrate = bitrate
+        self.modem_frame = modem_frame
+        self.frame_overhead = frame_overhead
+        self.target_depth = max(1, target_depth)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.feedback_gain = feedback_gain
+        self.queue_depth = queue_depth
+        self.clock = clock
+
+        # Measured airtime / modelled airtime, updated by feedback().
+        self.scale = 1.0
+
+        # (finish time, modelled airtime) of each frame the TNC is modelled to still hold, oldest first.
+        # Modelled airtimes are before scaling.
+        self._queue = deque()
+        self._last_airtime = frame_airtime(257, bitrate, modem_frame, frame_overhead)
+        # Queue depth and time at the last feedback(), and frames written since.
+        self._last_feedback = None
+        self._written = 0
+
+
+    def airtime(self, nbytes):
+        """ Estimated time to send a frame of nbytes over the air (seconds) """
+        return frame_airtime(nbytes, self.bitrate, self.modem_frame, self.frame_overhead) * self.scale
+
+
+    def depth(self, now=None):
+        """ Number of frames the TNC is modelled to hold, including the one on air """
+        _now = self.clock() if now is None else now
+        while self._queue and self._queue[0][0] <= _now:
+            self._queue.popleft()
+        return len(self._queue)
+
+
+    def delay(self, now=None):
+        """ Time to wait before the next write, so the TNC holds no more than target_depth frames (seconds) """
+        _now = self.clock() if now is None else now
+        _depth = self.depth(_now)
+        if _depth < self.target_depth:
+            return self.min_delay
+
+        # Wait for enough frames to go out that the next one brings the queue back up to target_depth.
+        _wait = self._queue[_depth - self.target_depth][0] - _now
+        return min(self.max_delay, max(self.min_delay, _wait))
+
+
+    def sent(self, nbytes, now=None):
+        """ Note that a frame of nbytes has been written to the TNC.
+
+            Returns:
+                float: Time to wait before the next write (seconds).
+        """
+        _now = self.clock() if now is None else now
+        self.depth(_now)
+
+        self._last_airtime = frame_airtime(nbytes, self.bitrate, self.modem_frame, self.frame_overhead)
+        _start = self._queue[-1][0] if self._queue else _now
+        self._queue.append((_start + self._last_airtime * self.scale, self._last_airtime))
+        self._written += 1
+
+        if self.queue_depth is not None:
+            self.feedback(self.queue_depth(), _now)
+
+        return self.delay(_now)
+
+
+    def feedback(self, depth, now=None):
+        """ Update the model with the number of frames the TNC reports it holds, including any on air """
+        _now = self.clock() if now is None else now
+
+        if self._last_feedback is not None:
+            _last_depth, _last_time = self._last_feedback
+            _drained = _last_depth + self._written - depth
+            # Only measure while the TNC was sending throughout, otherwise idle time would count as airtime.
+            if _drained > 0 and _last_depth > 0 and depth > 0 and _now > _last_time:
+                _ratio = (_now - _last_time) / (_drained * self._typical_airtime())
+                self.scale += self.feedback_gain * (_ratio - self.scale)
+                logging.debug(f"Pacer - measured {_ratio:.2f}x modelled airtime, scale now {self.scale:.3f}.")
+
+        self._last_feedback = (depth, _now)
+        self._written = 0
+
+        # Re-synchronise the model - the frames the TNC holds finish back to back from now.
+        # If it holds frames we had modelled as sent, assume they are like the last one written.
+        _airtimes = [_airtime for _finish, _airtime in self._queue][-depth:] if depth else []
+        _airtimes = [self._last_airtime] * (depth - len(_airtimes)) + _airtimes
+        self._queue.clear()
+        _finish = _now
+        for _airtime in _airtimes:
+            _finish += _airtime * self.scale
+            self._queue.append((_finish, _airtime))
+
+
+    def _typical_airtime(self):
+        """ Mean modelled (unscaled) airtime of the frames in the queue, or of the last frame written """
+        if not self._queue:
+            return self._last_airtime
+        return sum(_airtime for _finish, _airtime in self._queue) / len(self._queue)
+
+
+class SimulatedTNC(object):
+    """ A stand-in TNC, which sends frames over a simulated channel at a fixed rate.
+
+        Frames are written into a transmit buffer of buffer_frames frames, and
+        drained one at a time, each taking frame_airtime() to send. Frames
+        written while the buffer is full are dropped. Air time spent idle while
+        there were still frames to come is counted as idle_time.
+    """
+
+    def __init__(self, bitrate, modem_frame=None, frame_overhead=0.0, buffer_frames=8, clock=time.monotonic):
+        self.bitrate = bitrate
+        self.modem_frame = modem_frame
+        self.frame_overhead = frame_overhead
+        self.buffer_frames = buffer_frames
+        self.clock = clock
+
+        # Finish time of each frame in the buffer, oldest first.
+        self._queue = deque()
+
+        self.frames_written = 0
+        self.frames_sent = 0
+        self.overflows = 0
+        self.idle_time = 0.0
+        self.bytes_sent = 0
+        self.first_write = None
+        self.last_finish = None
+
+
+    def _drain(self, now):
+        while self._queue and self._queue[0] <= now:
+            self._queue.popleft()
+            self.frames_sent += 1
+
+
+    def depth(self):
+        """ Frames held in the buffer, including the one on air - the buffer occupancy feedback a TNC could give """
+        self._drain(self.clock())
+        return len(self._queue)
+
+
+    def write(self, frame):
+        _now = self.clock()
+        self._drain(_now)
+
+        if self.first_write is None:
+            self.first_write = _now
+
+        self.frames_written += 1
+        if len(self._queue) >= self.buffer_frames:
+            self.overflows += 1
+            return
+
+        if self._queue:
+            _start = self._queue[-1]
+        else:
+            _start = _now
+            if self.last_finish is not None and _now > self.last_finish:
+                self.idle_time += _now - self.last_finish
+
+        self.last_finish = _start + frame_airtime(len(frame), self.bitrate, self.modem_frame, self.frame_overhead)
+        self._queue.append(self.last_finish)
+        self.bytes_sent += len(frame)
+
+
+    def stats(self):
+        return {
+            'frames_written': self.frames_written,
+            'overflows': self.overflows,
+            'idle_time': self.idle_time,
+            'duration': (self.last_finish - self.first_write) if self.first_write is not None else 0.0
+        }
@@ -1,5 +1,6 @@
 import struct
 import traceback
+import zlib
 
 #
 # SSDV - Packets as per https://ukhas.org.uk/guides:ssdv
@@ -10,6 +11,23 @@ SSDV_RES_MULTIPLE = 16 # All SSDV packets need to have width/heights that are mu
 
 SSDV_HEADER = 0x55
 RESEND_HEADER = 0x50
+RESEND_HEADER_V2 = 0x51  # Compact resend requests - see encode_resend_packet_v2
+FOUNTAIN_HEADER = 0x46   # Fountain-coded repair packets - see fountain.py
+
+SSDV_PACKET_SIZE = 256
+SSDV_HEADER_SIZE = 15   # Sync byte through to the MCU index.
+SSDV_CRC_SIZE = 4
+SSDV_FEC_SIZE = 32
+
+SSDV_TYPE_FEC = 0x66
+SSDV_TYPE_NOFEC = 0x67
+
+# Payload lengths for each packet type.
+SSDV_PAYLOAD_FEC = SSDV_PACKET_SIZE - SSDV_HEADER_SIZE - SSDV_CRC_SIZE - SSDV_FEC_SIZE
+SSDV_PAYLOAD_NOFEC = SSDV_PACKET_SIZE - SSDV_HEADER_SIZE - SSDV_CRC_SIZE
+
+SSDV_NO_MCU_OFFSET = 0xFF
+SSDV_NO_MCU_ID = 0xFFFF
 
 _ssdv_callsign_alphabet = '-0123456789---ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 def ssdv_decode_callsign(code):
@@ -35,6 +53,20 @@ def ssdv_decode_callsign(code):
     return callsign
 
 
+def ssdv_encode_callsign(callsign):
+    """ Encode a callsign (up to 6 characters) into its SSDV integer representation. """
+    code = 0
+
+    for c in reversed(callsign[:6].upper()):
+        code *= 40
+        if 'A' <= c <= 'Z':
+            code += ord(c) - ord('A') + 14
+        elif '0' <= c <= '9':
+            code += ord(c) - ord('0') + 1
+
+    return code
+
+
 def ssdv_packet_info(packet):
     """ Extract various information out of a SSDV packet, and present as a dict. """
     packet = list(bytearray(packet))
@@ -63,6 +95,91 @@ def ssdv_packet_info(packet):
         return None
 
 
+# Header field layout - (name, numpy format, offset) - for batch parsing.
+SSDV_HEADER_FIELDS = [
+    ('sync', 'u1', 0),
+    ('type', 'u1', 1),
+    ('callsign', '>u4', 2),
+    ('image_id', 'u1', 6),
+    ('packet_id', '>u2', 7),
+    ('width', 'u1', 9),
+    ('height', 'u1', 10),
+    ('flags', 'u1', 11),
+    ('mcu_offset', 'u1', 12),
+    ('mcu_id', '>u2', 13),
+]
+
+_header_dtype = None
+
+def ssdv_header_dtype():
+    """ NumPy structured dtype for a SSDV packet header """
+    global _header_dtype
+
+    if _header_dtype is None:
+        # Imported here, so numpy is only loaded when batch parsing is used.
+        import numpy as np
+
+        _header_dtype = np.dtype({
+            'names': [_f[0] for _f in SSDV_HEADER_FIELDS],
+            'formats': [_f[1] for _f in SSDV_HEADER_FIELDS],
+            'offsets': [_f[2] for _f in SSDV_HEADER_FIELDS],
+            'itemsize': SSDV_HEADER_SIZE
+        })
+
+    return _header_dtype
+
+
+def ssdv_packet_headers(data, stride=SSDV_PACKET_SIZE, offset=0):
+    """ Parse the headers of many SSDV packets at once.
+
+        Args:
+            data (bytes, memoryview or numpy.ndarray): Contiguous buffer of fixed-size records, e.g. the
+                contents of a .bin file of concatenated 256-byte packets.
+            stride (int): Size of each record - 257 for KISS frames with a leading port byte.
+            offset (int): Offset of the SSDV packet within each record - 1 for KISS frames.
+
+        Returns:
+            dict: Columnar numpy arrays, one entry per record - 'callsign' (the encoded callsign, see
+                ssdv_decode_callsigns), 'type', 'image_id', 'packet_id', 'width' and 'height' (in pixels),
+                'flags', 'quality', 'eoi', 'mcu_mode', 'mcu_offset', 'mcu_id', and 'valid' (sync byte
+                and packet type are correct). A trailing partial record is ignored.
+
+    """
+    import numpy as np
+
+    _buffer = np.frombuffer(data, dtype=np.uint8)
+    # A view of just the headers - nothing is copied until the fields are extracted below.
+    _raw = np.ndarray((len(_buffer) // stride,), dtype=ssdv_header_dtype(), buffer=_buffer,
+        offset=offset, strides=(stride,))
+
+    return {
+        'callsign': _raw['callsign'].astype(np.uint32),
+        'type': _raw['type'].copy(),
+        'image_id': _raw['image_id'].copy(),
+        'packet_id': _raw['packet_id'].astype(np.uint16),
+        'width': _raw['width'].astype(np.uint16) * SSDV_RES_MULTIPLE,
+        'height': _raw['height'].astype(np.uint16) * SSDV_RES_MULTIPLE,
+        'flags': _raw['flags'].copy(),
+        'quality': ((_raw['flags'] >> 3) & 0x07) ^ 0x04,
+        'eoi': (_raw['flags'] & 0x04) != 0,
+        'mcu_mode': _raw['flags'] & 0x03,
+        'mcu_offset': _raw['mcu_offset'].copy(),
+        'mcu_id': _raw['mcu_id'].astype(np.uint16),
+        'valid': (_raw['sync'] == SSDV_HEADER) & ((_raw['type'] == SSDV_TYPE_FEC) | (_raw['type'] == SSDV_TYPE_NOFEC)),
+    }
+
+
+def ssdv_decode_callsigns(codes):
+    """ Decode an array of encoded callsigns (from ssdv_packet_headers) into a list of strings.
+        Each distinct callsign is only decoded once.
+    """
+    import numpy as np
+
+    _unique, _inverse = np.unique(codes, return_inverse=True)
+    _calls = [ssdv_decode_callsign(struct.pack('>I', int(_code))) for _code in _unique]
+    return [_calls[_i] for _i in _inverse.tolist()]
+
+
 def ssdv_packet_string(packet):
     """ Produce a textual representation of a SSDV packet. """
     if packet_info:
@@ -95,7 +212,10 @@ def encode_resend_packet(dstcall, srccall, img_id, last_packet, packets):
     return _resend_packet
 
 def decode_resend_packet(packet):
-    """ Decode a Resend request packet """
+    """ Decode a Resend request packet, in either format """
+    if len(packet) > 0 and packet[0] == RESEND_HEADER_V2:
+        return decode_resend_packet_v2(packet)
+
     _resend_struct = "B6s6sBH" + 'h'*MAX_PACKET_LIST
 
     _fields = struct.unpack(_resend_struct, packet)
@@ -112,4 +232,170 @@ def decode_resend_packet(packet):
         if _fields[_i] != -1:
             _output['missing'].append(_fields[_i])
 
-    return _output
\ No newline at end of file
+    return _output
+
+
+#
+#   Compact (v2) resend requests, listing as many missing packets as fit in one frame.
+#
+#   1 byte      - RESEND_HEADER_V2 (0x51)
+#   6 bytes     - Source callsign (ASCII, zero padded)
+#   6 bytes     - Destination callsign (ASCII, zero padded)
+#   1 byte      - Image ID
+#   2 bytes     - Last packet received (big-endian)
+#   1 byte      - Encoding of the missing packets, RESEND_RANGES or RESEND_BITMAP
+#   N bytes     - Missing packets:
+#                   RESEND_RANGES - for each run of missing packets, varints of the gap since the end
+#                       of the last run, and the run length - 1.
+#                   RESEND_BITMAP - one bit per packet ID from 0, most significant bit first, set if missing.
+#   4 bytes     - CRC32 of the preceding bytes, from the source callsign on
+#
+#   Whichever encoding is shorter is used - ranges for a few long fades, the
+#   bitmap for scattered losses. If the missing packets don't fit within the
+#   maximum request size, the lowest IDs are listed, and the rest are left for
+#   later requests.
+#
+
+RESEND_RANGES = 0
+RESEND_BITMAP = 1
+
+_RESEND_V2_FIELDS = struct.Struct('>B6s6sBHB')
+
+def _encode_varint(value):
+    """ Unsigned LEB128 - 7 bits per byte, least significant first, top bit set if more follow """
+    _out = bytearray()
+    while True:
+        _byte = value & 0x7F
+        value >>= 7
+        if value:
+            _out.append(_byte | 0x80)
+        else:
+            _out.append(_byte)
+            return bytes(_out)
+
+
+def _decode_varint(data, offset):
+    """ Decode a varint, returning (value, offset after it) """
+    _value = 0
+    _shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated varint")
+        _byte = data[offset]
+        offset += 1
+        _value |= (_byte & 0x7F) << _shift
+        _shift += 7
+        if not _byte & 0x80:
+            return (_value, offset)
+
+
+def packet_ranges(packets):
+    """ Convert a list of packet IDs into sorted (first, last + 1) ranges """
+    _ranges = []
+    for _pkt in sorted(set(packets)):
+        if _ranges and _ranges[-1][1] == _pkt:
+            _ranges[-1][1] = _pkt + 1
+        else:
+            _ranges.append([_pkt, _pkt + 1])
+    return [tuple(_range) for _range in _ranges]
+
+
+def encode_resend_packet_v2(dstcall, srccall, img_id, last_packet, packets, max_size=SSDV_PACKET_SIZE):
+    """ Generate a compact (v2) Resend request packet
+
+        Args:
+            max_size (int): Maximum size of the request (bytes). Only the lowest missing packet IDs which
+                fit are listed. None for no limit.
+    """
+    _ranges = packet_ranges(_pkt for _pkt in packets if _pkt >= 0)
+
+    # Encoded ranges, and their length after each range.
+    _range_data = bytearray()
+    _range_lengths = []
+    _end = 0
+    for _first, _last in _ranges:
+        _range_data += _encode_varint(_first - _end)
+        _range_data += _encode_varint(_last - _first - 1)
+        _range_lengths.append(len(_range_data))
+        _end = _last
+
+    if max_size is not None:
+        # Keep as many of the lowest ranges as fit, in either encoding.
+        _space = max_size - _RESEND_V2_FIELDS.size - 4
+        _count = len(_ranges)
+        while _count > 0 and min(_range_lengths[_count - 1], (_ranges[_count - 1][1] + 7) // 8) > _space:
+            _count -= 1
+
+        if _count < len(_ranges):
+            _ranges = _ranges[:_count]
+            _range_data = _range_data[:_range_lengths[_count - 1]] if _count else bytearray()
+            _end = _ranges[-1][1] if _count else 0
+
+    _bitmap = bytearray((_end + 7) // 8)
+    for _first, _last in _ranges:
+        for _pkt in range(_first, _last):
+            _bitmap[_pkt >> 3] |= 0x80 >> (_pkt & 7)
+
+    if len(_bitmap) < len(_range_data):
+        _encoding, _data = RESEND_BITMAP, _bitmap
+    else:
+        _encoding, _data = RESEND_RANGES, _range_data
+
+    _resend_packet = _RESEND_V2_FIELDS.pack(
+        RESEND_HEADER_V2,
+        srccall.encode(),
+        dstcall.encode(),
+        img_id,
+        last_packet,
+        _encoding) + bytes(_data)
+
+    return _resend_packet + struct.pack('>I', zlib.crc32(_resend_packet[1:]) & 0xFFFFFFFF)
+
+
+def decode_resend_packet_v2(packet):
+    """ Decode a compact (v2) Resend request packet. Raises ValueError if it is corrupt. """
+    if len(packet) < _RESEND_V2_FIELDS.size + 4 or packet[0] != RESEND_HEADER_V2:
+        raise ValueError("Not a v2 resend request")
+
+    if zlib.crc32(bytes(packet[1:-4])) & 0xFFFFFFFF != struct.unpack('>I', packet[-4:])[0]:
+        raise ValueError("Resend request CRC error")
+
+    _fields = _RESEND_V2_FIELDS.unpack_from(packet)
+    _data = bytes(packet[_RESEND_V2_FIELDS.size:-4])
+
+    _missing = []
+    if _fields[5] == RESEND_RANGES:
+        _end = 0
+        _offset = 0
+        while _offset < len(_data):
+            _gap, _offset = _decode_varint(_data, _offset)
+            _length, _offset = _decode_varint(_data, _offset)
+            _first = _end + _gap
+            _end = _first + _length + 1
+            _missing.extend(range(_first, _end))
+
+    elif _fields[5] == RESEND_BITMAP:
+        for _byte_index, _byte in enumerate(_data):
+            for _bit in range(8):
+                if _byte & (0x80 >> _bit):
+                    _missing.append(_byte_index * 8 + _bit)
+
+    else:
+        raise ValueError(f"Unknown resend request encoding: {_fields[5]}")
+
+    return {
+        'src_call': _fields[1].decode('ascii').strip('\x00'),
+        'dst_call': _fields[2].decode('ascii').strip('\x00'),
+        'img_id': _fields[3],
+        'last_packet': _fields[4],
+        'missing': _missing
+    }
+
+
+def is_resend_packet(packet):
+    """ Check if a packet (without the TNC port byte) looks like a resend request, in either format """
+    if len(packet) == 0:
+        return False
+    if packet[0] == RESEND_HEADER:
+        return len(packet) == SSDV_PACKET_SIZE
+    return packet[0] == RESEND_HEADER_V2 and len(packet) >= _RESEND_V2_FIELDS.size + 4
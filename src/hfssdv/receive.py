@@ -2,71 +2,283 @@
 #   SSDV RX Lib
 #
 
-import datetime
 import logging
-import os
-import sys
-import time
+from collections import OrderedDict
+from .burst import *
+from .fec import *
+from .image import *
 from .packets import *
+from .store import *
+
+
+# Images to collect fountain-coded repair packets for at once.
+MAX_FOUNTAIN_IMAGES = 4
+
+
+def iter_responses(resp):
+    """ Yield the individual responses within a result of SSDVRX.addPacket - one per packet, for a burst,
+        or for the packets rebuilt from repair packets.
+    """
+    if resp is None:
+        return
+    if resp['type'] in ('burst', 'repair'):
+        for _resp in resp['responses']:
+            yield from iter_responses(_resp)
+    else:
+        yield resp
+
 
 class SSDVRX(object):
     """ Class to handle receipt of SSDV packets and their organisation into images. """
 
-    def __init__(self, ssdv_path="./ssdv"):
+    def __init__(self, max_images=100, max_bytes=64*1024*1024, max_age=None, epoch_timeout=3600, archive_dir=None, journal=None,
+        defer_decode=False, resend_version=2, resend_max_size=SSDV_PACKET_SIZE):
+        """
+            Args:
+                max_images (int): Maximum number of images to hold in memory. None for no limit.
+                max_bytes (int): Maximum packet data to hold in memory (bytes). None for no limit.
+                max_age (float): Drop images which have not been updated for this long (seconds). None to disable.
+                epoch_timeout (float): Treat a packet as the start of a new image if its callsign and image ID
+                    have not been heard for this long (seconds), as image IDs wrap around.
+                archive_dir (str): If set, images dropped from memory are written to this directory.
+                journal (PacketJournal): If set, received SSDV packets are written to this journal.
+                defer_decode (bool): Don't decode packets as they are added - images are brought up to date
+                    when decode() is called, e.g. by a DecodeScheduler.
+                resend_version (int): Resend request format to send - 2 for the compact format, which
+                    lists many more missing packets, or 1 for senders which only support the original format.
+                resend_max_size (int): Maximum size of a compact (v2) resend request (bytes), e.g. the TNC's
+                    maximum frame size. Missing packets which don't fit are left for later requests.
+        """
+
+        self.image_store = ImageStore(
+            max_images=max_images,
+            max_bytes=max_bytes,
+            max_age=max_age,
+            epoch_timeout=epoch_timeout,
+            archive_dir=archive_dir
+        )
 
-        self.ssdv_path = ssdv_path
+        self.journal = journal
+        self.defer_decode = defer_decode
+        self.resend_version = resend_version
+        self.resend_max_size = resend_max_size
+
+        # Packet integrity statistics.
+        self.crc_errors = 0
+        self.fec_corrected_packets = 0
+        self.fec_corrected_symbols = 0
 
-        self.image_store = {}
-        
         self.latest_update = None
 
-        if not os.path.isfile(ssdv_path):
-            logging.critical("Could not find SSDV binary.")
-            sys.exit(1)
+        # (callsign, image ID, packet count) -> FountainDecoder, least recently used first.
+        self.fountain_decoders = OrderedDict()
+        # Packets rebuilt from repair packets.
+        self.repaired_packets = 0
     
 
     def calculateMissing(self, received):
-        """ Calculate the missing packets based on the received packets """
-        _missing = []
-        for i in range(max(received)):
-            if i not in received:
-                _missing.append(i)
-        
-        return _missing
+        """ Calculate the missing packets based on a list of received packet IDs """
+        _missing = MissingPackets()
+        for i in received:
+            _missing.add(i)
 
+        return _missing.packets()
 
-    def decode(self, image, tempfile='rxtemp.bin', outfile='rxtemp.jpg'):
-        """ Attempt to write-out a SSDV image to a file """
-        
-        # Grab list of packets and sort.
-        _packet_numbers = list(image['packets'].keys())
-        _packet_numbers.sort()
 
-        # Write out to disk.
-        _f = open(tempfile, 'wb')
-        for _pkt in _packet_numbers:
-            _f.write(image['packets'][_pkt])
-        _f.close()
+    def imageDecoder(self, image):
+        """ Return the decoder for an image, creating it from the image's packets if it has not been made yet,
+            and bringing it up to date with any packets added since it was last used.
+        """
+        if image.decoder is None:
+            # Imported here, so numpy and PIL are only loaded once we have an image to decode.
+            from .decoder import SSDVDecoder
 
-        # Attempt to SSDV decode the file.
+            # Decode straight from the image's packet buffer, rather than copying the packets.
+            image.decoder = SSDVDecoder(image.buffer(), store=image)
+        else:
+            image.decoder.sync()
 
-        _command = f"./ssdv -d {tempfile} {outfile} 2>/dev/null > /dev/null"
+        return image.decoder
 
-        retcode = os.system(_command)
 
-        if retcode == 0:
-            return outfile
-        else:
+    def decode(self, image, outfile=None):
+        """ Decode a SSDV image, in memory or to a file
+
+            Args:
+                image (SSDVImage): Image to decode.
+                outfile (str): File to write the JPEG to. If not supplied, nothing is written to disk.
+
+            Returns:
+                The JPEG (bytes) if outfile was not supplied, otherwise outfile. None if the image
+                could not be decoded.
+        """
+
+        try:
+            with image.decode_lock:
+                _jpeg = self.imageDecoder(image).get_jpeg()
+        except Exception as e:
+            logging.error(f"Could not decode image: {str(e)}")
+            return None
+
+        if _jpeg is None or outfile is None:
+            return _jpeg
+
+        try:
+            with open(outfile, 'wb') as _f:
+                _f.write(_jpeg)
+        except Exception as e:
+            logging.error(f"Could not write image to {outfile}: {str(e)}")
             return None
 
+        return outfile
+
+
+    def newImage(self, callsign, image_id, width, height, timestamp=None):
+        """ Create a new (empty) image, ready to be added to the image store """
+        return SSDVImage(callsign, image_id, width, height, timestamp=timestamp)
+
+
+    def importPackets(self, data, timestamp=None):
+        """ Bulk import SSDV packets, e.g. from an archived .bin file.
+
+            The packet headers are parsed in one batch, and images are not
+            decoded until they are needed. Nothing is journalled.
+
+            Args:
+                data (bytes): Concatenated 256-byte SSDV packets.
+                timestamp (float): Time to record the packets as received at. Defaults to now.
+
+            Returns:
+                int: Number of packets imported.
+        """
+        _headers = ssdv_packet_headers(data)
+        _callsigns = ssdv_decode_callsigns(_headers['callsign'])
+        _image_ids = _headers['image_id'].tolist()
+        _packet_ids = _headers['packet_id'].tolist()
+        _widths = _headers['width'].tolist()
+        _heights = _headers['height'].tolist()
+        _valid = _headers['valid'].tolist()
+
+        _data = memoryview(data)
+        _image = None
+        _count = 0
+
+        for _i in range(len(_valid)):
+            if not _valid[_i]:
+                continue
+
+            _info = (_callsigns[_i], _image_ids[_i], _widths[_i], _heights[_i])
+            if _image is None or _info != (_image.callsign, _image.id, _image.width, _image.height):
+                # Only look up the image when it changes - archives hold runs of packets from one image.
+                _image = self.image_store.lookup({
+                    'callsign': _info[0], 'image_id': _info[1], 'width': _info[2], 'height': _info[3]
+                }, now=timestamp)
+                if _image is None:
+                    _image = self.newImage(*_info, timestamp=timestamp)
+                    self.image_store.add(_image, now=timestamp)
+
+            _packet, _corrected = self.verifyPacket(_data[_i * SSDV_PACKET_SIZE:(_i + 1) * SSDV_PACKET_SIZE])
+            if _packet is None:
+                continue
+
+            _pkt_id = _packet_ids[_i]
+            _size = _image.nbytes
+            _new = _image.add_packet(_pkt_id, _packet)
+            self.image_store.update(_image, _image.nbytes - _size, now=timestamp)
+
+            if _image.decoder is not None and not self.defer_decode:
+                _image.decoder.add_packet(_image[_pkt_id])
+
+            if _new:
+                _image.corrected += _corrected
+            self.latest_update = _image
+            _count += 1
+
+        return _count
+
+
+    def verifyPacket(self, packet, corrected=None):
+        """ Check a packet's CRC, correcting it with FEC if possible, and update our statistics.
+
+            If corrected is set, the packet has already been checked and corrected by ssdv_verify_packet,
+            which corrected that many symbols - only the statistics are updated.
+
+            Returns a tuple of the (corrected) packet, or None if it is corrupt, and the number of
+            symbols corrected.
+        """
+        if corrected is None:
+            _packet, _corrected = ssdv_verify_packet(packet)
+        else:
+            _packet, _corrected = (bytes(packet), corrected)
+
+        if _packet is None:
+            self.crc_errors += 1
+            logging.warning("Discarding SSDV packet with a CRC error.")
+        elif _corrected:
+            self.fec_corrected_packets += 1
+            self.fec_corrected_symbols += _corrected
+            logging.info(f"Corrected {_corrected} bad bytes in SSDV packet.")
+
+        return (_packet, _corrected)
+
+
+    def addPacket(self, packet, timestamp=None, link=0, replay=False, corrected=None):
+        """ Handle receipt of a new packet from the TNC
+
+            Args:
+                packet (bytes): KISS frame, including the TNC port byte.
+                timestamp (float): Time the packet was received. Defaults to now.
+                link (int): ID of the TNC link the packet was received on, for the journal.
+                replay (bool): The packet is being replayed from a journal - don't decode it or journal it again.
+                corrected (int): If set, the SSDV packet has already been checked (and corrected) by
+                    ssdv_verify_packet, which corrected this many symbols, so it is not checked again.
+
+            Packets which fail their CRC check (after FEC correction, for FEC packets) are discarded.
+
+            Bursts (see burst.py) are unpacked, and each packet in them handled as if it had arrived in its
+            own frame. The result is then {'type': 'burst', 'responses': [...]} - use iter_responses()
+            to handle any result.
+
+            Fountain-coded repair packets (see fountain.py) are handed to addRepairPacket.
+        """
+        if is_burst(packet):
+            try:
+                _frames = list(iter_frames(packet))
+            except ValueError as e:
+                logging.error(f"Discarding malformed burst: {str(e)}")
+                return None
+
+            _responses = [_resp for _resp in (self.addPacket(_frame, timestamp, link, replay) for _frame in _frames) if _resp]
+            return {'type': 'burst', 'responses': _responses} if _responses else None
+
+        if len(packet) > 1 and packet[1] == FOUNTAIN_HEADER:
+            return self.addRepairPacket(packet, timestamp, link, replay)
+
+        if is_resend_packet(packet[1:]):
+            try:
+                _resend_data = decode_resend_packet(packet[1:])
+            except Exception as e:
+                logging.warning(f"Discarding corrupt resend request: {str(e)}")
+                return None
+
+            logging.info(f"Got resend request: {str(_resend_data)}")
+
+            return {
+                'type': 'resend',
+                'data': _resend_data
+            }
 
-    def addPacket(self, packet):
-        """ Handle receipt of a new packet from the TNC """
         if len(packet) == 257:
             # Possibly a SSDV packet
             if packet[1] == SSDV_HEADER:
-                # Strip off TNC port (first byte)
-                packet = packet[1:]
+                # Strip off TNC port (first byte), check the CRC, and correct errors in FEC packets.
+                _port = packet[:1]
+                packet, _corrected = self.verifyPacket(packet[1:], corrected)
+                if packet is None:
+                    return None
+
+                if self.journal and not replay:
+                    self.journal.append(_port + packet, link, timestamp)
 
                 pkt_info = ssdv_packet_info(packet)
 
@@ -76,59 +288,151 @@ class SSDVRX(object):
                 _width = pkt_info['width']
                 _height = pkt_info['height']
 
-                if _callsign not in self.image_store:
-                    self.image_store[_callsign] = {}
-
-                if _img_id not in self.image_store[_callsign]:
-                    self.image_store[_callsign][_img_id] = {
-                        'packets': {
-                            _pkt_id: packet
-                        },
-                        'missing': [],
-                        'width': _width,
-                        'height': _height,
-                        'callsign': _callsign,
-                        'id': _img_id,
-                        'time': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H%M%S")
-                    }
+                _image = self.image_store.lookup(pkt_info, now=timestamp)
+
+                if _image is None:
+                    _image = self.newImage(_callsign, _img_id, _width, _height, timestamp)
+                    _new = _image.add_packet(_pkt_id, packet)
+                    self.image_store.add(_image, now=timestamp)
 
                 else:
-                    self.image_store[_callsign][_img_id]['packets'][_pkt_id] = packet
-                
-                # Calculate missing packets from image.
-                self.image_store[_callsign][_img_id]['missing'] = self.calculateMissing(
-                    list(self.image_store[_callsign][_img_id]['packets'].keys())
-                )
+                    _size = _image.nbytes
+                    _new = _image.add_packet(_pkt_id, packet)
+                    self.image_store.update(_image, _image.nbytes - _size, now=timestamp)
+
+                if _new:
+                    # Corrections to a packet we already have don't improve the image.
+                    _image.corrected += _corrected
+
+                self.latest_update = _image
 
-                self.latest_update = self.image_store[_callsign][_img_id]
+                if replay:
+                    # Decoding is deferred until the image is needed.
+                    return None
+
+                if self.defer_decode:
+                    # Decoded when decode() is next called.
+                    pass
+                elif _image.decoder is None:
+                    # Decodes every packet we have so far, including this one.
+                    self.imageDecoder(_image)
+                else:
+                    # Decode only the MCUs this packet contributes.
+                    _image.decoder.add_packet(_image[_pkt_id])
 
                 logging.info(f"New SSDV Packet. Call: {_callsign}, ID: {_img_id}, Pkt No:{_pkt_id}")
 
                 return {
                     'type': 'image_update', 
                     'latest': self.latest_update,
-                    'store': self.image_store
+                    'store': self.image_store,
+                    'corrected': _corrected
                     }
 
-            elif packet[1] == RESEND_HEADER:
-                try:
-                    _resend_data = decode_resend_packet(packet[1:])
-                except:
-                    return None
+        else:
+            logging.error("Unknown packet size.")
+            return None
 
-                logging.info(f"Got resend request: {str(_resend_data)}")
 
-                return {
-                    'type': 'resend',
-                    'data': _resend_data
-                }
+    def addRepairPacket(self, packet, timestamp=None, link=0, replay=False):
+        """ Handle a fountain-coded repair packet, rebuilding the image's missing packets once we have enough.
 
-        else:
-            logging.error("Unknown packet size.")
+            Rebuilt packets are added with addPacket, as if they had been received. The result is
+            {'type': 'repair', 'callsign': ..., 'image_id': ..., 'responses': [...]}, with the rebuilt packets'
+            responses (none while more repair packets are needed) - use iter_responses() to handle it.
+            None is returned for duplicate repair packets, and repair packets for complete images.
+        """
+        # Imported here, as fountain coding needs numpy.
+        import numpy as np
+        from .fountain import FountainDecoder, fountain_packet_info
+
+        _port = packet[:1]
+        _info = fountain_packet_info(packet[1:])
+        if _info is None:
+            self.crc_errors += 1
+            logging.warning("Discarding repair packet with a CRC error.")
             return None
 
+        if self.journal and not replay:
+            self.journal.append(packet, link, timestamp)
+
+        _count = _info['source_count']
+        _key = (_info['callsign'], _info['image_id'], _count)
+        _decoder = self.fountain_decoders.pop(_key, None) or FountainDecoder(_count)
+        self.fountain_decoders[_key] = _decoder
+        while len(self.fountain_decoders) > MAX_FOUNTAIN_IMAGES:
+            self.fountain_decoders.popitem(last=False)
+
+        if not _decoder.add(_info['seed'], _info['payload']):
+            return None
+
+        # The packets we already have. If the image has packets beyond the end, it is an older image
+        # with the same ID, so start from nothing.
+        _known = np.zeros(_count, dtype=bool)
+        _source = np.zeros((_count, SSDV_PACKET_SIZE), dtype=np.uint8)
+        _image = self.image_store.get(_info['callsign'], _info['image_id'])
+        if _image is not None and _image.missing.highest < _count:
+            _n = _image.missing.highest + 1
+            _known[:_n] = np.frombuffer(bytes(_image.missing.bitmap[:_n]), dtype=np.uint8) != 0
+            _source[:_n] = np.frombuffer(bytes(_image.slab[:_n * SSDV_PACKET_SIZE]), dtype=np.uint8).reshape(_n, SSDV_PACKET_SIZE)
+
+        if _known.all():
+            del self.fountain_decoders[_key]
+            return None
+
+        _resp = {'type': 'repair', 'callsign': _info['callsign'], 'image_id': _info['image_id'], 'responses': []}
+
+        if _count - np.count_nonzero(_known) > len(_decoder):
+            return _resp
+
+        _rebuilt = _decoder.decode(_known, _source)
+        if not _rebuilt:
+            logging.debug(f"Not enough repair packets for {_info['callsign']} image {_info['image_id']} yet.")
+            return _resp
+
+        del self.fountain_decoders[_key]
+        logging.info(f"Rebuilt {len(_rebuilt)} packets of {_info['callsign']} image {_info['image_id']} from {len(_decoder)} repair packets.")
+
+        # Checked and stored like any other packet - a rebuilt packet which fails its CRC is discarded.
+        for _pkt_id in _rebuilt:
+            _update = self.addPacket(_port + _source[_pkt_id].tobytes(), timestamp, link, replay=replay)
+            if _update:
+                _resp['responses'].append(_update)
+        self.repaired_packets += len(_rebuilt)
+
+        return _resp
+
+
+    def resendRequest(self, image, callsign):
+        """ Produce a resend request packet for the missing packets of an image, from the supplied callsign.
+
+            In the compact (v2) format, as many missing packets are listed as fit in resend_max_size bytes.
+            In the original format, which senders without v2 support need, only the first MAX_PACKET_LIST are.
+            Either way, the lowest packet IDs are listed first, and the rest are left for later requests.
+        """
+        _lastpacket = image.missing.highest
+
+        if self.resend_version == 1:
+            return encode_resend_packet(image.callsign, callsign, image.id, _lastpacket,
+                image.missing.packets(MAX_PACKET_LIST))
+
+        return encode_resend_packet_v2(image.callsign, callsign, image.id, _lastpacket, image.missing.packets(),
+            max_size=self.resend_max_size)
+
+
+    async def receive(self, tnc, callback=None):
+        """ Read frames from an asyncio KISS TNC client (such as kiss.KISSClient), and add them to the image store.
+
+            The result of addPacket is passed to callback, if supplied. Runs until cancelled.
+        """
+        while True:
+            _frame = await tnc.read()
+            _resp = self.addPacket(_frame)
+            if _resp and callback:
+                callback(_resp)
+
 
     def clearStore(self):
         """ Erase the internal image store """
-        self.image_store = {}
+        self.image_store.clear()
 
@@ -0,0 +1,181 @@
+#
+#   Offline Receive Path Replay
+#
+#   Feeds recorded SSDV traffic through SSDVRX.addPacket and decode as fast as
+#   possible, and reports throughput and latency - for measuring the receive
+#   path without a radio.
+#
+#   Accepts raw KISS captures, packet journals, SSDV .bin files (concatenated
+#   256-byte packets, as produced by `ssdv -e`), or directories of .bin files.
+#
+#   Usage: python -m hfssdv.replay capture.kiss [more captures...] [--no-decode]
+#
+
+import argparse
+import json
+import logging
+import os
+import time
+from .journal import *
+from .kiss import *
+from .packets import *
+from .receive import *
+
+
+def read_bin(filename):
+    """ Read a .bin file of concatenated SSDV packets, returning KISS frames (with a port byte) """
+    _frames = []
+    with open(filename, 'rb') as _f:
+        _data = _f.read()
+
+    for _i in range(0, len(_data) - SSDV_PACKET_SIZE + 1, SSDV_PACKET_SIZE):
+        _frames.append(b'\x00' + _data[_i:_i + SSDV_PACKET_SIZE])
+    return _frames
+
+
+def read_kiss_capture(filename):
+    """ Read a raw KISS byte stream capture, returning its frames """
+    with open(filename, 'rb') as _f:
+        return KISSDeframer().feed(_f.read() + bytes([KISS_FEND]))
+
+
+def load_frames(path):
+    """ Load KISS frames from a capture file, journal, .bin file, or a directory of .bin files """
+    if os.path.isdir(path):
+        _frames = []
+        for _name in sorted(os.listdir(path)):
+            if _name.endswith('.bin'):
+                _frames += load_frames(os.path.join(path, _name))
+        return _frames
+
+    with open(path, 'rb') as _f:
+        _magic = _f.read(len(JOURNAL_MAGIC))
+
+    if _magic == JOURNAL_MAGIC:
+        return [_frame for _timestamp, _link, _frame in scan_journal(path)[0]]
+    elif _magic[:1] == bytes([SSDV_HEADER]):
+        return read_bin(path)
+    else:
+        return read_kiss_capture(path)
+
+
+def percentile(values, pct):
+    """ Nearest-rank percentile of an already sorted list """
+    if not values:
+        return 0.0
+    _rank = max(0, min(len(values) - 1, int(round(pct / 100.0 * len(values))) - 1))
+    return values[_rank]
+
+
+class ReplayResult(object):
+    """ Timing results from a replay """
+
+    def __init__(self):
+        self.packets = 0
+        self.elapsed = 0.0
+        # Per-packet addPacket + decode time (seconds).
+        self.latencies = []
+        # Time from the start of the replay until the first decoded image, and packets needed for it.
+        self.first_image_time = None
+        self.first_image_packets = None
+        self.images = 0
+
+
+    def rate(self):
+        return self.packets / self.elapsed if self.elapsed else 0.0
+
+
+    def to_dict(self):
+        _sorted = sorted(self.latencies)
+        return {
+            'packets': self.packets,
+            'images': self.images,
+            'elapsed': self.elapsed,
+            'packets_per_sec': self.rate(),
+            'latency_p50': percentile(_sorted, 50),
+            'latency_p90': percentile(_sorted, 90),
+            'latency_p99': percentile(_sorted, 99),
+            'latency_max': _sorted[-1] if _sorted else 0.0,
+            'first_image_time': self.first_image_time,
+            'first_image_packets': self.first_image_packets
+        }
+
+
+    def report(self):
+        _r = self.to_dict()
+        _lines = [
+            f"{_r['packets']} packets, {_r['images']} images in {_r['elapsed']:.3f} s - {_r['packets_per_sec']:.1f} packets/s",
+            f"Latency: p50 {1000*_r['latency_p50']:.2f} ms, p90 {1000*_r['latency_p90']:.2f} ms, "
+            f"p99 {1000*_r['latency_p99']:.2f} ms, max {1000*_r['latency_max']:.2f} ms",
+        ]
+        if _r['first_image_time'] is not None:
+            _lines.append(f"First viewable image after {1000*_r['first_image_time']:.2f} ms ({_r['first_image_packets']} packets)")
+        else:
+            _lines.append("No viewable image.")
+        return "\n".join(_lines)
+
+
+def replay(frames, ssdv_rx=None, decode=True, outfile=None):
+    """ Feed frames through the receive path as fast as possible.
+
+        Args:
+            frames (list): KISS frames, including the port byte.
+            ssdv_rx (SSDVRX): Receiver to use. A new one is created if not supplied.
+            decode (bool): Decode the image after every packet, as the GUI does.
+            outfile (str): File to write decoded images to. If not supplied, images are only decoded in memory.
+
+        Returns:
+            ReplayResult: Timing results.
+
+    """
+    _rx = ssdv_rx if ssdv_rx else SSDVRX(max_images=None, max_bytes=None)
+    _result = ReplayResult()
+
+    _clock = time.perf_counter
+    _start = _clock()
+
+    for _frame in frames:
+        _packet_start = _clock()
+        # Bursts give a response per packet.
+        _updates = [_resp for _resp in iter_responses(_rx.addPacket(_frame)) if _resp['type'] == 'image_update']
+        if not _updates:
+            continue
+
+        _viewable = _rx.decode(_updates[-1]['latest'], outfile=outfile) if decode else None
+        _end = _clock()
+
+        _result.packets += len(_updates)
+        _result.latencies.append(_end - _packet_start)
+        if _viewable and _result.first_image_time is None:
+            _result.first_image_time = _end - _start
+            _result.first_image_packets = _result.packets
+
+    _result.elapsed = _clock() - _start
+
+    _result.images = len(_rx.image_store)
+    return _result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded SSDV traffic through the receive path, and report performance.")
+    parser.add_argument("captures", nargs="+", help="KISS capture, packet journal, SSDV .bin file, or directory of .bin files.")
+    parser.add_argument("--no-decode", action="store_true", default=False, help="Only add packets, don't decode images.")
+    parser.add_argument("--json", action="store_true", default=False, help="Output results as JSON.")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    _frames = []
+    for _capture in args.captures:
+        _frames += load_frames(_capture)
+
+    _result = replay(_frames, decode=not args.no_decode)
+
+    if args.json:
+        print(json.dumps(_result.to_dict()))
+    else:
+        print(_result.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#
+#   Decode Scheduler
+#
+#   Decodes received images off the TNC read thread. Updates are coalesced
+#   per image - however many packets arrive while an image is waiting to be
+#   decoded, it is decoded once, with everything received so far - and each
+#   image is decoded at most max_rate times per second. Decodes run on a
+#   small thread pool, so a burst of packets (or a replay) never blocks
+#   reading from the TNC.
+#
+#   The SSDVRX should be created with defer_decode=True, so addPacket leaves
+#   all decoding to the scheduler.
+#
+#   By default images are decoded in this process. A backend (such as
+#   decodepool.ProcessDecodeBackend) can be supplied to decode them elsewhere.
+#
+
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DecodeScheduler(object):
+    """ Coalescing, rate-limited background decoding of received images.
+
+        For each decode, callback is called (on a worker thread) with a dict:
+            'image': The SSDVImage decoded.
+            'jpeg': The decoded JPEG (bytes).
+            'region': Pixel region (x, y, width, height) changed since the image's last decode, or None.
+            'generation': The image's generation when the decode started. The decode used at least
+                this many packets, so results can be ordered, and stale ones dropped.
+    """
+
+    def __init__(self, ssdv_rx, callback, max_rate=4.0, workers=2, backend=None):
+        """
+            Args:
+                ssdv_rx (SSDVRX): Receiver holding the images, used to decode them.
+                callback (function): Called with the result of each decode.
+                max_rate (float): Maximum decodes per second, per image.
+                workers (int): Number of decode threads. With a backend, the number of decodes handed to it at once.
+                backend: If set, decode images with backend.decode(image), which returns (JPEG, region) or None.
+        """
+        self.ssdv_rx = ssdv_rx
+        self.callback = callback
+        self.backend = backend
+        self.interval = 1.0 / max_rate if max_rate else 0.0
+
+        self.decodes = 0
+        self.coalesced = 0
+
+        # Image -> time it is next due to be decoded, for images waiting to be decoded.
+        self._pending = {}
+        # (due time, sequence, image), for the images in _pending.
+        self._queue = []
+        self._sequence = 0
+        # Images being decoded, and those updated while being decoded.
+        self._running = set()
+        self._dirty = set()
+        # Image -> time of its last decode.
+        self._last_decode = {}
+
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode')
+        self._running_flag = True
+        self._thread = threading.Thread(target=self._dispatch, name='decode-scheduler', daemon=True)
+        self._thread.start()
+
+
+    def submit(self, image):
+        """ Note that an image has new packets. Never blocks on a decode. """
+        with self._cond:
+            if image in self._pending:
+                # Latest wins - the waiting decode will pick up this packet too.
+                self.coalesced += 1
+                return
+
+            if image in self._running:
+                # Decode again once the current decode finishes.
+                if image in self._dirty:
+                    self.coalesced += 1
+                self._dirty.add(image)
+                return
+
+            self._schedule(image)
+
+
+    def _schedule(self, image):
+        """ Queue an image to be decoded, no sooner than interval after its last decode. Called with the lock held. """
+        _due = max(time.monotonic(), self._last_decode.get(image, 0.0) + self.interval)
+        self._pending[image] = _due
+        self._sequence += 1
+        heapq.heappush(self._queue, (_due, self._sequence, image))
+        self._cond.notify()
+
+
+    def _dispatch(self):
+        """ Hand images to the worker pool as they become due """
+        with self._cond:
+            while self._running_flag:
+                _now = time.monotonic()
+                if not self._queue:
+                    # Idle - drop the rate-limit state of images which are no longer limited, so we don't hold on to them.
+                    self._last_decode = {_i: _t for _i, _t in self._last_decode.items() if _now - _t < self.interval}
+                    self._cond.wait(self.interval if self._last_decode else None)
+                    continue
+
+                _due, _sequence, _image = self._queue[0]
+                if _due > _now:
+                    self._cond.wait(_due - _now)
+                    continue
+
+                heapq.heappop(self._queue)
+                del self._pending[_image]
+                self._running.add(_image)
+                self._last_decode[_image] = _now
+                self._executor.submit(self._decode, _image)
+
+
+    def _decode(self, image):
+        try:
+            _generation = image.generation
+
+            if self.backend is not None:
+                _jpeg, _region = self.backend.decode(image) or (None, None)
+                self.backend.prune(self.ssdv_rx.image_store)
+            else:
+                _jpeg = self.ssdv_rx.decode(image)
+                if _jpeg is not None:
+                    with image.decode_lock:
+                        _region = image.decoder.take_region()
+
+            if _jpeg is not None:
+                self.decodes += 1
+                self.callback({
+                    'image': image,
+                    'jpeg': _jpeg,
+                    'region': _region,
+                    'generation': _generation
+                })
+
+        except Exception as e:
+            logging.exception(f"Error decoding image: {str(e)}")
+
+        finally:
+            with self._cond:
+                self._running.discard(image)
+                if image in self._dirty:
+                    self._dirty.discard(image)
+                    self._schedule(image)
+
+
+    def stop(self, wait=True):
+        """ Stop the scheduler. Images waiting to be decoded are dropped. """
+        with self._cond:
+            self._running_flag = False
+            self._queue = []
+            self._pending.clear()
+            self._dirty.clear()
+            self._cond.notify()
+
+        self._thread.join()
+        self._executor.shutdown(wait=wait)
+        if self.backend is not None:
+            self.backend.stop()
@@ -0,0 +1,185 @@
+#
+#   Bounded SSDV Image Store
+#
+#   Holds received images keyed on (callsign, image ID, epoch), with limits on
+#   the number of images and the packet data held in memory. The least
+#   recently updated images are evicted first, and can be spilled to an
+#   on-disk archive as .bin files (concatenated 256-byte packets, as used by
+#   the ssdv utility).
+#
+#   SSDV image IDs are only 8 bits, so they wrap around. A packet starts a new
+#   epoch of its (callsign, image ID) if its image geometry does not match the
+#   image we already hold, or if that image has not been updated for a while.
+#
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from .packets import *
+
+
+class ImageStore(object):
+    """ A bounded, LRU-evicting store of received images.
+
+        Images are SSDVImage objects, as built by SSDVRX.addPacket. The store
+        sets their 'epoch' and 'last_update' attributes, and accounts for the
+        memory used by their packet slabs.
+    """
+
+    def __init__(self, max_images=100, max_bytes=64*1024*1024, max_age=None, epoch_timeout=3600, archive_dir=None):
+        """
+            Args:
+                max_images (int): Maximum number of images to hold. None for no limit.
+                max_bytes (int): Maximum packet data to hold (bytes). None for no limit.
+                max_age (float): Evict images which have not been updated for this long (seconds). None to disable.
+                epoch_timeout (float): Treat a packet as the start of a new image if its (callsign, image ID)
+                    has not been heard for this long (seconds).
+                archive_dir (str): If set, evicted images are written to this directory.
+        """
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.epoch_timeout = epoch_timeout
+        self.archive_dir = archive_dir
+
+        # (callsign, image ID, epoch) -> image, least recently updated first.
+        self.images = OrderedDict()
+        # (callsign, image ID) -> current epoch.
+        self.epochs = {}
+
+        self.bytes = 0
+        self.evicted = 0
+
+
+    def __len__(self):
+        return len(self.images)
+
+
+    def __contains__(self, key):
+        return key in self.images
+
+
+    def __getitem__(self, key):
+        return self.images[key]
+
+
+    def __iter__(self):
+        return iter(self.images.values())
+
+
+    def keys(self):
+        return self.images.keys()
+
+
+    def get(self, callsign, image_id, epoch=None):
+        """ Return an image, or None if it is not in the store. The latest epoch is used if epoch is not supplied. """
+        if epoch is None:
+            epoch = self.epochs.get((callsign, image_id))
+        return self.images.get((callsign, image_id, epoch))
+
+
+    def lookup(self, info, now=None):
+        """ Find the image a packet belongs to, from its ssdv_packet_info.
+
+            Returns None if the packet is the start of a new image (or a new
+            epoch of an image ID), which should then be created and add()ed.
+        """
+        _image = self.get(info['callsign'], info['image_id'])
+        if _image is None:
+            return None
+
+        if (_image.width != info['width']) or (_image.height != info['height']):
+            return None
+
+        _now = time.time() if now is None else now
+        if self.epoch_timeout and (_now - _image.last_update > self.epoch_timeout):
+            return None
+
+        return _image
+
+
+    def add(self, image, now=None):
+        """ Add a new image to the store, as the newest epoch of its (callsign, image ID) """
+        _id = (image.callsign, image.id)
+        _epoch = self.epochs.get(_id, -1) + 1
+        self.epochs[_id] = _epoch
+
+        image.epoch = _epoch
+        image.last_update = time.time() if now is None else now
+        self.images[_id + (_epoch,)] = image
+        self.bytes += image.nbytes
+
+        self.evict(now)
+
+
+    def update(self, image, added_bytes=0, now=None):
+        """ Note that a packet has been added to an image (growing its slab by added_bytes),
+            and evict other images if we are over our limits
+        """
+        _key = (image.callsign, image.id, image.epoch)
+        self.images.move_to_end(_key)
+        image.last_update = time.time() if now is None else now
+        self.bytes += added_bytes
+
+        self.evict(now)
+
+
+    def _over_limit(self, now):
+        if self.max_images is not None and len(self.images) > self.max_images:
+            return True
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            return True
+
+        if self.max_age is not None:
+            _oldest = next(iter(self.images.values()))
+            return now - _oldest.last_update > self.max_age
+
+        return False
+
+
+    def evict(self, now=None):
+        """ Evict the least recently updated images until we are within our limits. The newest image is always kept. """
+        _now = time.time() if now is None else now
+
+        while len(self.images) > 1 and self._over_limit(_now):
+            self.remove(next(iter(self.images)))
+
+
+    def remove(self, key):
+        """ Remove an image from the store, archiving it if configured """
+        _image = self.images.pop(key)
+        self.bytes -= _image.nbytes
+        self.evicted += 1
+
+        if self.archive_dir:
+            self.archive(_image)
+
+        logging.debug(f"Evicted image {key} from store.")
+        return _image
+
+
+    def archive_filename(self, image):
+        return os.path.join(self.archive_dir,
+            f"{image.time}_{image.callsign}_{image.id}_{image.epoch}.bin")
+
+
+    def archive(self, image):
+        """ Write an image's packets out to the archive directory, in packet order """
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            _filename = self.archive_filename(image)
+            with open(_filename, 'wb') as _f:
+                # Each run of consecutive packets is written straight from the image's slab.
+                for _run in image.runs():
+                    _f.write(_run)
+            logging.info(f"Archived image {image.callsign} {image.id} to {_filename}")
+            return _filename
+        except Exception as e:
+            logging.error(f"Could not archive image: {str(e)}")
+            return None
+
+
+    def clear(self):
+        self.images.clear()
+        self.bytes = 0
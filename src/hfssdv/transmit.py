@@ -3,149 +3,246 @@
 #
 
 import logging
+import math
 import os
-import sys
+import queue
+import random
 import time
-from PIL import Image
+from .burst import *
 from .packets import *
+from .txcache import *
 
 class SSDVTX(object):
     """ Class to handle loading, compressing, and transmitting images. """
 
-    def __init__(self, ssdv_path="./ssdv"):
+    def __init__(self, cache=None, pacer=None, burst_size=None, fountain_overhead=None):
+        """
+            Args:
+                cache (txcache.PacketCache): If set, encoded images are cached here, and looked up
+                    here before encoding, and to answer resend requests for images sent before a restart.
+                pacer (pacing.TransmitPacer): If set, the delay between packets is worked out by the
+                    pacer, and the delay passed to the transmit methods is ignored.
+                burst_size (int): If set, send packets in bursts of up to this many bytes per TNC frame
+                    (see burst.py). The delay is then between bursts.
+                fountain_overhead (float): If set, follow each image sent in full with this fraction of its
+                    packet count in fountain-coded repair packets (see fountain.py), so receivers can rebuild
+                    lost packets without a resend request.
+        """
 
-        self.ssdv_path = ssdv_path
         self.image_id = 0
 
+        self.cache = cache
+
+        self.pacer = pacer
+
+        self.burst_size = burst_size
+
+        self.fountain_overhead = fountain_overhead
+
         self.image_store = {}
 
         self.current_image = None
 
+        # IDs of images which are encoded and waiting to be sent, e.g. from a batch.BatchLoader.
+        self.ready_queue = queue.Queue()
+
         # Flag set to abort a currently running transmission.
         self.abort_tx = False
 
 
-        if not os.path.isfile(ssdv_path):
-            logging.critical("Could not find SSDV binary.")
-            sys.exit(1)
-            
+    def add_image(self, image, name="image", callsign="N0CALL", quality=4, fec=False, max_packets=None, image_id=None,
+        cache_key=None):
+        """ Encode a PIL image, and add it to our image store
 
-    def resize_image(self, filename, outfile="txtemp.jpg"):
-        """ Resize image if necessary """
-        img = Image.open(filename)
+            If max_packets is set, the image size and quality level are chosen
+            to fit the image into that many packets, and quality is ignored.
 
-        width, height = img.size
+            If image_id is not set, the next image ID is used. If cache_key is
+            set, the encoded image is added to the packet cache under it.
 
-        # Round sizes to multples of 16
-        _new_width = int(round(width/SSDV_RES_MULTIPLE)*SSDV_RES_MULTIPLE)
-        _new_height = int(round(height/SSDV_RES_MULTIPLE)*SSDV_RES_MULTIPLE)
+            Return a string with a status message.
 
-        if (_new_width != width) or (_new_height != height):
-            logging.info(f"Resizing image to {_new_width}x{_new_height} for transmission.")
-            img = img.resize((_new_width, _new_height))
-        else:
-            logging.info("Not resizing image.")
-        
-        img.save(outfile, "JPEG")
-        img.close()
+        """
+        # Imported here, so numpy and PIL are only loaded once we have an image to encode.
+        from .encoder import encode_image, encode_image_budget
+
+        _image_id = self.reserve_image_id() if image_id is None else image_id
+        _settings = None
 
+        try:
+            if max_packets:
+                _packets, _settings = encode_image_budget(image, max_packets, callsign=callsign, image_id=_image_id, fec=fec)
+            else:
+                _packets = encode_image(image, callsign=callsign, image_id=_image_id, quality=quality, fec=fec)
+        except Exception as e:
+            _error = f"Could not compress image: {str(e)}"
+            logging.error(_error)
+            return _error
 
-    def compress_image(self, infile="txtemp.jpg", id=0, outfile="txtemp.bin", callsign="N0CALL", quality=4):
-        """ Attempt to compress a JPEG using SSDV. """
+        _status = self.store_image(_image_id, _packets, name=name, callsign=callsign, quality=quality, settings=_settings)
+        self.current_image = _image_id
 
-        _command = f"./ssdv -e -n -c {callsign} -i {id} -q {quality} {infile} {outfile}"
+        if self.cache is not None and cache_key:
+            self.cache.put(cache_key, _packets, callsign, _image_id, self.image_store[_image_id]['quality'],
+                name=name, settings=_settings)
 
-        retcode = os.system(_command)
+        return _status
 
-        if retcode == 0:
-            return True
-        else:
-            return False
 
+    def reserve_image_id(self):
+        """ Allocate the next image ID """
+        _image_id = self.image_id
+        self.image_id = (self.image_id + 1) % 256
+        return _image_id
 
-    def read_in_packets(self,filename="txtemp.bin"):
-        """ Read in a SSDV file ready for transmission """
-        file_size = os.path.getsize(filename)
 
-        packets = []
+    def store_image(self, image_id, packets, name="image", callsign="N0CALL", quality=4, settings=None):
+        """ Add an encoded image to our image store
 
-        try:
-            f = open(filename,'rb')
-            for x in range(file_size//256):
-                data = f.read(256)
-                packets.append(data)
-            
-            f.close()
-        except Exception as e:
-            logging.critical(f"Could not read in {filename}.")
-            return None
-        
-        return packets
+            settings are the settings chosen by encoder.encode_image_budget, if it was used.
+
+            Return a string with a status message.
+
+        """
+        if settings:
+            quality = settings['quality']
+
+        self.image_store[image_id] = {
+            'callsign': callsign,
+            'quality': quality,
+            'packets': packets,
+            # Seed of the next repair packet. Random, so repair packets sent after a restart are still new.
+            'repair_seed': random.getrandbits(32)
+        }
+
+        _status = f"Img ID {image_id}: ({name}): {len(packets)} packets."
+        if settings:
+            _status += f" Auto: {settings['width']}x{settings['height']}px, quality {quality}"
+            _status += "." if settings['fits'] else ", over budget!"
+        logging.info(_status)
+        return _status
 
 
-    def load_new_image(self,filename, callsign="N0CALL", quality=4):
-        """ Load in a new JPEG file, resize it if necessary, compress, and add to our image store 
+    def load_new_image(self,filename, callsign="N0CALL", quality=4, fec=False, max_packets=None):
+        """ Load in a new image file, resize it if necessary, compress, and add to our image store 
+
+            If max_packets is set, the image size and quality are chosen to fit that many packets.
         
             Return a string with a status message.
         
         """
 
-        # Resize image
+        from PIL import Image
+
+        _name = os.path.basename(filename)
+        _image_id = None
+        _key = None
+
+        if self.cache is not None:
+            try:
+                _digest = file_digest(filename)
+            except Exception as e:
+                _error = f"Could not load image: {str(e)}"
+                logging.error(_error)
+                return _error
+
+            _image_id = self.reserve_image_id()
+            _key = cache_key(_digest, callsign, quality, fec, max_packets=max_packets)
+            _entry = self.cache.get(_key, _image_id)
+            if _entry is not None:
+                _status = self.store_image(_image_id, _entry['packets'], name=_name, callsign=callsign,
+                    quality=_entry['quality'], settings=_entry['settings'])
+                self.current_image = _image_id
+                return _status + " (cached)"
+
         try:
-            self.resize_image(filename)
+            _img = Image.open(filename)
+            _img.load()
         except Exception as e:
             _error = f"Could not load image: {str(e)}"
             logging.error(_error)
             return _error
 
-        # Compress image
-        _compress_ok =  self.compress_image(id=self.image_id, callsign=callsign, quality=quality)
+        _status = self.add_image(_img, name=_name, callsign=callsign, quality=quality, fec=fec,
+            max_packets=max_packets, image_id=_image_id, cache_key=_key)
+        _img.close()
+        return _status
 
-        if not _compress_ok:
-            _error = "Could not compress image."
-            logging.error(_error)
-            return _error
-        
-        # Now load in the SSDV data.
-        _packets = self.read_in_packets()
 
-        if _packets:
-            # Add to local store.
-            self.image_store[self.image_id] = {
-                'callsign': callsign,
-                'quality': quality,
-                'packets': _packets
-            }
+    def restore_image(self, image_id, callsign):
+        """ Add the last image sent with an image ID and callsign back into the image store, from the packet cache.
+
+            Returns True if it was found.
+        """
+        if self.cache is None:
+            return False
 
-            self.current_image = self.image_id
+        _entry = self.cache.latest(callsign, image_id)
+        if _entry is None:
+            return False
 
-            # Increment image ID.
-            self.image_id = (self.image_id + 1) % 256
+        self.store_image(image_id, _entry['packets'], name=_entry['name'], callsign=callsign,
+            quality=_entry['quality'], settings=_entry['settings'])
+        return True
 
-            _status = f"Img ID {self.current_image}: ({os.path.basename(filename)}): {len(_packets)} packets."
-            logging.info(_status)
-            return _status
 
-        else:
-            _error = "Could not load in compressed file."
-            logging.error(_error)
-            return _error
+    def repair_count(self, image_id):
+        """ Number of repair packets to follow an image with, from fountain_overhead """
+        if not self.fountain_overhead or image_id not in self.image_store:
+            return 0
+        return math.ceil(len(self.image_store[image_id]['packets']) * self.fountain_overhead)
+
+
+    def repair_packets(self, image_id, count):
+        """ Produce count new fountain-coded repair packets for an image. Each call gives different packets. """
+        # Imported here, as fountain coding needs numpy.
+        from .fountain import encode_repair_packets
+
+        _entry = self.image_store[image_id]
+        _seeds = [(_entry['repair_seed'] + _i) % 2**32 for _i in range(count)]
+        _entry['repair_seed'] = (_entry['repair_seed'] + count) % 2**32
+
+        return encode_repair_packets(_entry['packets'], _entry['callsign'], image_id, _seeds)
+
+
+    def tx_frames(self, image_id, packets, repair=0):
+        """ Yield (frame, packets sent so far) to transmit the listed packets of an image, followed by
+            'repair' new repair packets - in bursts, if burst_size is set
+        """
+        _packets = self.image_store[image_id]['packets']
+        _items = [_packets[_pkt] for _pkt in packets]
+        if repair:
+            _items += self.repair_packets(image_id, repair)
+
+        _sent = 0
+        for _frame, _count in burst_frames(_items, self.burst_size):
+            _sent += _count
+            yield (_frame, _sent)
+
+
+    def packet_delay(self, frame, delay):
+        """ Time to wait after writing a frame to the TNC - from the pacer if we have one, otherwise delay """
+        if self.pacer is not None:
+            return self.pacer.sent(len(frame))
+        return delay
 
 
     def transmit_current_image(self, tnc, delay=7, status_callback=None):
-        """ Transmit the current loaded image through the supplied KISS TNC """
+        """ Transmit the current loaded image through the supplied KISS TNC. Returns False if aborted. """
 
         if self.current_image in self.image_store:
-            for _i in range(len(self.image_store[self.current_image]['packets'])):
-                _packet = self.image_store[self.current_image]['packets'][_i]
-                tnc.write(_packet)
+            _packets = len(self.image_store[self.current_image]['packets'])
+            _repair = self.repair_count(self.current_image)
+            _count = _packets + _repair
+            for _frame, _sent in self.tx_frames(self.current_image, range(_packets), _repair):
+                tnc.write(_frame)
                 
-                _status = f"TXing Image {self.current_image} packet {_i+1}/{len(self.image_store[self.current_image]['packets'])}."
+                _status = f"TXing Image {self.current_image} packet {_sent}/{_count}."
                 logging.info(_status)
                 if status_callback:
                     status_callback(_status)
                 
-                time.sleep(delay)
+                time.sleep(self.packet_delay(_frame, delay))
 
                 if self.abort_tx:
                     _status = "Aborting Transmission"
@@ -154,12 +251,13 @@ class SSDVTX(object):
                         status_callback(_status)
 
                     self.abort_tx = False
-                    return
+                    return False
 
             _status = "Transmit Done."
             logging.info(_status)
             if status_callback:
                 status_callback(_status)
+            return True
         
         else:
             _error = "No image to transmit."
@@ -175,6 +273,7 @@ class SSDVTX(object):
         if image_id in self.image_store:
 
             _to_send = []
+            missing = set(missing)
 
             for _pkt in range(len(self.image_store[image_id]['packets'])):
                 if _pkt in missing:
@@ -191,22 +290,39 @@ class SSDVTX(object):
             return None
 
 
+    def resend_request_packets(self, request, callsign):
+        """ Check a decoded resend request is addressed to our callsign, and work out which packets to resend.
+
+            Returns a list of packet IDs, or None if there is nothing we can resend.
+        """
+        if request['dst_call'] != callsign:
+            logging.info(f"Got Resend request for {request['dst_call']}, discarding.")
+            return None
+
+        if request['img_id'] not in self.image_store and self.restore_image(request['img_id'], callsign):
+            logging.info(f"Restored img ID {request['img_id']} from the packet cache.")
+
+        _resend_list = self.check_resend_ability(request['img_id'], request['last_packet'], request['missing'])
+
+        if not _resend_list:
+            logging.info(f"Received resend request for img ID {request['img_id']}, but not in database.")
+
+        return _resend_list
+
+
     def transmit_image_subset(self, image_id, packets, tnc, delay=7, status_callback=None):
         """ Transmit the current loaded image through the supplied KISS TNC """
 
         if image_id in self.image_store:
-            _i = 1
-            for _pkt in packets:
-                _packet = self.image_store[self.current_image]['packets'][_pkt]
-                tnc.write(_packet)
+            for _frame, _sent in self.tx_frames(image_id, packets):
+                tnc.write(_frame)
                 
-                _status = f"TXing Image {self.current_image} packet {_i}/{len(packets)}."
+                _status = f"TXing Image {image_id} packet {_sent}/{len(packets)}."
                 logging.info(_status)
                 if status_callback:
                     status_callback(_status)
                 
-                time.sleep(delay)
-                _i += 1
+                time.sleep(self.packet_delay(_frame, delay))
 
                 if self.abort_tx:
                     _status = "Aborting Transmission"
@@ -229,6 +345,71 @@ class SSDVTX(object):
                 status_callback(_error)
 
 
+    async def transmit_image_subset_async(self, image_id, packets, tnc, delay=7, status_callback=None, repair=0):
+        """ Transmit part of an image through an asyncio KISS TNC client, without blocking the event loop.
+
+            The TNC must provide an awaitable write(), such as kiss.KISSClient. The packets are followed
+            by 'repair' new repair packets.
+        """
+        # Imported here, so the GUI and other threaded users of SSDVTX don't pay for loading asyncio.
+        import asyncio
+
+        if image_id not in self.image_store:
+            _error = "No image to transmit."
+            logging.error(_error)
+            if status_callback:
+                status_callback(_error)
+            return
+
+        for _frame, _sent in self.tx_frames(image_id, packets, repair):
+            await tnc.write(_frame)
+
+            _status = f"TXing Image {image_id} packet {_sent}/{len(packets) + repair}."
+            logging.info(_status)
+            if status_callback:
+                status_callback(_status)
+
+            await asyncio.sleep(self.packet_delay(_frame, delay))
+
+            if self.abort_tx:
+                _status = "Aborting Transmission"
+                logging.info(_status)
+                if status_callback:
+                    status_callback(_status)
+
+                self.abort_tx = False
+                return
+
+        _status = "Transmit Done."
+        logging.info(_status)
+        if status_callback:
+            status_callback(_status)
+
+
+    def transmit_queued_images(self, tnc, delay=7, status_callback=None):
+        """ Transmit the images waiting in the ready queue, in turn, until it is empty or we are aborted """
+        while True:
+            try:
+                self.current_image = self.ready_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            if not self.transmit_current_image(tnc, delay, status_callback):
+                return
+
+
+    async def transmit_current_image_async(self, tnc, delay=7, status_callback=None):
+        """ Transmit the current loaded image through an asyncio KISS TNC client """
+
+        if self.current_image in self.image_store:
+            _packets = range(len(self.image_store[self.current_image]['packets']))
+        else:
+            _packets = []
+
+        await self.transmit_image_subset_async(self.current_image, _packets, tnc, delay, status_callback,
+            repair=self.repair_count(self.current_image))
+
+
     def abort(self):
         self.abort_tx = True
 
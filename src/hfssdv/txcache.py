@@ -0,0 +1,294 @@
+#
+#   Encoded Packet Cache
+#
+#   An on-disk, content-addressed cache of encoded SSDV packet sets. Loading
+#   an image we have encoded before (such as a repeated beacon) with the same
+#   settings skips encoding, and images sent before a restart can still be
+#   found to answer resend requests.
+#
+#   Entries are keyed by a SHA-256 of the source file's contents and the
+#   encode parameters (callsign, quality, FEC, size limits). The image ID is
+#   left out, as a new one is assigned every time an image is loaded - on a
+#   hit, the packets are renumbered to the new image ID, recalculating their
+#   CRCs and FEC parity. Each entry is one file, named <key>.ssdv:
+#       8 bytes     - Magic, b'HFSSDVC2'
+#       2 bytes     - Header length (big-endian)
+#       N bytes     - Header, JSON - callsign, name, quality, and the auto settings, if any
+#       Packets, 256 bytes each
+#
+#   The entry last loaded as each callsign and image ID is indexed by an empty
+#   file, named <callsign>_<image ID>_<key>.ref, so the image to resend for a
+#   resend request can be found without reading the entries.
+#
+#   Once the cache is over max_bytes, the least recently used entries are
+#   deleted. Use is tracked by file modification time, which is updated on
+#   every hit, so it survives a restart.
+#
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from .packets import *
+
+CACHE_MAGIC = b'HFSSDVC2'
+CACHE_SUFFIX = '.ssdv'
+INDEX_SUFFIX = '.ref'
+
+_HEADER_LENGTH = struct.Struct('>H')
+
+# Default cache size limit - around 500 images of 500 packets.
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def file_digest(filename):
+    """ SHA-256 of a file's contents, as a hex string """
+    _hash = hashlib.sha256()
+    with open(filename, 'rb') as _f:
+        for _chunk in iter(lambda: _f.read(1 << 16), b''):
+            _hash.update(_chunk)
+    return _hash.hexdigest()
+
+
+def cache_key(digest, callsign, quality, fec=False, max_size=None, max_packets=None):
+    """ Cache key for an image file, encoded with the supplied parameters.
+
+        Args:
+            digest (str): Image file digest, from file_digest().
+            max_size (tuple): (width, height) limit the image was shrunk to fit, if any.
+            max_packets (int): Packet budget the size and quality were picked for, if any.
+    """
+    _params = json.dumps([digest, callsign, quality, fec, max_size and list(max_size), max_packets])
+    return hashlib.sha256(_params.encode('ascii')).hexdigest()
+
+
+def renumber_packets(packets, image_id):
+    """ Change the image ID of a set of SSDV packets, if it differs, recalculating their CRCs and FEC parity """
+    if not packets or packets[0][6] == image_id:
+        return packets
+
+    # Imported here, so the FEC tables are only built when they are needed.
+    from .fec import ssdv_set_image_id
+    return [ssdv_set_image_id(_packet, image_id) for _packet in packets]
+
+
+class PacketCache(object):
+    """ LRU, size-bounded, on-disk cache of encoded packet sets.
+
+        Entries are returned as dicts:
+            'callsign', 'image_id', 'quality', 'name', 'settings' (from encode_image_budget, or None),
+            and 'packets' (list of 256-byte packets).
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES):
+        """
+            Args:
+                directory (str): Directory to hold the cache. Created if needed.
+                max_bytes (int): Size to keep the cache under (bytes).
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        # Key -> [size, last used], for every entry on disk.
+        self._entries = {}
+        # (callsign, image ID) -> key of the entry last loaded as that image.
+        self._index = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        _indexed = []
+        for _filename in os.listdir(directory):
+            try:
+                _stat = os.stat(os.path.join(directory, _filename))
+                if _filename.endswith(CACHE_SUFFIX):
+                    self._entries[_filename[:-len(CACHE_SUFFIX)]] = [_stat.st_size, _stat.st_mtime]
+                elif _filename.endswith(INDEX_SUFFIX):
+                    _callsign, _image_id, _key = _filename[:-len(INDEX_SUFFIX)].split('_')
+                    _indexed.append((_stat.st_mtime, _callsign, int(_image_id), _key))
+            except (ValueError, OSError):
+                continue
+
+        # Oldest first, so the latest index file for each image wins. Stale index files are removed.
+        for _used, _callsign, _image_id, _key in sorted(_indexed):
+            if _key in self._entries:
+                self._set_index(_callsign, _image_id, _key, touch=False)
+            else:
+                self._remove_index(_callsign, _image_id, _key)
+
+        logging.info(f"Packet cache {directory}: {len(self._entries)} images, {self.size/1e6:.1f} MB.")
+
+
+    @property
+    def size(self):
+        """ Total size of the entries (bytes) """
+        return sum(_entry[0] for _entry in self._entries.values())
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{CACHE_SUFFIX}")
+
+
+    def _index_path(self, callsign, image_id, key):
+        return os.path.join(self.directory, f"{callsign}_{image_id}_{key}{INDEX_SUFFIX}")
+
+
+    def get(self, key, image_id=None):
+        """ Look up an entry, marking it as used. Returns None on a miss.
+
+            If image_id is set, the packets are renumbered to it, and the entry is indexed as that
+            image ID, to answer resend requests for it.
+        """
+        with self._lock:
+            _result = self._read(key) if key in self._entries else None
+            if _result is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if image_id is not None:
+                self._set_index(_result['callsign'], image_id, key)
+
+        if image_id is not None:
+            _result['packets'] = renumber_packets(_result['packets'], image_id)
+            _result['image_id'] = image_id
+        return _result
+
+
+    def latest(self, callsign, image_id):
+        """ The entry last loaded as a callsign and image ID, e.g. to answer a resend request. None if there isn't one. """
+        with self._lock:
+            _key = self._index.get((callsign, image_id))
+            _result = self._read(_key) if _key is not None else None
+            if _result is None:
+                return None
+
+        _result['packets'] = renumber_packets(_result['packets'], image_id)
+        _result['image_id'] = image_id
+        return _result
+
+
+    def _read(self, key):
+        """ Read an entry from disk and mark it as used. Called with the lock held. """
+        _path = self._path(key)
+        try:
+            with open(_path, 'rb') as _f:
+                _data = _f.read()
+
+            if _data[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+                raise ValueError("bad magic")
+
+            _offset = len(CACHE_MAGIC) + _HEADER_LENGTH.size
+            _length, = _HEADER_LENGTH.unpack_from(_data, len(CACHE_MAGIC))
+            _header = json.loads(_data[_offset:_offset + _length])
+            _offset += _length
+
+            if len(_data) == _offset or (len(_data) - _offset) % SSDV_PACKET_SIZE:
+                raise ValueError("truncated")
+
+            _packets = [_data[_i:_i + SSDV_PACKET_SIZE] for _i in range(_offset, len(_data), SSDV_PACKET_SIZE)]
+
+            _entry = self._entries[key]
+            _entry[1] = time.time()
+            os.utime(_path, (_entry[1], _entry[1]))
+
+        except Exception as e:
+            logging.error(f"Could not read packet cache entry {_path}, dropping: {str(e)}")
+            self._remove(key)
+            return None
+
+        return {
+            'callsign': _header['callsign'],
+            'image_id': _packets[0][6],
+            'quality': _header['quality'],
+            'name': _header['name'],
+            'settings': _header.get('settings'),
+            'packets': _packets
+        }
+
+
+    def put(self, key, packets, callsign, image_id, quality, name="image", settings=None):
+        """ Add an entry, then evict the least recently used entries until the cache is under max_bytes """
+        _header = json.dumps({'callsign': callsign, 'name': name, 'quality': quality, 'settings': settings}).encode('utf-8')
+        _path = self._path(key)
+
+        with self._lock:
+            try:
+                # Written to a temporary file and renamed, so a crash never leaves a partial entry.
+                with open(_path + '.tmp', 'wb') as _f:
+                    _f.write(CACHE_MAGIC + _HEADER_LENGTH.pack(len(_header)) + _header)
+                    for _packet in packets:
+                        _f.write(_packet)
+                os.replace(_path + '.tmp', _path)
+            except Exception as e:
+                logging.error(f"Could not write packet cache entry {_path}: {str(e)}")
+                return
+
+            self._entries[key] = [os.path.getsize(_path), time.time()]
+            self._set_index(callsign, image_id, key)
+            self._evict()
+
+
+    def _set_index(self, callsign, image_id, key, touch=True):
+        """ Index an entry as the one last loaded as a callsign and image ID. Called with the lock held. """
+        _old = self._index.get((callsign, image_id))
+        if _old is not None and _old != key:
+            self._remove_index(callsign, image_id, _old)
+        self._index[(callsign, image_id)] = key
+
+        if touch:
+            try:
+                with open(self._index_path(callsign, image_id, key), 'ab'):
+                    pass
+            except OSError as e:
+                logging.error(f"Could not write packet cache index for {callsign} image {image_id}: {str(e)}")
+
+
+    def _remove_index(self, callsign, image_id, key):
+        if self._index.get((callsign, image_id)) == key:
+            del self._index[(callsign, image_id)]
+        try:
+            os.remove(self._index_path(callsign, image_id, key))
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        """ Delete least recently used entries until the cache is under max_bytes. Called with the lock held. """
+        _size = self.size
+        if _size <= self.max_bytes:
+            return
+
+        for _used, _key in sorted((_entry[1], _key) for _key, _entry in self._entries.items()):
+            if _size <= self.max_bytes:
+                break
+            _size -= self._entries[_key][0]
+            self._remove(_key)
+            logging.debug(f"Evicted packet cache entry {_key}.")
+
+
+    def _remove(self, key):
+        """ Delete an entry, and its index files. Called with the lock held. """
+        for (_callsign, _image_id), _key in list(self._index.items()):
+            if _key == key:
+                self._remove_index(_callsign, _image_id, _key)
+
+        if self._entries.pop(key, None) is None:
+            return
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
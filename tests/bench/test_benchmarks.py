@@ -0,0 +1,113 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from hfssdv.replay import replay
+
+from ..util import encoded_image, find_ssdv, load_benchmark, run_benchmark, ssdv_reference, synthetic_image
+
+# Slowest acceptable receive path throughput, as for `make bench`.
+MIN_PACKETS_PER_SECOND = 20.0
+
+
+class ReplayTest(unittest.TestCase):
+    """ Replays synthetic images of several sizes through the receive path, and fails if it is too slow """
+
+    def setUp(self):
+        logging.disable(logging.INFO)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def test_throughput(self):
+        _frames_for = load_benchmark('bench_replay').frames_for
+        for _width, _height in ((160, 128), (320, 240), (640, 480)):
+            _packets = encoded_image(_width, _height, quality=4)
+            for _frames in (_frames_for(_packets), _frames_for(_packets, loss=0.1, shuffle=True)):
+                with self.subTest(size=(_width, _height), frames=len(_frames)):
+                    _result = replay(_frames)
+                    self.assertEqual(_result.packets, len(_frames))
+                    self.assertEqual(_result.images, 1)
+                    self.assertIsNotNone(_result.first_image_time)
+                    self.assertGreater(_result.rate(), MIN_PACKETS_PER_SECOND)
+
+
+class BenchmarkSmokeTest(unittest.TestCase):
+    """ Runs each script in benchmarks/ on a small workload, so they don't rot """
+
+    def run_script(self, name, *args):
+        _result = run_benchmark(name, *args)
+        self.assertEqual(_result.returncode, 0, msg=f"{name} failed:\n{_result.stdout}")
+        self.assertTrue(_result.stdout.strip())
+        return _result.stdout
+
+
+    def test_bench_replay(self):
+        self.run_script('bench_replay', '--sizes', '160x128')
+
+
+    def test_bench_decode(self):
+        _dir = tempfile.mkdtemp()
+        try:
+            _capture = os.path.join(_dir, 'capture.bin')
+            with open(_capture, 'wb') as _f:
+                _f.write(b''.join(encoded_image()))
+            self.run_script('bench_decode', _capture, '--ssdv', os.path.join(_dir, 'no-ssdv'))
+        finally:
+            shutil.rmtree(_dir)
+
+
+    def test_bench_decode_reference(self):
+        _ssdv = find_ssdv()
+        if not _ssdv:
+            self.skipTest("ssdv binary not installed.")
+
+        _dir = tempfile.mkdtemp()
+        try:
+            # Encoded by the reference encoder, and checked against its decoder.
+            _capture = os.path.join(_dir, 'capture.bin')
+            with open(_capture, 'wb') as _f:
+                _f.write(b''.join(ssdv_reference(_ssdv, synthetic_image(160, 128), 2)[0]))
+            self.assertIn("matches ssdv -d", self.run_script('bench_decode', _capture, '--ssdv', _ssdv))
+        finally:
+            shutil.rmtree(_dir)
+
+
+    def test_bench_headers(self):
+        self.run_script('bench_headers', '--packets', 2000)
+
+
+    def test_bench_missing(self):
+        self.run_script('bench_missing', '--packets', 300, '--backlog', 20)
+
+
+    def test_bench_journal(self):
+        self.run_script('bench_journal', '--hours', 0.2)
+
+
+    def test_bench_pacing(self):
+        self.run_script('bench_pacing', '--packets', 30)
+
+
+    def test_bench_burst(self):
+        self.run_script('bench_burst', '--packets', 50, '--max-k', 3)
+
+
+    def test_bench_fountain(self):
+        self.run_script('bench_fountain', '--packets', 100, '--trials', 2, '--overheads', '0,0.1')
+
+
+    def test_bench_resend(self):
+        self.run_script('bench_resend', '--packets', 100, '--trials', 2)
+
+
+    def test_sim_arq(self):
+        self.run_script('sim_arq', '--images', 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import logging
+import unittest
+from unittest import mock
+
+from hfssdv import receive
+from hfssdv.aggregator import RXAggregator
+from hfssdv.burst import *
+from hfssdv.fec import ssdv_verify_packet
+
+from .util import corrupt, encoded_image
+
+
+class AggregatorTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.packets = encoded_image(fec=True)
+        self.aggregator = RXAggregator([('localhost', 8001), ('localhost', 8002)])
+        self.ssdv_rx = self.aggregator.ssdv_rx
+        self.ssdv_rx.defer_decode = True
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def test_duplicates(self):
+        for _packet in self.packets:
+            self.assertIsNotNone(self.aggregator.handle_frame(0, b'\x00' + _packet))
+        for _packet in self.packets[:3]:
+            self.assertIsNone(self.aggregator.handle_frame(1, b'\x00' + _packet))
+
+        self.assertEqual(self.aggregator.stats[0].unique, len(self.packets))
+        self.assertEqual(self.aggregator.stats[1].duplicates, 3)
+        self.assertEqual(self.aggregator.exclusive(), [len(self.packets) - 3, 0])
+
+
+    def test_corrected_once(self):
+        """ Packets are checked and corrected once, by the aggregator, and passed on corrected """
+        with mock.patch.object(receive, 'ssdv_verify_packet', wraps=ssdv_verify_packet) as _verify:
+            _resp = self.aggregator.handle_frame(0, b'\x00' + corrupt(self.packets[0], 4))
+            # The corrected copy is a duplicate, even with other errors.
+            self.assertIsNone(self.aggregator.handle_frame(1, b'\x00' + corrupt(self.packets[0], 6, seed=2)))
+            self.assertIsNone(self.aggregator.handle_frame(1, b'\x00' + corrupt(self.packets[1], 40)))
+        self.assertEqual(_verify.call_count, 0)
+
+        self.assertEqual(_resp['type'], 'image_update')
+        self.assertEqual(bytes(_resp['latest'][0]), bytes(self.packets[0]))
+        self.assertEqual(_resp['latest'].corrected, 4)
+        self.assertEqual((self.ssdv_rx.fec_corrected_packets, self.ssdv_rx.fec_corrected_symbols), (1, 4))
+
+        self.assertEqual(self.aggregator.stats[0].fec_corrected, 4)
+        self.assertEqual(self.aggregator.stats[1].fec_corrected, 6)
+        self.assertEqual(self.aggregator.stats[1].duplicates, 1)
+        self.assertEqual(self.aggregator.stats[1].crc_errors, 1)
+
+
+    def test_repeated_frames(self):
+        """ Non-SSDV frames are only duplicates when heard on another link at about the same time """
+        _frame = b'\x00' + bytes(range(40))
+        with mock.patch.object(self.ssdv_rx, 'addPacket') as _add, \
+                mock.patch('hfssdv.aggregator.time.time', return_value=1000.0) as _time:
+            self.aggregator.handle_frame(0, _frame)
+            self.aggregator.handle_frame(1, _frame)
+            # A retry, heard on the same link.
+            self.aggregator.handle_frame(0, _frame)
+            # Another retry, heard on the other link later on.
+            _time.return_value += self.aggregator.frame_dedup_window + 1
+            self.aggregator.handle_frame(1, _frame)
+
+        self.assertEqual(_add.call_count, 3)
+        self.assertEqual([_stats.duplicates for _stats in self.aggregator.stats], [0, 1])
+        self.assertEqual([_stats.other for _stats in self.aggregator.stats], [2, 2])
+
+
+    def test_bursts(self):
+        _frames = [b'\x00' + _frame for _frame, _count in burst_frames(self.packets, 600)]
+        for _frame in _frames:
+            self.aggregator.handle_frame(0, _frame)
+        # The same packets, heard singly on the other link.
+        for _packet in self.packets:
+            self.assertIsNone(self.aggregator.handle_frame(1, b'\x00' + _packet))
+
+        # A lone packet left over at the end is sent in a frame of its own.
+        self.assertEqual(self.aggregator.stats[0].bursts, sum(1 for _frame in _frames if is_burst(_frame)))
+        self.assertEqual(self.aggregator.stats[0].unique, len(self.packets))
+        _image = self.ssdv_rx.image_store.get("N0CALL", 0)
+        self.assertEqual([bytes(_image[_i]) for _i in _image.packet_ids()], [bytes(_p) for _p in self.packets])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+import logging
+import unittest
+
+from hfssdv.arq import *
+from hfssdv.packets import *
+from hfssdv.receive import SSDVRX
+from hfssdv.transmit import SSDVTX
+
+from .util import load_benchmark, synthetic_image
+
+TX_CALLSIGN = "VK5TX"
+RX_CALLSIGN = "VK5RX"
+
+
+class Clock(object):
+    """ A clock which only moves when told to """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RequesterTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.clock = Clock()
+        _tx = SSDVTX()
+        _tx.add_image(synthetic_image(160, 128), callsign=TX_CALLSIGN)
+        self.packets = _tx.image_store[_tx.current_image]['packets']
+        self.rx = SSDVRX(max_images=None, max_bytes=None, defer_decode=True)
+        self.requester = ARQRequester(self.rx, RX_CALLSIGN, end_delay=15, idle_timeout=60, retry_timeout=120,
+            max_rounds=2, clock=self.clock)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def receive(self, packets):
+        for _packet in packets:
+            self.requester.heard(self.rx.addPacket(b'\x00' + _packet, timestamp=self.clock.now))
+
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        return self.requester.due()
+
+
+    def test_end_delay(self):
+        self.receive(self.packets[:3] + self.packets[4:])
+        self.assertEqual(self.advance(14), [])
+        _requests = self.advance(1)
+        self.assertEqual(len(_requests), 1)
+        self.assertEqual(decode_resend_packet(_requests[0])['missing'], [3])
+
+        self.receive(self.packets[3:4])
+        self.assertEqual(self.requester.images, {})
+        _metrics = self.requester.metrics()[0]
+        self.assertEqual(_metrics['rounds'], 1)
+        self.assertEqual(_metrics['time_to_complete'], 15)
+
+
+    def test_idle_timeout(self):
+        # The end of the image is not heard.
+        self.receive(self.packets[:-2])
+        self.assertEqual(self.advance(59), [])
+        _requests = self.advance(1)
+        self.assertEqual(len(_requests), 1)
+        self.assertEqual(decode_resend_packet(_requests[0])['last_packet'], len(self.packets) - 3)
+
+
+    def test_retry_and_give_up(self):
+        self.receive(self.packets[1:])
+        self.assertEqual(len(self.advance(15)), 1)
+        # Unanswered, so repeated after retry_timeout, then given up on after max_rounds.
+        self.assertEqual(self.advance(119), [])
+        self.assertEqual(len(self.advance(1)), 1)
+        self.assertEqual(self.advance(120), [])
+        self.assertEqual(self.requester.images, {})
+        self.assertEqual(self.requester.summary()['gave_up'], 1)
+
+        # Late packets of a given up image are ignored.
+        self.receive(self.packets[:1])
+        self.assertEqual(self.requester.images, {})
+
+
+class ResponderTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.clock = Clock()
+        self.tx = SSDVTX()
+        self.tx.add_image(synthetic_image(160, 128), callsign=TX_CALLSIGN)
+        self.image_id = self.tx.current_image
+        self.count = len(self.tx.image_store[self.image_id]['packets'])
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def request(self, missing, src_call=RX_CALLSIGN, dst_call=TX_CALLSIGN, image_id=None):
+        """ A decoded resend request for the missing packets """
+        _image_id = self.image_id if image_id is None else image_id
+        return decode_resend_packet(encode_resend_packet_v2(dst_call, src_call, _image_id, self.count - 1, missing))
+
+
+    def test_answer(self):
+        _responder = ARQResponder(self.tx, TX_CALLSIGN, clock=self.clock)
+        self.assertEqual(_responder.handle(self.request([1, 3])), [1, 3])
+        self.assertIsNone(_responder.handle(self.request([1], dst_call="N0CALL")))
+        self.assertIsNone(_responder.handle(self.request([1], image_id=(self.image_id + 1) % 256)))
+        self.assertEqual(_responder.stats['answered'], 1)
+        self.assertEqual(_responder.stats['packets'], 2)
+        self.assertEqual(_responder.stats['unavailable'], 1)
+
+
+    def test_allowlist(self):
+        _responder = ARQResponder(self.tx, TX_CALLSIGN, allowlist=["vk5rx"], clock=self.clock)
+        self.assertEqual(_responder.handle(self.request([2])), [2])
+        self.assertIsNone(_responder.handle(self.request([2], src_call="N0CALL")))
+        self.assertEqual(_responder.stats['not_allowed'], 1)
+
+
+    def test_max_rounds(self):
+        _responder = ARQResponder(self.tx, TX_CALLSIGN, max_rounds=2, clock=self.clock)
+        self.assertEqual(_responder.handle(self.request([1])), [1])
+        self.assertEqual(_responder.handle(self.request([1])), [1])
+        self.assertIsNone(_responder.handle(self.request([1])))
+        # Counted per station.
+        self.assertEqual(_responder.handle(self.request([1], src_call="N0CALL")), [1])
+        self.assertEqual(_responder.stats['max_rounds'], 1)
+
+        # Re-using the image ID starts the count again.
+        self.tx.add_image(synthetic_image(160, 128, seed=2), callsign=TX_CALLSIGN, image_id=self.image_id)
+        self.count = len(self.tx.image_store[self.image_id]['packets'])
+        self.assertEqual(_responder.handle(self.request([1])), [1])
+
+
+    def test_min_interval(self):
+        _responder = ARQResponder(self.tx, TX_CALLSIGN, min_interval=30, clock=self.clock)
+        self.assertEqual(_responder.handle(self.request([1])), [1])
+        self.clock.now += 29
+        self.assertIsNone(_responder.handle(self.request([1])))
+        self.clock.now += 1
+        self.assertEqual(_responder.handle(self.request([1])), [1])
+        self.assertEqual(_responder.stats['too_soon'], 1)
+
+
+    def test_rate_limit(self):
+        _responder = ARQResponder(self.tx, TX_CALLSIGN, max_packets=5, rate_window=3600, clock=self.clock)
+        self.assertEqual(_responder.handle(self.request([0, 1, 2])), [0, 1, 2])
+        # Cut short to fit, then refused.
+        self.assertEqual(_responder.handle(self.request([3, 4, 5, 6])), [3, 4])
+        self.assertIsNone(_responder.handle(self.request([5])))
+        self.assertEqual(_responder.stats['rate_limited'], 1)
+
+        self.clock.now += 3600
+        self.assertEqual(_responder.handle(self.request([5, 6])), [5, 6])
+
+
+class SimulationTest(unittest.TestCase):
+    """ Both stations over a fading channel - every image must be completed """
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.sim_arq = load_benchmark('sim_arq')
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def run_simulation(self, *argv):
+        """ Run a simulation, with sim_arq.py's command line options """
+        _sim = self.sim_arq.Simulation(self.sim_arq.parse_args([str(_arg) for _arg in argv]))
+        _sim.run()
+        return _sim
+
+
+    def simulate(self, *argv):
+        """ Run a simulation, checking every image was completed """
+        _sim = self.run_simulation(*argv)
+        _args = _sim.args
+
+        _metrics = _sim.requester.metrics()
+        self.assertEqual(len(_metrics), _args.images, "Images were never heard")
+        for _image in _metrics:
+            self.assertIsNotNone(_image['completed'], f"Image {_image['image_id']} not completed")
+        self.assertEqual(_sim.requester.images, {})
+        self.assertEqual(_sim.requester.summary()['gave_up'], 0)
+
+        for _image in _sim.ssdv_rx.image_store.images.values():
+            self.assertEqual(len(_image.missing), 0)
+            self.assertFalse(image_incomplete(_image))
+
+        # Packets were actually lost and resent.
+        self.assertGreater(_sim.downlink.lost, 0)
+        return _sim
+
+
+    def test_defaults(self):
+        _sim = self.simulate('--images', 3)
+        self.assertGreater(_sim.responder.stats['answered'], 0)
+
+
+    def test_heavy_loss(self):
+        for _seed in range(1, 4):
+            with self.subTest(seed=_seed):
+                self.simulate('--images', 3, '--loss', 0.2, '--seed', _seed)
+
+
+    def test_bursts(self):
+        self.simulate('--images', 3, '--burst-size', 600, '--modem-frame', 510, '--loss', 0.2)
+
+
+    def test_fountain(self):
+        self.simulate('--images', 3, '--fountain', 0.2, '--loss', 0.2)
+
+
+    def test_rate_limit(self):
+        # The sender stops answering once the limit is used up, so images can't all be completed.
+        _sim = self.run_simulation('--images', 3, '--loss', 0.2, '--resend-limit', 10)
+        self.assertLessEqual(_sim.responder.stats['packets'], 10)
+        self.assertGreater(_sim.responder.stats['rate_limited'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from hfssdv.burst import *
+from hfssdv.packets import *
+from hfssdv.receive import SSDVRX, iter_responses
+
+from .util import encoded_image
+
+
+class BurstTest(unittest.TestCase):
+
+    def setUp(self):
+        self.packets = encoded_image()
+
+
+    def test_pack_unpack(self):
+        _items = [bytes(self.packets[0]), b'', b'\x51' * 30, bytes(self.packets[1])]
+        _burst = pack_burst(_items)
+        self.assertEqual(len(_burst), BURST_HEADER_SIZE + sum(BURST_ITEM_HEADER_SIZE + len(_i) for _i in _items))
+        self.assertEqual(unpack_burst(_burst), _items)
+
+        self.assertTrue(is_burst(b'\x00' + _burst))
+        self.assertFalse(is_burst(b'\x00' + bytes(self.packets[0])))
+        self.assertEqual(list(iter_frames(b'\x03' + _burst)), [b'\x03' + _i for _i in _items])
+        self.assertEqual(list(iter_frames(b'\x00' + bytes(self.packets[0]))), [b'\x00' + bytes(self.packets[0])])
+
+
+    def test_malformed(self):
+        _burst = pack_burst([bytes(self.packets[0]), bytes(self.packets[1])])
+        for _bad in (_burst[:-1], _burst[:5], b'\x00\x01'):
+            with self.assertRaises(ValueError):
+                unpack_burst(_bad)
+
+        with self.assertRaises(ValueError):
+            pack_burst([b'x'] * (BURST_MAX_ITEMS + 1))
+
+
+    def test_burst_frames(self):
+        _packets = [bytes(_p) for _p in self.packets]
+        self.assertEqual(burst_frames(_packets), [(_p, 1) for _p in _packets])
+
+        _burst_size = 3 * (SSDV_PACKET_SIZE + BURST_ITEM_HEADER_SIZE) + BURST_HEADER_SIZE
+        _frames = burst_frames(_packets, _burst_size)
+        self.assertEqual(sum(_count for _frame, _count in _frames), len(_packets))
+        self.assertTrue(all(len(_frame) <= _burst_size for _frame, _count in _frames))
+        self.assertTrue(all(_count == 3 for _frame, _count in _frames[:-1]))
+
+        _unpacked = []
+        for _frame, _count in _frames:
+            _unpacked += [_item[1:] for _item in iter_frames(b'\x00' + _frame)]
+        self.assertEqual(_unpacked, _packets)
+
+
+    def test_oversized_item(self):
+        # An item too big for a burst gets a frame of its own, sent bare.
+        self.assertEqual(burst_items([10, 600, 10, 10], 100), [(0, 1), (1, 2), (2, 4)])
+
+
+    def test_receive_burst(self):
+        _rx = SSDVRX(defer_decode=True)
+        _packets = [bytes(_p) for _p in self.packets]
+        for _frame, _count in burst_frames(_packets, 1000):
+            _resp = _rx.addPacket(b'\x00' + _frame)
+            self.assertEqual(len([_r for _r in iter_responses(_resp) if _r['type'] == 'image_update']), _count)
+
+        _image = _rx.image_store.get("N0CALL", 0)
+        self.assertEqual(len(_image), len(_packets))
+        self.assertEqual(len(_image.missing), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
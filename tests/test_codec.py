@@ -0,0 +1,163 @@
+import random
+import unittest
+
+import numpy as np
+
+from hfssdv.decoder import *
+from hfssdv.encoder import *
+from hfssdv.fec import *
+from hfssdv.packets import *
+
+from .util import SSDV_FIXTURES, encoded_image, find_ssdv, ssdv_fixtures, ssdv_reference, synthetic_image
+
+
+class EncodeDecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.image = synthetic_image(160, 128)
+        self.packets = encode_image(self.image, callsign="VK5QI", image_id=7, quality=5)
+
+
+    def test_packet_headers(self):
+        for _i, _packet in enumerate(self.packets):
+            self.assertEqual(len(_packet), SSDV_PACKET_SIZE)
+            _info = ssdv_packet_info(_packet)
+            self.assertEqual(_info['callsign'], "VK5QI")
+            self.assertEqual(_info['image_id'], 7)
+            self.assertEqual(_info['packet_id'], _i)
+            self.assertEqual((_info['width'], _info['height']), (160, 128))
+            # Only the last packet is marked as the end of the image.
+            self.assertEqual(bool(_packet[11] & 0x04), _i == len(self.packets) - 1)
+            self.assertEqual(ssdv_verify_packet(_packet), (bytes(_packet), 0))
+
+
+    def test_round_trip(self):
+        _decoded = decode_to_image(self.packets)
+        self.assertEqual(_decoded.size, self.image.size)
+
+        self.assertLess(self.mean_error(_decoded), 12.0)
+
+
+    def test_quality_levels(self):
+        _low = decode_to_image(encode_image(self.image, quality=1))
+        _high = decode_to_image(encode_image(self.image, quality=7))
+        self.assertLess(self.mean_error(_high), self.mean_error(_low))
+
+
+    def mean_error(self, decoded):
+        return np.abs(np.asarray(decoded, dtype=float) - np.asarray(self.image, dtype=float)).mean()
+
+
+    def test_fec_round_trip(self):
+        _packets = encode_image(self.image, callsign="VK5QI", image_id=7, quality=5, fec=True)
+        self.assertTrue(all(_packet[1] == SSDV_TYPE_FEC for _packet in _packets))
+        self.assertEqual(decode_to_image(_packets).size, self.image.size)
+
+
+    def test_resize_to_mcu_multiple(self):
+        _packets = encode_image(synthetic_image(150, 100), quality=3)
+        _info = ssdv_packet_info(_packets[0])
+        self.assertEqual(_info['width'] % 16, 0)
+        self.assertEqual(_info['height'] % 16, 0)
+        self.assertEqual(decode_to_image(_packets).size, (_info['width'], _info['height']))
+
+
+    def test_incremental_matches_full_decode(self):
+        _decoder = SSDVDecoder()
+        for _i, _packet in enumerate(self.packets):
+            _decoder.add_packet(_packet)
+            self.assertEqual(_decoder.get_jpeg(), decode_packets(self.packets[:_i + 1]))
+
+
+    def test_incremental_with_loss_and_reordering(self):
+        _packets = encoded_image(320, 240, seed=2, quality=4)
+        for _seed in range(6):
+            _random = random.Random(_seed)
+            _received = [_i for _i in range(len(_packets)) if _random.random() >= 0.15]
+            _order = list(_received)
+            _random.shuffle(_order)
+            # Some packets are heard twice.
+            _order += _random.sample(_received, 5)
+
+            _decoder = SSDVDecoder()
+            _added = set()
+            for _pkt_id in _order:
+                self.assertEqual(_decoder.add_packet(_packets[_pkt_id]), _pkt_id)
+                _added.add(_pkt_id)
+                if _random.random() < 0.3:
+                    _expected = decode_packets([_packets[_i] for _i in sorted(_added)])
+                    self.assertEqual(_decoder.get_jpeg(), _expected)
+
+            self.assertEqual(_decoder.get_jpeg(), decode_packets([_packets[_i] for _i in _received]))
+
+
+    def test_decode_from_buffer(self):
+        # A slab of packets, with the lost packets zero-filled.
+        _buffer = bytearray(len(self.packets) * SSDV_PACKET_SIZE)
+        _kept = [_i for _i in range(len(self.packets)) if _i % 4 != 1]
+        for _i in _kept:
+            _buffer[_i * SSDV_PACKET_SIZE:(_i + 1) * SSDV_PACKET_SIZE] = self.packets[_i]
+
+        self.assertEqual(SSDVDecoder(bytes(_buffer)).get_jpeg(), decode_packets([self.packets[_i] for _i in _kept]))
+
+
+    def test_changed_region(self):
+        _decoder = SSDVDecoder()
+        _decoder.add_packet(self.packets[0])
+        _decoder.get_jpeg()
+        _x, _y, _width, _height = _decoder.take_region()
+        self.assertEqual((_x, _y), (0, 0))
+        self.assertIsNone(_decoder.take_region())
+
+        # Nothing new, nothing changed.
+        _decoder.add_packet(self.packets[0])
+        _decoder.get_jpeg()
+        self.assertIsNone(_decoder.take_region())
+
+
+    def test_rejects_mismatched_packets(self):
+        _decoder = SSDVDecoder(self.packets[:2])
+        _other = encoded_image(320, 240, quality=5)
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(_decoder.add_packet(_other[2]))
+        self.assertIsNone(_decoder.add_packet(bytes(SSDV_PACKET_SIZE)))
+
+
+
+class ReferenceDecodeTest(unittest.TestCase):
+    """ Packets from the reference ssdv encoder decode to the same pixels as the reference decoder gives,
+        for each MCU mode (chroma subsampling) - checking SSDV_MCU_MODES, and the rest of the JPEG rebuilt
+    """
+
+    def assertSamePixels(self, packets, expected, name):
+        self.assertEqual(packets[0][11] & 0x03, int(name[len('mode'):]))
+        _decoded = np.asarray(decode_to_image(packets).convert('RGB'), dtype=np.int16)
+        _expected = np.asarray(expected, dtype=np.int16)
+        self.assertEqual(_decoded.shape, _expected.shape)
+        # Allowing for IDCT rounding differences, should the fixture have been decoded with another libjpeg.
+        self.assertLessEqual(np.abs(_decoded - _expected).max(), 2, name)
+
+
+    def test_fixtures(self):
+        _fixtures = ssdv_fixtures()
+        if not _fixtures:
+            self.skipTest("No reference fixtures - produce them with 'make ssdv-fixtures'.")
+
+        for _name, _packets, _expected in _fixtures:
+            with self.subTest(fixture=_name):
+                self.assertSamePixels(_packets, _expected, _name)
+
+
+    def test_reference_binary(self):
+        _ssdv = find_ssdv()
+        if not _ssdv:
+            self.skipTest("ssdv binary not installed.")
+
+        for _name, _subsampling in SSDV_FIXTURES:
+            with self.subTest(fixture=_name):
+                _packets, _expected = ssdv_reference(_ssdv, synthetic_image(160, 128, seed=3), _subsampling)
+                self.assertSamePixels(_packets, _expected, _name)
+
+
+if __name__ == "__main__":
+    unittest.main()
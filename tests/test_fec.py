@@ -0,0 +1,94 @@
+import logging
+import unittest
+
+from hfssdv.fec import *
+from hfssdv.packets import *
+from hfssdv.receive import SSDVRX
+
+from .util import corrupt, encoded_image
+
+
+class ReedSolomonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fec_packets = encoded_image(fec=True)
+        self.nofec_packets = encoded_image(fec=False)
+
+
+    def test_codeword_syndromes(self):
+        _block = bytes(self.fec_packets[0][1:])
+        self.assertEqual(rs_syndromes(_block), [RS_A0] * RS_NROOTS)
+        self.assertNotEqual(rs_syndromes(corrupt(b'\x00' + _block, 1, end=SSDV_PACKET_SIZE)[1:]), [RS_A0] * RS_NROOTS)
+
+
+    def test_corrects_up_to_16_symbols(self):
+        _packet = bytes(self.fec_packets[1])
+        for _count in (1, 5, 16):
+            for _seed in range(5):
+                self.assertEqual(ssdv_verify_packet(corrupt(_packet, _count, _seed)), (_packet, _count))
+
+
+    def test_untrusted_sync_and_type(self):
+        # The sync and type bytes are not covered by the CRC, so are fixed up rather than trusted.
+        _packet = bytes(self.fec_packets[1])
+        _damaged = b'\x00\x00' + _packet[2:]
+        self.assertEqual(ssdv_verify_packet(_damaged), (_packet, 0))
+
+
+    def test_too_many_errors(self):
+        _packet = bytes(self.fec_packets[1])
+        for _seed in range(5):
+            self.assertEqual(ssdv_verify_packet(corrupt(_packet, 40, _seed, end=SSDV_PACKET_SIZE)), (None, -1))
+
+
+    def test_nofec_crc(self):
+        _packet = bytes(self.nofec_packets[1])
+        self.assertEqual(ssdv_verify_packet(_packet), (_packet, 0))
+        for _seed in range(5):
+            self.assertEqual(ssdv_verify_packet(corrupt(_packet, 1, _seed)), (None, -1))
+
+        self.assertEqual(ssdv_verify_packet(_packet[:-1]), (None, -1))
+
+
+    def test_receiver_statistics(self):
+        _rx = SSDVRX(defer_decode=True)
+        logging.disable(logging.WARNING)
+        try:
+            _rx.addPacket(b'\x00' + corrupt(self.fec_packets[0], 3))
+            _rx.addPacket(b'\x00' + corrupt(self.nofec_packets[1], 1))
+        finally:
+            logging.disable(logging.NOTSET)
+
+        self.assertEqual(_rx.fec_corrected_packets, 1)
+        self.assertEqual(_rx.fec_corrected_symbols, 3)
+        self.assertEqual(_rx.crc_errors, 1)
+
+        _image = _rx.image_store.get("N0CALL", 0)
+        self.assertEqual(list(_image.packet_ids()), [0])
+        self.assertEqual(bytes(_image[0]), bytes(self.fec_packets[0]))
+        self.assertEqual(_image.corrected, 3)
+
+
+    def test_duplicates_not_counted(self):
+        """ Corrections to packets we already have are counted by the receiver, but not against the image """
+        for _import in (False, True):
+            with self.subTest(importPackets=_import):
+                _rx = SSDVRX(defer_decode=True)
+                _packets = [corrupt(self.fec_packets[0], 3), corrupt(self.fec_packets[0], 5, seed=2), corrupt(self.fec_packets[1], 2)]
+                logging.disable(logging.WARNING)
+                try:
+                    if _import:
+                        _rx.importPackets(b''.join(_packets))
+                    else:
+                        for _packet in _packets:
+                            _rx.addPacket(b'\x00' + _packet)
+                finally:
+                    logging.disable(logging.NOTSET)
+
+                self.assertEqual(_rx.fec_corrected_packets, 3)
+                self.assertEqual(_rx.fec_corrected_symbols, 10)
+                self.assertEqual(_rx.image_store.get("N0CALL", 0).corrected, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import logging
+import random
+import unittest
+
+import numpy as np
+
+from hfssdv.fountain import *
+from hfssdv.receive import SSDVRX
+from hfssdv.transmit import SSDVTX
+
+from .util import synthetic_image
+
+
+class TNC(object):
+    """ Collects the frames written to it """
+
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(bytes(frame))
+
+
+class FountainTest(unittest.TestCase):
+
+    def setUp(self):
+        _random = np.random.default_rng(1)
+        self.packets = [_random.integers(0, 256, SSDV_PACKET_SIZE, dtype=np.uint8).tobytes() for _i in range(60)]
+        self.source = packet_array(self.packets)
+
+
+    def test_repair_row(self):
+        # Rows depend only on the seed and K, so both ends agree.
+        self.assertTrue((repair_row(5, 60) == repair_row(5, 60)).all())
+        self.assertFalse((repair_row(5, 60) == repair_row(6, 60)).all())
+        self.assertEqual(len(repair_row(5, 60)), 60)
+
+
+    def test_packet_info(self):
+        _packet = encode_repair_packets(self.packets, "VK5ABC", 9, [1234])[0]
+        self.assertEqual(len(_packet), FOUNTAIN_PACKET_SIZE)
+        _info = fountain_packet_info(_packet)
+        self.assertEqual((_info['callsign'], _info['image_id'], _info['source_count'], _info['seed']),
+            ("VK5ABC", 9, 60, 1234))
+
+        _expected = np.bitwise_xor.reduce(self.source[repair_row(1234, 60)], axis=0)
+        self.assertEqual(_info['payload'], _expected.tobytes())
+
+        _bad = bytearray(_packet)
+        _bad[20] ^= 0x01
+        self.assertIsNone(fountain_packet_info(bytes(_bad)))
+
+
+    def rebuild(self, known, seeds):
+        _decoder = FountainDecoder(len(self.packets))
+        for _packet in encode_repair_packets(self.packets, "VK5ABC", 9, seeds):
+            _info = fountain_packet_info(_packet)
+            self.assertTrue(_decoder.add(_info['seed'], _info['payload']))
+
+        _source = np.zeros_like(self.source)
+        _source[known] = self.source[known]
+        return _decoder.decode(known, _source), _source
+
+
+    def test_rebuild(self):
+        _random = np.random.default_rng(2)
+        for _loss in (0.05, 0.3, 1.0):
+            _known = _random.random(len(self.packets)) >= _loss
+            _missing = np.flatnonzero(~_known).tolist()
+            _rebuilt, _source = self.rebuild(_known, list(range(100, 100 + len(_missing) + 10)))
+            self.assertEqual(_rebuilt, _missing)
+            self.assertTrue((_source == self.source).all())
+
+
+    def test_not_enough_repair_packets(self):
+        _known = np.ones(len(self.packets), dtype=bool)
+        _known[[3, 10, 40]] = False
+        self.assertEqual(self.rebuild(_known, [1, 2])[0], [])
+
+
+    def test_gf2_solve(self):
+        _matrix = np.array([[1, 0], [1, 1], [0, 1]], dtype=bool)
+        _values = np.array([[5], [6], [3]], dtype=np.uint8)
+        self.assertEqual(gf2_solve(_matrix, _values).tolist(), [[5], [3]])
+        self.assertIsNone(gf2_solve(np.array([[1, 1], [1, 1]], dtype=bool), _values[:2]))
+
+
+    def test_end_to_end(self):
+        """ An image sent with repair packets arrives complete, despite losses """
+        logging.disable(logging.INFO)
+        try:
+            for _burst_size in (None, 600):
+                _tx = SSDVTX(burst_size=_burst_size, fountain_overhead=0.4)
+                _tx.add_image(synthetic_image(320, 240), callsign="VK5ABC", quality=4)
+                # Repair packets are random combinations, so a few spare are needed to rebuild with
+                # near certainty. Fix the combinations, to make the test repeatable.
+                _tx.image_store[_tx.current_image]['repair_seed'] = 1
+                _tnc = TNC()
+                _tx.transmit_current_image(_tnc, delay=0)
+                _sent = _tx.image_store[_tx.current_image]['packets']
+
+                _rx = SSDVRX(defer_decode=True)
+                _random = random.Random(3)
+                _lost = 0
+                for _frame in _tnc.frames:
+                    if _random.random() < 0.08:
+                        _lost += 1
+                        continue
+                    _rx.addPacket(b'\x00' + _frame)
+
+                _image = _rx.image_store.get("VK5ABC", _tx.current_image)
+                self.assertGreater(_lost, 0)
+                self.assertGreater(_rx.repaired_packets, 0)
+                self.assertEqual(len(_image.missing), 0)
+                self.assertEqual([bytes(_image[_i]) for _i in range(len(_sent))], [bytes(_p) for _p in _sent])
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import subprocess
+import sys
+import time
+import unittest
+
+from .util import python_env
+
+# Modules which must stay cheap to import.
+CHECK_MODULES = ['hfssdv.packets', 'hfssdv.receive', 'hfssdv.transmit', 'hfssdv.cli', 'hfssdv.gui']
+
+# Modules which must not be loaded by any of the above.
+HEAVY_MODULES = ['PyQt5', 'PySide2', 'pyqtgraph', 'numpy', 'PIL', 'kissfix']
+
+# Import time budget per module, as a multiple of the start-up time of a bare interpreter measured in the same run.
+# Both are the best of several interleaved runs, so a slow or busy machine slows both alike.
+BUDGET_FACTOR = 4.0
+REPEATS = 7
+
+
+def import_times(module):
+    """ Import a module in a fresh interpreter, returning {module name: cumulative import time (us)} """
+    _result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True, env=python_env()
+    )
+
+    _times = {}
+    for _line in _result.stderr.splitlines():
+        if not _line.startswith('import time:'):
+            continue
+        _fields = _line[len('import time:'):].split('|')
+        try:
+            _times[_fields[2].strip()] = int(_fields[1])
+        except ValueError:
+            # Header line.
+            continue
+    return _times
+
+
+def run_time(code):
+    """ Run some code in a fresh interpreter, returning the wall clock time taken (ms) """
+    _start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True, env=python_env())
+    return (time.perf_counter() - _start) * 1000.0
+
+
+class ImportTimeTest(unittest.TestCase):
+    """ Core modules are imported in a fresh interpreter, as the headless RX/TX commands rely on them staying cheap """
+
+    def test_no_heavy_imports(self):
+        for _module in CHECK_MODULES:
+            with self.subTest(module=_module):
+                _times = import_times(_module)
+                self.assertIn(_module, _times)
+                _heavy = sorted(set(_name.split('.')[0] for _name in _times) & set(HEAVY_MODULES))
+                self.assertEqual(_heavy, [], f"{_module} imports {', '.join(_heavy)}")
+
+
+    def test_import_budget(self):
+        for _module in CHECK_MODULES:
+            with self.subTest(module=_module):
+                _baseline = []
+                _imported = []
+                for _i in range(REPEATS):
+                    _baseline.append(run_time('pass'))
+                    _imported.append(run_time(f"import {_module}"))
+
+                _startup = min(_baseline)
+                _cost = min(_imported) - _startup
+                _budget = BUDGET_FACTOR * _startup
+                self.assertLess(_cost, _budget,
+                    f"{_module} took {_cost:.1f} ms to import (budget {_budget:.1f} ms, {BUDGET_FACTOR:.0f}x the {_startup:.1f} ms interpreter start-up)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from hfssdv.decoder import decode_packets
+from hfssdv.journal import *
+from hfssdv.receive import SSDVRX
+
+from .util import encoded_image
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'journal.bin')
+        self.packets = [bytes(_p) for _p in encoded_image(callsign="VK5ABC", image_id=3)]
+        logging.disable(logging.ERROR)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.dir)
+
+
+    def test_append_and_scan(self):
+        _journal = PacketJournal(self.filename)
+        for _i, _packet in enumerate(self.packets):
+            _journal.append(b'\x00' + _packet, link=_i % 2, timestamp=1000.0 + _i)
+        _journal.close()
+
+        _records, _end = scan_journal(self.filename)
+        self.assertEqual(_end, os.path.getsize(self.filename))
+        self.assertEqual([(_t, _l, bytes(_f)) for _t, _l, _f in _records],
+            [(1000.0 + _i, _i % 2, b'\x00' + _p) for _i, _p in enumerate(self.packets)])
+
+
+    def test_torn_tail_recovery(self):
+        _journal = PacketJournal(self.filename)
+        _rx = SSDVRX(journal=_journal, defer_decode=True)
+        for _packet in self.packets[:-3]:
+            _rx.addPacket(b'\x00' + _packet)
+        _journal.close()
+        _good_size = os.path.getsize(self.filename)
+
+        # A crash part way through writing a record.
+        with open(self.filename, 'ab') as _f:
+            _f.write(b'\x41\xd9\x00\x00\x00\x00\x00\x00\x00\x01')
+
+        self.assertEqual(scan_journal(self.filename)[1], _good_size)
+
+        # Reopening drops the torn record, and replay rebuilds the image store.
+        _journal = PacketJournal(self.filename)
+        self.assertEqual(os.path.getsize(self.filename), _good_size)
+        _rx = SSDVRX(journal=_journal)
+        self.assertEqual(_journal.replay(_rx), len(self.packets) - 3)
+
+        for _packet in self.packets[-3:]:
+            _rx.addPacket(b'\x00' + _packet)
+        _journal.close()
+
+        _image = _rx.image_store.get("VK5ABC", 3)
+        self.assertEqual(len(_image.missing), 0)
+        self.assertEqual(_rx.decode(_image), decode_packets(self.packets))
+        self.assertEqual(len(scan_journal(self.filename)[0]), len(self.packets))
+
+
+    def test_not_a_journal(self):
+        with open(self.filename, 'wb') as _f:
+            _f.write(b'something else entirely')
+        self.assertEqual(scan_journal(self.filename), ([], 0))
+        self.assertEqual(scan_journal(os.path.join(self.dir, 'missing.bin')), ([], 0))
+
+
+    def test_compact(self):
+        _journal = PacketJournal(self.filename, retention=100, compact_interval=None)
+        _journal.append(b'\x00' + self.packets[0], timestamp=1000.0)
+        for _packet in self.packets[:5]:
+            _journal.append(b'\x00' + _packet, timestamp=1200.0)
+
+        # The old record, and the duplicate of packet 0, are dropped.
+        self.assertEqual(_journal.compact(now=1250.0), 1)
+        self.assertEqual([bytes(_f[1:]) for _t, _l, _f in _journal.read()], self.packets[:5])
+
+        _journal.append(b'\x00' + self.packets[5], timestamp=1260.0)
+        _journal.close()
+        self.assertEqual(len(scan_journal(self.filename)[0]), 6)
+
+
+    def test_compact_off_receive_path(self):
+        _journal = PacketJournal(self.filename, retention=100, compact_interval=3600)
+        _journal._last_compact = 1000.0
+        for _packet in self.packets[:3]:
+            _journal.append(b'\x00' + _packet, timestamp=1000.0)
+        # Not compacted as frames are appended, even once it is due.
+        _journal.append(b'\x00' + self.packets[0], timestamp=5000.0)
+        self.assertEqual(len(_journal.read()), 4)
+
+        self.assertEqual(_journal.compact_if_due(now=4000.0), 0)
+        self.assertEqual(_journal.compact_if_due(now=5000.0), 3)
+        self.assertEqual(_journal.compact_if_due(now=5001.0), 0)
+        self.assertEqual(len(_journal.read()), 1)
+
+        # Compacted again when reopened - dropping the duplicate, though the records are long past retention now.
+        _journal.append(b'\x00' + self.packets[0], timestamp=5000.0)
+        _journal.close()
+        _journal = PacketJournal(self.filename, retention=None)
+        self.assertEqual(_journal.records, 1)
+        _journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
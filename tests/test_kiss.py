@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import unittest
+
+from hfssdv.kiss import *
+from hfssdv.receive import SSDVRX
+from hfssdv.transmit import SSDVTX
+
+from .util import synthetic_image
+
+# Longest to wait for anything over the stand-in TNC (seconds).
+TIMEOUT = 10
+
+
+class KISSFramingTest(unittest.TestCase):
+
+    def test_escaping(self):
+        _data = bytes(range(256)) + b'\xc0\xdb\xdb\xdc\xc0'
+        _escaped = kiss_escape(_data)
+        self.assertNotIn(b'\xc0', _escaped)
+        self.assertEqual(kiss_unescape(_escaped), _data)
+
+
+    def test_frame(self):
+        _frame = kiss_frame(b'\x55\xc0', port=1)
+        self.assertEqual(_frame, b'\xc0\x10\x55\xdb\xdc\xc0')
+
+
+    def test_deframer(self):
+        _stream = kiss_frame(b'\x01\xc0\x02') + kiss_frame(b'\xdb' * 3) + kiss_frame(b'end')
+        _deframer = KISSDeframer()
+        _frames = []
+        # Fed a byte at a time, as a TCP stream may split anywhere.
+        for _i in range(len(_stream)):
+            _frames += _deframer.feed(_stream[_i:_i + 1])
+        self.assertEqual(_frames, [b'\x00\x01\xc0\x02', b'\x00' + b'\xdb' * 3, b'\x00end'])
+        self.assertEqual(_deframer.buffer, b'')
+
+
+class StandInTNCTest(unittest.TestCase):
+    """ KISSClient and the receive and transmit paths, over a local stand-in TNC """
+
+    def setUp(self):
+        # Connection errors are expected.
+        logging.disable(logging.CRITICAL)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, TIMEOUT))
+
+
+    def test_relay(self):
+        async def _test():
+            _server = KISSServer()
+            await _server.start()
+            _tx = KISSClient(port=_server.port, name="tx")
+            _rx = KISSClient(port=_server.port, name="rx")
+            try:
+                _tx.start()
+                _rx.start()
+                await _tx.connected.wait()
+                await _rx.connected.wait()
+
+                _frames = [bytes([_i]) + b'\xc0\xdb' + bytes(250) for _i in range(20)]
+                for _frame in _frames:
+                    await _tx.write(_frame)
+                await _tx.flush()
+
+                self.assertEqual([await _rx.read() for _frame in _frames], [b'\x00' + _frame for _frame in _frames])
+                self.assertEqual((_tx.frames_tx, _rx.frames_rx), (20, 20))
+            finally:
+                await _tx.stop()
+                await _rx.stop()
+                await _server.stop()
+
+        self.run_async(_test())
+
+
+    def test_reconnect(self):
+        async def _test():
+            # Find a free port, and leave nothing listening on it.
+            _server = KISSServer()
+            await _server.start()
+            _port = _server.port
+            await _server.stop()
+
+            _client = KISSClient(port=_port, reconnect_delay=0.05, max_reconnect_delay=0.2)
+            _client.start()
+            _server = KISSServer(port=_port)
+            try:
+                await asyncio.sleep(0.3)
+                self.assertFalse(_client.connected.is_set())
+
+                # The TNC comes up, and the client connects once it retries.
+                await _server.start()
+                await _client.connected.wait()
+
+                # The TNC goes away and comes back.
+                await _server.stop()
+                await asyncio.sleep(0.1)
+                self.assertFalse(_client.connected.is_set())
+                _server = KISSServer(port=_port)
+                await _server.start()
+                await _client.connected.wait()
+                self.assertEqual(_client.reconnects, 1)
+            finally:
+                await _client.stop()
+                await _server.stop()
+
+        self.run_async(_test())
+
+
+    def test_backpressure(self):
+        async def _test():
+            # Not connected, so nothing is written, and the TX queue fills up.
+            _client = KISSClient(port=1, tx_queue_size=4)
+            for _i in range(4):
+                await _client.write(b'x')
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(_client.write(b'x'), 0.1)
+
+        self.run_async(_test())
+
+
+    def test_image_transfer(self):
+        """ SSDVTX sends an image over the stand-in TNC to SSDVRX, both driven from the event loop """
+        async def _test():
+            _server = KISSServer()
+            await _server.start()
+            _tx_tnc = KISSClient(port=_server.port, name="tx")
+            _rx_tnc = KISSClient(port=_server.port, name="rx")
+            _ssdv_tx = SSDVTX()
+            _ssdv_rx = SSDVRX(defer_decode=True)
+            _ssdv_tx.add_image(synthetic_image(160, 128), callsign="VK5ABC", quality=4)
+            _count = len(_ssdv_tx.image_store[_ssdv_tx.current_image]['packets'])
+
+            _updates = []
+            _complete = asyncio.Event()
+
+            def _callback(resp):
+                _updates.append(resp)
+                if len(_updates) == _count:
+                    _complete.set()
+
+            _receiver = asyncio.ensure_future(_ssdv_rx.receive(_rx_tnc, _callback))
+            try:
+                _tx_tnc.start()
+                _rx_tnc.start()
+                await _tx_tnc.connected.wait()
+                await _rx_tnc.connected.wait()
+
+                await _ssdv_tx.transmit_current_image_async(_tx_tnc, delay=0)
+                await _complete.wait()
+            finally:
+                _receiver.cancel()
+                await asyncio.gather(_receiver, return_exceptions=True)
+                await _tx_tnc.stop()
+                await _rx_tnc.stop()
+                await _server.stop()
+
+            _image = _ssdv_rx.image_store.get("VK5ABC", _ssdv_tx.current_image)
+            self.assertEqual(len(_image), _count)
+            self.assertEqual(len(_image.missing), 0)
+            self.assertTrue(all(_resp['type'] == 'image_update' for _resp in _updates))
+
+        self.run_async(_test())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+from unittest import mock
+
+from hfssdv.packets import *
+from hfssdv.pacing import *
+from hfssdv.transmit import SSDVTX
+
+from .util import load_benchmark, synthetic_image
+
+BITRATE = 1000
+PACKETS = 300
+BUFFER_FRAMES = 8
+
+# With and without fixed-size modem frames.
+MODEMS = [
+    {'modem_frame': None, 'frame_overhead': 0.5},
+    {'modem_frame': 510, 'frame_overhead': 0.5},
+]
+
+
+class PacingTest(unittest.TestCase):
+    """ Packets sent to the simulated TNC on a simulated clock, as in benchmarks/bench_pacing.py """
+
+    def setUp(self):
+        self.bench = load_benchmark('bench_pacing')
+
+
+    def send(self, modem, delay=None, bitrate=None, feedback=False):
+        """ Send PACKETS packets to a simulated TNC, with a fixed delay or paced as if the modem ran at 'bitrate'.
+
+            Returns:
+                (dict, TransmitPacer): The TNC's stats, and the pacer used (if any).
+        """
+        _clock = self.bench.SimulatedClock()
+        _tnc = SimulatedTNC(BITRATE, buffer_frames=BUFFER_FRAMES, clock=_clock.time, **modem)
+        _pacer = None
+        if bitrate:
+            _pacer = TransmitPacer(bitrate, clock=_clock.time, queue_depth=_tnc.depth if feedback else None, **modem)
+        return self.bench.run(PACKETS, _tnc, _clock, delay=delay, pacer=_pacer), _pacer
+
+
+    def ideal_duration(self, modem):
+        """ Time to send every packet back to back """
+        return PACKETS * frame_airtime(SSDV_PACKET_SIZE, BITRATE, **modem)
+
+
+    def assertNoGaps(self, stats, modem):
+        """ Every frame sent, with the TNC never left idle """
+        self.assertEqual(stats['frames_written'], PACKETS)
+        self.assertEqual(stats['overflows'], 0)
+        self.assertLess(stats['idle_time'], 0.01 * stats['duration'])
+        self.assertAlmostEqual(stats['duration'], self.ideal_duration(modem), delta=0.01 * self.ideal_duration(modem))
+
+
+    def test_frame_airtime(self):
+        self.assertAlmostEqual(frame_airtime(100, 800), 1.0)
+        self.assertAlmostEqual(frame_airtime(100, 800, frame_overhead=0.5), 1.5)
+        # Padded out to whole modem frames.
+        self.assertAlmostEqual(frame_airtime(257, 800, modem_frame=100, frame_overhead=0.5), 3 * 1.5)
+        self.assertAlmostEqual(frame_airtime(0, 800, modem_frame=100), 1.0)
+
+
+    def test_pacer(self):
+        for _modem in MODEMS:
+            with self.subTest(modem=_modem):
+                _stats, _pacer = self.send(_modem, bitrate=BITRATE)
+                self.assertNoGaps(_stats, _modem)
+
+
+    def test_fixed_delays(self):
+        for _modem in MODEMS:
+            with self.subTest(modem=_modem):
+                _airtime = frame_airtime(SSDV_PACKET_SIZE, BITRATE, **_modem)
+                # Too short floods the TNC's buffer, too long leaves the air idle.
+                _stats, _pacer = self.send(_modem, delay=0.5 * _airtime)
+                self.assertGreater(_stats['overflows'], 0)
+                _stats, _pacer = self.send(_modem, delay=1.5 * _airtime)
+                self.assertEqual(_stats['overflows'], 0)
+                self.assertGreater(_stats['idle_time'], 0.25 * _stats['duration'])
+
+
+    def test_misconfigured_bitrate(self):
+        for _modem in MODEMS:
+            with self.subTest(modem=_modem):
+                _stats, _pacer = self.send(_modem, bitrate=BITRATE * 1.5)
+                self.assertGreater(_stats['overflows'], 0)
+                _stats, _pacer = self.send(_modem, bitrate=BITRATE / 1.5)
+                self.assertGreater(_stats['idle_time'], 0.25 * _stats['duration'])
+
+
+    def test_feedback(self):
+        """ With buffer occupancy feedback, a mis-configured bitrate corrects itself """
+        for _modem in MODEMS:
+            with self.subTest(modem=_modem, bitrate='fast'):
+                _stats, _pacer = self.send(_modem, bitrate=BITRATE * 1.5, feedback=True)
+                self.assertNoGaps(_stats, _modem)
+
+            with self.subTest(modem=_modem, bitrate='slow'):
+                _stats, _pacer = self.send(_modem, bitrate=BITRATE / 1.5, feedback=True)
+                self.assertNoGaps(_stats, _modem)
+                # Airtime estimates scaled to the drain rate measured.
+                self.assertAlmostEqual(_pacer.scale, 1 / 1.5, delta=0.05)
+
+
+    def test_transmit(self):
+        """ SSDVTX sends an image through a TNC, paced with feedback """
+        _modem = MODEMS[1]
+        _clock = self.bench.SimulatedClock()
+        _tnc = SimulatedTNC(BITRATE, buffer_frames=BUFFER_FRAMES, clock=_clock.time, **_modem)
+        _tx = SSDVTX(pacer=TransmitPacer(BITRATE * 1.5, clock=_clock.time, queue_depth=_tnc.depth, **_modem))
+        _tx.add_image(synthetic_image(320, 240), callsign="N0CALL")
+        _packets = len(_tx.image_store[_tx.current_image]['packets'])
+
+        with mock.patch('hfssdv.transmit.time.sleep', _clock.sleep):
+            _tx.transmit_image_subset(_tx.current_image, range(_packets), _tnc)
+
+        _stats = _tnc.stats()
+        self.assertEqual(_stats['frames_written'], _packets)
+        self.assertEqual(_stats['overflows'], 0)
+        self.assertLess(_stats['idle_time'], 0.01 * _stats['duration'])
+
+
+if __name__ == "__main__":
+    unittest.main()
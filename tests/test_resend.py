@@ -0,0 +1,135 @@
+import random
+import unittest
+
+from hfssdv.packets import *
+from hfssdv.packets import _decode_varint, _encode_varint
+from hfssdv.receive import SSDVRX
+
+from .util import encoded_image
+
+# Offset of the encoding byte in a v2 resend request.
+RESEND_V2_ENCODING_OFFSET = 16
+
+
+class ResendV1Test(unittest.TestCase):
+
+    def test_round_trip(self):
+        _packet = encode_resend_packet("VK5ABC", "N0CALL", 12, 300, [1, 2, 3, 250])
+        self.assertEqual(len(_packet), SSDV_PACKET_SIZE)
+        self.assertTrue(is_resend_packet(_packet))
+        self.assertEqual(decode_resend_packet(_packet), {
+            'src_call': "N0CALL", 'dst_call': "VK5ABC", 'img_id': 12, 'last_packet': 300, 'missing': [1, 2, 3, 250]
+        })
+
+
+    def test_packet_limit(self):
+        _packet = encode_resend_packet("VK5ABC", "N0CALL", 1, 999, list(range(500)))
+        self.assertEqual(len(_packet), SSDV_PACKET_SIZE)
+        self.assertEqual(decode_resend_packet(_packet)['missing'], list(range(MAX_PACKET_LIST)))
+
+
+class ResendV2Test(unittest.TestCase):
+
+    def test_round_trip(self):
+        _random = random.Random(1)
+        for _count in (0, 1, 10, 500, 3000):
+            _missing = sorted(_random.sample(range(4000), _count))
+            _packet = encode_resend_packet_v2("VK5ABC", "N0CALL", 200, 3999, _missing, max_size=None)
+            self.assertTrue(is_resend_packet(_packet))
+            self.assertEqual(decode_resend_packet(_packet), {
+                'src_call': "N0CALL", 'dst_call': "VK5ABC", 'img_id': 200, 'last_packet': 3999, 'missing': _missing
+            })
+
+
+    def test_encodings(self):
+        # A few long fades are shortest as ranges, scattered losses as a bitmap.
+        _fades = list(range(100, 300)) + list(range(1000, 1040))
+        _packet = encode_resend_packet_v2("VK5ABC", "N0CALL", 1, 2000, _fades)
+        self.assertEqual(_packet[RESEND_V2_ENCODING_OFFSET], RESEND_RANGES)
+        self.assertLess(len(_packet), 32)
+        self.assertEqual(decode_resend_packet(_packet)['missing'], _fades)
+
+        _scattered = list(range(0, 2000, 3))
+        _packet = encode_resend_packet_v2("VK5ABC", "N0CALL", 1, 2000, _scattered, max_size=None)
+        self.assertEqual(_packet[RESEND_V2_ENCODING_OFFSET], RESEND_BITMAP)
+        self.assertEqual(decode_resend_packet(_packet)['missing'], _scattered)
+
+
+    def test_size_limit(self):
+        # Every other packet lost, up to the highest packet ID - the worst case for both encodings.
+        _missing = list(range(0, 65535, 2))
+        _full = encode_resend_packet_v2("VK5ABC", "N0CALL", 1, 65534, _missing, max_size=None)
+        self.assertGreater(len(_full), 4000)
+
+        for _max_size in (64, SSDV_PACKET_SIZE, 1024):
+            _packet = encode_resend_packet_v2("VK5ABC", "N0CALL", 1, 65534, _missing, max_size=_max_size)
+            self.assertLessEqual(len(_packet), _max_size)
+            self.assertGreater(len(_packet), _max_size - 8)
+            # The lowest packet IDs are listed, and the rest left for later requests.
+            _data = decode_resend_packet(_packet)
+            self.assertEqual(_data['missing'], _missing[:len(_data['missing'])])
+            self.assertEqual(_data['last_packet'], 65534)
+
+        # Fits as it is.
+        _packet = encode_resend_packet_v2("VK5ABC", "N0CALL", 1, 2000, list(range(100, 300)))
+        self.assertEqual(decode_resend_packet(_packet)['missing'], list(range(100, 300)))
+
+
+    def test_unsorted_and_duplicates(self):
+        _packet = encode_resend_packet_v2("VK5ABC", "N0CALL", 1, 50, [9, 3, 4, 3, -1])
+        self.assertEqual(decode_resend_packet(_packet)['missing'], [3, 4, 9])
+
+
+    def test_varint(self):
+        for _value in (0, 1, 127, 128, 300, 65535, 2**32):
+            _data = _encode_varint(_value)
+            self.assertEqual(_decode_varint(_data + b'\xff', 0), (_value, len(_data)))
+
+        with self.assertRaises(ValueError):
+            _decode_varint(b'\x80\x80', 0)
+
+
+    def test_corrupt(self):
+        _packet = bytearray(encode_resend_packet_v2("VK5ABC", "N0CALL", 1, 50, [3, 4, 9]))
+        _packet[5] ^= 0x01
+        with self.assertRaises(ValueError):
+            decode_resend_packet(bytes(_packet))
+
+        with self.assertRaises(ValueError):
+            decode_resend_packet_v2(bytes([RESEND_HEADER_V2]) + bytes(5))
+
+
+class ResendRequestTest(unittest.TestCase):
+    """ SSDVRX produces and receives resend requests in either format """
+
+    def setUp(self):
+        self.packets = encoded_image(callsign="VK5ABC", image_id=3)
+
+
+    def request(self, version, lost):
+        _rx = SSDVRX(defer_decode=True, resend_version=version)
+        for _i, _packet in enumerate(self.packets):
+            if _i not in lost:
+                _rx.addPacket(b'\x00' + _packet)
+
+        _request = _rx.resendRequest(_rx.image_store.get("VK5ABC", 3), "N0CALL")
+        _resp = SSDVRX().addPacket(b'\x00' + _request)
+        self.assertEqual(_resp['type'], 'resend')
+        return _resp['data']
+
+
+    def test_v1(self):
+        _data = self.request(1, {2, 5, 6})
+        self.assertEqual((_data['src_call'], _data['dst_call'], _data['img_id']), ("N0CALL", "VK5ABC", 3))
+        self.assertEqual(_data['missing'], [2, 5, 6])
+
+
+    def test_v2(self):
+        _data = self.request(2, {2, 5, 6})
+        self.assertEqual((_data['src_call'], _data['dst_call'], _data['img_id']), ("N0CALL", "VK5ABC", 3))
+        self.assertEqual(_data['missing'], [2, 5, 6])
+        self.assertEqual(_data['last_packet'], len(self.packets) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from hfssdv.packets import *
+from hfssdv.receive import SSDVRX
+
+from .util import encoded_image
+
+
+class ImageStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        logging.disable(logging.INFO)
+        # The first few packets of each of several images.
+        self.images = [[bytes(_p) for _p in encoded_image(64, 48, seed=_i, callsign="VK5ABC", image_id=_i)[:3]]
+            for _i in range(5)]
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.dir)
+
+
+    def receive(self, rx, image, now=1000.0, packets=None):
+        for _packet in self.images[image][:packets]:
+            rx.addPacket(b'\x00' + _packet, timestamp=now)
+
+
+    def test_max_images(self):
+        _rx = SSDVRX(max_images=3, archive_dir=self.dir, defer_decode=True)
+        for _i in range(5):
+            self.receive(_rx, _i)
+
+        _store = _rx.image_store
+        self.assertEqual(list(_store.keys()), [("VK5ABC", _i, 0) for _i in (2, 3, 4)])
+        self.assertEqual(_store.evicted, 2)
+        self.assertEqual(_store.bytes, sum(_image.nbytes for _image in _store))
+
+        # Evicted images are archived, in packet order.
+        _archived = sorted(os.listdir(self.dir))
+        self.assertEqual(len(_archived), 2)
+        with open(os.path.join(self.dir, _archived[0]), 'rb') as _f:
+            self.assertEqual(_f.read(), b''.join(self.images[0]))
+
+
+    def test_least_recently_updated_evicted(self):
+        _rx = SSDVRX(max_images=3, defer_decode=True)
+        self.receive(_rx, 0, packets=2)
+        self.receive(_rx, 1)
+        self.receive(_rx, 2)
+        # Image 0 is updated, so image 1 is now the oldest.
+        _rx.addPacket(b'\x00' + self.images[0][2], timestamp=1000.0)
+        self.receive(_rx, 3)
+
+        self.assertEqual(sorted(_key[1] for _key in _rx.image_store.keys()), [0, 2, 3])
+
+
+    def test_max_bytes(self):
+        _rx = SSDVRX(max_images=None, max_bytes=1, defer_decode=True)
+        for _i in range(3):
+            self.receive(_rx, _i)
+        # The newest image is always kept.
+        self.assertEqual(list(_rx.image_store.keys()), [("VK5ABC", 2, 0)])
+
+
+    def test_max_age(self):
+        _rx = SSDVRX(max_age=60, defer_decode=True)
+        self.receive(_rx, 0, now=1000.0)
+        self.receive(_rx, 1, now=1030.0)
+        self.receive(_rx, 2, now=1080.0)
+        self.assertEqual(sorted(_key[1] for _key in _rx.image_store.keys()), [1, 2])
+
+
+    def test_epoch_after_timeout(self):
+        _rx = SSDVRX(epoch_timeout=100, defer_decode=True)
+        self.receive(_rx, 0, now=1000.0)
+        self.receive(_rx, 0, now=1050.0)
+        self.assertEqual(list(_rx.image_store.keys()), [("VK5ABC", 0, 0)])
+
+        # The image ID has wrapped around - the same ID, long after, is a new image.
+        self.receive(_rx, 0, now=1500.0)
+        self.assertEqual(list(_rx.image_store.keys()), [("VK5ABC", 0, 0), ("VK5ABC", 0, 1)])
+        self.assertEqual(_rx.image_store.get("VK5ABC", 0).epoch, 1)
+        self.assertEqual(len(_rx.image_store.get("VK5ABC", 0, epoch=0)), 3)
+
+
+    def test_epoch_on_new_geometry(self):
+        _rx = SSDVRX(defer_decode=True)
+        self.receive(_rx, 0)
+        _rx.addPacket(b'\x00' + bytes(encoded_image(96, 48, callsign="VK5ABC", image_id=0)[0]), timestamp=1001.0)
+
+        _image = _rx.image_store.get("VK5ABC", 0)
+        self.assertEqual((_image.epoch, _image.width), (1, 96))
+
+
+    def test_import_packets(self):
+        _rx = SSDVRX(defer_decode=True)
+        _data = b''.join(self.images[0] + self.images[1])
+        self.assertEqual(_rx.importPackets(_data + bytes(SSDV_PACKET_SIZE), timestamp=1000.0), 6)
+        self.assertEqual(sorted(_key[1] for _key in _rx.image_store.keys()), [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from hfssdv.batch import BatchLoader
+from hfssdv.encoder import encode_image
+from hfssdv.fec import ssdv_set_image_id, ssdv_verify_packet
+from hfssdv.txcache import *
+from hfssdv.transmit import SSDVTX
+
+from .util import synthetic_image
+
+
+class PacketCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.ERROR)
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.files = []
+        for _seed in range(2):
+            self.files.append(os.path.join(self.dir, f"image{_seed}.png"))
+            synthetic_image(160, 128, seed=_seed + 1).save(self.files[-1])
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.dir)
+
+
+    def index_files(self):
+        return sorted(_name for _name in os.listdir(self.cache_dir) if _name.endswith(INDEX_SUFFIX))
+
+
+    def test_set_image_id(self):
+        _image = synthetic_image(160, 128)
+        for _fec in (False, True):
+            with self.subTest(fec=_fec):
+                _packets = encode_image(_image, image_id=3, fec=_fec)
+                _expected = encode_image(_image, image_id=200, fec=_fec)
+                _renumbered = [ssdv_set_image_id(_packet, 200) for _packet in _packets]
+                self.assertEqual(_renumbered, _expected)
+                for _packet in _renumbered:
+                    self.assertEqual(ssdv_verify_packet(_packet), (_packet, 0))
+
+
+    def test_cache_key(self):
+        _digest = file_digest(self.files[0])
+        self.assertEqual(cache_key(_digest, "N0CALL", 4), cache_key(_digest, "N0CALL", 4))
+        self.assertNotEqual(cache_key(_digest, "N0CALL", 4), cache_key(_digest, "N0CALL", 5))
+        self.assertNotEqual(cache_key(_digest, "N0CALL", 4), cache_key(_digest, "VK5ABC", 4))
+        self.assertNotEqual(cache_key(_digest, "N0CALL", 4), cache_key(_digest, "N0CALL", 4, fec=True))
+        self.assertNotEqual(cache_key(_digest, "N0CALL", 4), cache_key(file_digest(self.files[1]), "N0CALL", 4))
+
+
+    def test_repeated_loads(self):
+        """ Loading the same file again is a cache hit, renumbered to its new image ID """
+        _tx = SSDVTX(cache=PacketCache(self.cache_dir))
+        _reference = SSDVTX()
+        for _i in range(3):
+            _status = _tx.load_new_image(self.files[0], callsign="VK5ABC", fec=True)
+            _reference.load_new_image(self.files[0], callsign="VK5ABC", fec=True)
+            self.assertEqual(_status.endswith("(cached)"), _i > 0)
+            self.assertEqual(_tx.image_store[_i]['packets'], _reference.image_store[_i]['packets'])
+
+        self.assertEqual((_tx.cache.hits, _tx.cache.misses), (2, 1))
+        self.assertEqual(len(_tx.cache), 1)
+
+
+    def test_restore(self):
+        """ Images can be restored after a restart, to answer resend requests """
+        _tx = SSDVTX(cache=PacketCache(self.cache_dir))
+        for _filename in self.files + self.files[:1]:
+            _tx.load_new_image(_filename, callsign="VK5ABC")
+        self.assertEqual(len(self.index_files()), 3)
+
+        _restarted = SSDVTX(cache=PacketCache(self.cache_dir))
+        for _image_id in range(3):
+            self.assertTrue(_restarted.restore_image(_image_id, "VK5ABC"))
+            self.assertEqual(_restarted.image_store[_image_id]['packets'], _tx.image_store[_image_id]['packets'])
+        self.assertFalse(_restarted.restore_image(3, "VK5ABC"))
+        self.assertFalse(_restarted.restore_image(0, "N0CALL"))
+
+
+    def test_image_id_reused(self):
+        """ Only the image last loaded as an image ID is restored """
+        _tx = SSDVTX(cache=PacketCache(self.cache_dir))
+        _tx.load_new_image(self.files[0], callsign="VK5ABC")
+        _tx.image_id = 0
+        _tx.load_new_image(self.files[1], callsign="VK5ABC")
+        self.assertEqual(len(self.index_files()), 1)
+
+        _cache = PacketCache(self.cache_dir)
+        self.assertEqual(_cache.latest("VK5ABC", 0)['packets'], _tx.image_store[0]['packets'])
+
+
+    def test_eviction(self):
+        _tx = SSDVTX(cache=PacketCache(self.cache_dir))
+        _tx.load_new_image(self.files[0], callsign="VK5ABC")
+        _size = _tx.cache.size
+        time.sleep(0.01)
+        _tx.load_new_image(self.files[0], callsign="VK5ABC")
+
+        # Room for one image - the least recently used one goes, along with its index files.
+        _tx.cache.max_bytes = int(_size * 1.5)
+        _tx.load_new_image(self.files[1], callsign="VK5ABC")
+        self.assertEqual(len(_tx.cache), 1)
+        self.assertEqual(self.index_files(), [f"VK5ABC_2_{_key}{INDEX_SUFFIX}" for _key in _tx.cache._entries])
+        self.assertIsNone(_tx.cache.latest("VK5ABC", 0))
+        self.assertIsNotNone(_tx.cache.latest("VK5ABC", 2))
+
+
+    def test_batch(self):
+        _tx = SSDVTX(cache=PacketCache(self.cache_dir))
+        _loader = BatchLoader(_tx, callsign="VK5ABC", processes=1)
+        try:
+            # Encoded and cached, then loaded again from the cache.
+            _ids = []
+            for _round in range(2):
+                _ids += _loader.load(self.files)
+                for _filename in self.files:
+                    _tx.ready_queue.get(timeout=60)
+        finally:
+            _loader.stop()
+
+        self.assertEqual(_ids, [0, 1, 2, 3])
+        self.assertEqual((_tx.cache.hits, _tx.cache.misses), (2, 2))
+        for _image_id in (2, 3):
+            self.assertEqual(_tx.image_store[_image_id]['packets'],
+                [ssdv_set_image_id(_packet, _image_id) for _packet in _tx.image_store[_image_id - 2]['packets']])
+
+
+    def test_batch_status(self):
+        # Cached images are delivered, and their status reported, off the caller's thread and outside the lock.
+        _calls = queue.Queue()
+        _tx = SSDVTX(cache=PacketCache(self.cache_dir))
+        _loader = BatchLoader(_tx, callsign="VK5ABC", processes=1,
+            status_callback=lambda _text: _calls.put((threading.current_thread(), _loader._lock.locked(), _text)))
+        try:
+            for _round in range(2):
+                _loader.load(self.files)
+                for _filename in self.files:
+                    _thread, _locked, _text = _calls.get(timeout=60)
+                    self.assertIsNot(_thread, threading.main_thread())
+                    self.assertFalse(_locked)
+        finally:
+            _loader.stop()
+
+        self.assertEqual(_tx.cache.hits, 2)
+        self.assertTrue(_text.endswith("(4/4)"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+#
+#   Test Helpers
+#
+#   Synthetic test images and packets, and access to the scripts in
+#   benchmarks/ (which is not a package), for the unit tests.
+#
+
+import glob
+import importlib
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from hfssdv.packets import SSDV_CRC_SIZE, SSDV_HEADER_SIZE, SSDV_PAYLOAD_FEC
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(ROOT_DIR, 'benchmarks')
+SRC_DIR = os.path.join(ROOT_DIR, 'src')
+
+# Packets encoded by the reference ssdv binary (<name>.bin), and its decode of them (<name>.png).
+SSDV_FIXTURE_DIR = os.path.join(ROOT_DIR, 'tests', 'data', 'ssdv')
+
+# Reference fixtures, as (name, PIL JPEG subsampling) - 4:2:0, 4:2:2 and 4:4:4, SSDV MCU modes 0, 2 and 3.
+SSDV_FIXTURES = [('mode0', 2), ('mode2', 1), ('mode3', 0)]
+
+# End of the bytes covered by the CRC in a FEC packet. Errors in the RS parity after it don't matter.
+FEC_CRC_END = SSDV_HEADER_SIZE + SSDV_PAYLOAD_FEC + SSDV_CRC_SIZE
+
+
+def load_benchmark(name):
+    """ Import a script from benchmarks/ as a module """
+    # The scripts import each other, so they need to be on the path.
+    if BENCHMARK_DIR not in sys.path:
+        sys.path.insert(0, BENCHMARK_DIR)
+    return importlib.import_module(name)
+
+
+def python_env():
+    """ Environment for a fresh interpreter, with src/ on its path """
+    _env = dict(os.environ)
+    _env['PYTHONPATH'] = os.pathsep.join([SRC_DIR] + ([_env['PYTHONPATH']] if _env.get('PYTHONPATH') else []))
+    return _env
+
+
+def run_benchmark(name, *args, timeout=600):
+    """ Run a script from benchmarks/ in a fresh interpreter.
+
+        Returns:
+            subprocess.CompletedProcess: With the script's combined output in stdout.
+    """
+    return subprocess.run(
+        [sys.executable, os.path.join(BENCHMARK_DIR, name + '.py')] + [str(_arg) for _arg in args],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, env=python_env(), timeout=timeout
+    )
+
+
+def synthetic_image(width, height, seed=1):
+    """ A test image with gradients, shapes and some noise, as used by the benchmarks """
+    return load_benchmark('bench_replay').synthetic_image(width, height, seed)
+
+
+def encoded_image(width=160, height=128, seed=1, **kwargs):
+    """ SSDV packets for a synthetic image. kwargs are passed to encode_image. """
+    from hfssdv.encoder import encode_image
+    return encode_image(synthetic_image(width, height, seed), **kwargs)
+
+
+def find_ssdv():
+    """ Path to the reference ssdv binary, from $SSDV or the path, or None if it is not installed """
+    return os.environ.get('SSDV') or shutil.which('ssdv')
+
+
+def ssdv_reference(ssdv_path, image, subsampling, callsign="N0CALL", image_id=0):
+    """ Encode an image with the reference ssdv binary (ssdv -e), and decode it again (ssdv -d).
+
+        Returns:
+            tuple: (list of 256-byte SSDV packets, decoded PIL Image)
+    """
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as _workdir:
+        _source = os.path.join(_workdir, 'source.jpg')
+        _packets = os.path.join(_workdir, 'packets.bin')
+        _decoded = os.path.join(_workdir, 'decoded.jpg')
+
+        image.convert('RGB').save(_source, 'JPEG', quality=90, subsampling=subsampling)
+        subprocess.run([ssdv_path, '-e', '-c', callsign, '-i', str(image_id), _source, _packets],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run([ssdv_path, '-d', _packets, _decoded],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        with open(_packets, 'rb') as _f:
+            _data = _f.read()
+        with Image.open(_decoded) as _img:
+            _img.load()
+            return ([_data[_i:_i + 256] for _i in range(0, len(_data) - 255, 256)], _img.convert('RGB'))
+
+
+def ssdv_fixtures():
+    """ Reference fixtures in SSDV_FIXTURE_DIR, as (name, packets, PIL Image decoded by ssdv -d) """
+    from PIL import Image
+
+    _fixtures = []
+    for _filename in sorted(glob.glob(os.path.join(SSDV_FIXTURE_DIR, '*.bin'))):
+        _name = os.path.splitext(_filename)[0]
+        with open(_filename, 'rb') as _f:
+            _data = _f.read()
+        with Image.open(_name + '.png') as _img:
+            _img.load()
+            _fixtures.append((os.path.basename(_name), [_data[_i:_i + 256] for _i in range(0, len(_data) - 255, 256)],
+                _img.convert('RGB')))
+    return _fixtures
+
+
+def write_ssdv_fixtures(ssdv_path=None):
+    """ Produce the reference fixtures with the ssdv binary. Run by 'make ssdv-fixtures'. """
+    _ssdv = ssdv_path or find_ssdv()
+    if not _ssdv:
+        raise RuntimeError("The ssdv binary was not found - install it, or set $SSDV.")
+
+    os.makedirs(SSDV_FIXTURE_DIR, exist_ok=True)
+    for _name, _subsampling in SSDV_FIXTURES:
+        _packets, _decoded = ssdv_reference(_ssdv, synthetic_image(160, 128), _subsampling)
+        with open(os.path.join(SSDV_FIXTURE_DIR, _name + '.bin'), 'wb') as _f:
+            _f.write(b''.join(_packets))
+        _decoded.save(os.path.join(SSDV_FIXTURE_DIR, _name + '.png'))
+
+
+def corrupt(packet, count, seed=1, start=2, end=FEC_CRC_END):
+    """ Change count bytes of a packet, between bytes start and end """
+    _random = random.Random(seed)
+    _packet = bytearray(packet)
+    for _offset in _random.sample(range(start, end), count):
+        _packet[_offset] ^= _random.randrange(1, 256)
+    return bytes(_packet)